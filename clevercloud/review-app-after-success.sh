@@ -17,3 +17,9 @@ PGPASSWORD=$POSTGRESQL_ADDON_PASSWORD pg_restore -d $POSTGRESQL_ADDON_DB -h $POS
 # does not have execution rights on the $APP_HOME directory.
 echo "Loading fixtures"
 ls -d $APP_HOME/itou/fixtures/django/* | xargs django-admin loaddata
+
+# Fixtures are loaded without signals.
+echo "Refreshing siaes search index"
+django-admin refresh_siae_search_index
+echo "Syncing the sequence of PASS IAE numbers"
+django-admin sync_approval_number_sequence
@@ -345,6 +345,10 @@ BOOTSTRAP4 = {
 # Base Adresse Nationale (BAN).
 # https://adresse.data.gouv.fr/faq
 API_BAN_BASE_URL = "https://api-adresse.data.gouv.fr"
+# Geocoding results are kept in database, see `itou.utils.apis.geocoding`.
+API_BAN_CACHE_TTL_DAYS = int(os.getenv("API_BAN_CACHE_TTL_DAYS", 180))
+# Addresses which could not be geocoded are retried sooner.
+API_BAN_CACHE_NEGATIVE_TTL_DAYS = int(os.getenv("API_BAN_CACHE_NEGATIVE_TTL_DAYS", 7))
 
 # https://api.gouv.fr/api/api-geo.html#doc_tech
 API_GEO_BASE_URL = "https://geo.api.gouv.fr"
@@ -356,6 +360,8 @@ API_ENTREPRISE_BASE_URL = "https://entreprise.api.gouv.fr/v2"
 API_ENTREPRISE_CONTEXT = "emplois.inclusion.beta.gouv.fr"
 API_ENTREPRISE_RECIPIENT = os.environ.get("API_ENTREPRISE_RECIPIENT")
 API_ENTREPRISE_TOKEN = os.environ.get("API_ENTREPRISE_TOKEN")
+# Published rate limit of API Entreprise, per IP address.
+API_ENTREPRISE_RATE_LIMIT_PER_MINUTE = int(os.getenv("API_ENTREPRISE_RATE_LIMIT_PER_MINUTE", 250))
 
 # Pôle emploi's Emploi Store Dev aka ESD. There is a production AND a recette environment:
 #  - Production: https://www.pole-emploi.io
@@ -378,6 +384,8 @@ API_ESD_BASE_URL = os.environ.get("API_ESD_BASE_URL", "https://api.emploi-store.
 # the values can be: sandbox|production
 API_ESD_MISE_A_JOUR_PASS_MODE = os.environ.get("API_ESD_MISE_A_JOUR_PASS_MODE", "sandbox")
 API_ESD_SHOULD_PERFORM_MISE_A_JOUR_PASS = os.environ.get("API_ESD_SHOULD_PERFORM_MISE_A_JOUR_PASS", "False") == "True"
+# Requests per second allowed by the recherche individu and mise à jour APIs.
+API_ESD_RATE_LIMIT_PER_SECOND = int(os.getenv("API_ESD_RATE_LIMIT_PER_SECOND", 3))
 
 
 # PE Connect aka PEAMU - technically one of ESD's APIs.
@@ -527,6 +535,17 @@ METABASE_SHOW_SQL_REQUESTS = False
 # by batch of 1000 => 5s
 METABASE_INSERT_BATCH_SIZE = 100
 
+# Set how many tables are populated at the same time by `populate_metabase_itou`, each in its own process.
+# Every process hydrates its own chunks of objects: RAM usage grows with this number.
+METABASE_POPULATE_MAX_WORKERS = int(os.environ.get("METABASE_POPULATE_MAX_WORKERS", 4))
+
+# Set how many anonymized ids are memoized by each process of `populate_metabase_itou`.
+# A hash takes roughly 200 bytes of RAM with its key.
+METABASE_ANONYMIZATION_CACHE_SIZE = int(os.environ.get("METABASE_ANONYMIZATION_CACHE_SIZE", 500_000))
+
+# Approximate peak memory use, in bytes, of `populate_metabase_fluxiae` while streaming fluxIAE exports to metabase.
+METABASE_FLUXIAE_MEMORY_BUDGET = int(os.environ.get("METABASE_FLUXIAE_MEMORY_BUDGET", 512 * 1024 * 1024))
+
 # Embedding signed Metabase dashboard
 METABASE_SITE_URL = "https://stats.inclusion.beta.gouv.fr"
 METABASE_SECRET_KEY = os.environ.get("METABASE_SECRET_KEY", "")
@@ -564,6 +583,11 @@ SLACK_CRON_WEBHOOK_URL = os.environ.get("SLACK_CRON_WEBHOOK_URL", None)
 REDIS_DB = os.environ.get("REDIS_DB", 1)
 # Complete URL (containing the instance password)
 REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379")
+# Redis database of the caches (siaes API, ASP referentials), apart from the Huey queue
+# (must be different from REDIS_DB and for each environment). Memory limits apply to the whole Redis instance
+# though: its maxmemory policy must be `volatile-lru`, so that only keys with an expiry (e.g. cached responses)
+# are evicted, never the Huey queue.
+REDIS_CACHE_DB = os.environ.get("REDIS_CACHE_DB", 2)
 
 # Huey instance
 # If any performance issue, increasing the number of workers *can* be a good idea
@@ -580,6 +604,32 @@ HUEY = {
     "immediate": False,
 }
 
+# Cache.
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# ------------------------------------------------------------------------------
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Responses of the public siaes API, shared by all instances.
+    # See `itou.api.siae_api.cache`.
+    "siae_api": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_URL + f"/?db={REDIS_CACHE_DB}",
+        "KEY_PREFIX": "siae_api",
+        "TIMEOUT": 60 * 60,
+    },
+    # Version of the ASP referentials kept in memory by each process.
+    # See `itou.asp.cache`.
+    "asp_referentials": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_URL + f"/?db={REDIS_CACHE_DB}",
+        "KEY_PREFIX": "asp_referentials",
+        "TIMEOUT": None,
+    },
+}
+
 # Email.
 # https://anymail.readthedocs.io/en/stable/esps/mailjet/
 # ------------------------------------------------------------------------------
@@ -660,6 +710,12 @@ ASP_FS_KNOWN_HOSTS = os.getenv("ASP_FS_KNOWN_HOSTS")
 ASP_FS_REMOTE_UPLOAD_DIR = "depot"
 # SFTP path: Where to get submitted employee records validation feedback
 ASP_FS_REMOTE_DOWNLOAD_DIR = "retrait"
+# Max number of SFTP connections used to download feedback files in parallel
+ASP_FS_SFTP_POOL_SIZE = int(os.getenv("ASP_FS_SFTP_POOL_SIZE", 4))
+# Local path: Where feedback files are kept until they are processed
+ASP_FS_LOCAL_SPOOL_DIR = os.getenv("ASP_FS_LOCAL_SPOOL_DIR", f"{IMPORT_DIR}/asp_fs_spool")
+# Serve lookups of ASP referentials (communes, countries...) from memory, see `itou.asp.cache`
+ASP_REFERENTIALS_CACHE_ENABLED = True
 
 # S3 uploads
 # ------------------------------------------------------------------------------
@@ -29,6 +29,23 @@ RELEASE_STATS_SIAE = True
 
 ASP_FS_KNOWN_HOSTS = None
 
+# No Redis server in unit tests.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "siae_api": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+    },
+    "asp_referentials": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "asp_referentials",
+    },
+}
+
+# Referentials created by a test are rolled back without any signal: a process-wide cache would outlive them.
+ASP_REFERENTIALS_CACHE_ENABLED = False
+
 # Employee record production deployment
 EMPLOYEE_RECORD_FEATURE_AVAILABILITY_DATE = timezone.datetime(2021, 1, 1, tzinfo=timezone.utc)
 # Allow for testing
@@ -43,3 +60,5 @@ AI_EMPLOYEES_STOCK_DEVELOPER_EMAIL = "colette@ratatouille.com"
 # We enable the notifications in the test environment so that can ensure the correct API calls are performed,
 # but those calls are mocked so that no real data is sent to Pole Emploi
 API_ESD_SHOULD_PERFORM_MISE_A_JOUR_PASS = True
+# Calls to PE's APIs are mocked: don't wait for the rate limiter.
+API_ESD_RATE_LIMIT_PER_SECOND = 1000
@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+
+
+class ApiConfig(AppConfig):
+    name = "itou.api"
+    verbose_name = "API"
+
+    def ready(self):
+        """
+        When the app is loaded:
+        activate the signals invalidating the response cache of the siaes API
+        """
+        import itou.api.siae_api.signals  # noqa F401
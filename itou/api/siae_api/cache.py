@@ -0,0 +1,92 @@
+"""
+Response cache of the public siaes API.
+
+Partner crawlers query the same cities over and over. Responses are cached by query parameters,
+each cached response being tagged with the versions of the departments of the area it covers.
+Saving a siae or one of its job descriptions bumps the version of its department (see `signals.py`),
+which makes every cached response covering this department stale at once.
+
+The area of a response is approximated by the departments of the cities located within the search radius
+(and the department of the searched city itself). A siae in another department could still be returned,
+in which case its changes are only visible once the cached response expires (see the `TIMEOUT` of the cache).
+
+Responses are served uncached while Redis is unavailable (see `viewsets.py`).
+"""
+import hashlib
+import logging
+import uuid
+
+from django.contrib.gis.measure import D
+from django.core.cache import caches
+from redis.exceptions import RedisError
+from rest_framework.renderers import JSONRenderer
+
+from itou.cities.models import City
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = "siae_api"
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def get_department_version_key(department):
+    return f"department_version:{department}"
+
+
+def bump_department_version(department):
+    try:
+        get_cache().set(get_department_version_key(department), uuid.uuid4().hex, timeout=None)
+    except RedisError:
+        # Cached responses of this department expire on their own.
+        logger.exception("Could not bump the siaes API cache version of department %s", department)
+
+
+def get_area_departments(code_insee, distance_km):
+    """
+    Return the departments covered by a search, or None if the city does not exist.
+    """
+    cache = get_cache()
+    key = f"area_departments:{code_insee}:{distance_km}"
+    departments = cache.get(key)
+    if departments is None:
+        city = City.objects.filter(code_insee=code_insee).first()
+        if not city:
+            return None
+        departments = set(
+            City.objects.filter(coords__dwithin=(city.coords, D(km=distance_km))).values_list("department", flat=True)
+        )
+        departments = sorted(departments | {city.department})
+        # Cities hardly ever move.
+        cache.set(key, departments, timeout=None)
+    return departments
+
+
+def get_area_version(departments):
+    cache = get_cache()
+    keys = [get_department_version_key(department) for department in departments]
+    for key in set(keys) - set(cache.get_many(keys)):
+        # `add` does not override a version set meanwhile by another process.
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+    versions = cache.get_many(keys)
+    return hashlib.md5("".join(versions.get(key, "") for key in keys).encode()).hexdigest()
+
+
+def get_response_cache_key(code_insee, distance_km, query_params):
+    """
+    Return the key of the cached response, or None if the response should not be cached.
+    """
+    departments = get_area_departments(code_insee, distance_km)
+    if departments is None:
+        return None
+    params = "&".join(f"{name}={value}" for name, value in sorted(query_params.items()))
+    params_digest = hashlib.md5(params.encode()).hexdigest()
+    return f"response:{params_digest}:{get_area_version(departments)}"
+
+
+def get_etag(data):
+    # Weak ETag: the same data is rendered differently by the JSON and the browsable API renderers.
+    return f'W/"{hashlib.md5(JSONRenderer().render(data)).hexdigest()}"'
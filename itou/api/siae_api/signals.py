@@ -0,0 +1,52 @@
+"""
+Invalidate cached responses of the siaes API, see `cache.py`.
+"""
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from itou.api.siae_api.cache import bump_department_version
+from itou.siaes.models import Siae, SiaeJobDescription
+
+
+def bump_department_version_on_commit(department):
+    transaction.on_commit(partial(bump_department_version, department))
+
+
+@receiver(post_save, sender=Siae)
+@receiver(post_delete, sender=Siae)
+def invalidate_siae_area(sender, instance, raw=False, **kwargs):
+    if raw:
+        # Loading fixtures.
+        return
+    bump_department_version_on_commit(instance.department)
+    # A siae moving to another department leaves the responses covering its former department.
+    loaded_department = getattr(instance, "_loaded_department", None)
+    if loaded_department not in (None, instance.department):
+        bump_department_version_on_commit(loaded_department)
+    instance._loaded_department = instance.department
+
+
+@receiver(post_save, sender=SiaeJobDescription)
+@receiver(post_delete, sender=SiaeJobDescription)
+def invalidate_job_description_area(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    department = Siae.objects.filter(pk=instance.siae_id).values_list("department", flat=True).first()
+    if department is not None:
+        bump_department_version_on_commit(department)
+
+
+@receiver(m2m_changed, sender=Siae.jobs.through)
+def invalidate_jobs_area(sender, instance, action, reverse, pk_set, **kwargs):
+    # Job descriptions added with `siae.jobs.add()` are bulk created without `post_save` signals.
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        bump_department_version_on_commit(instance.department)
+        return
+    siaes = Siae.objects.all() if action == "post_clear" else Siae.objects.filter(pk__in=pk_set)
+    for department in siaes.order_by().values_list("department", flat=True).distinct():
+        bump_department_version_on_commit(department)
@@ -1,8 +1,12 @@
 import json
+from unittest import mock
 
+from django.test import override_settings
 from django.urls import reverse
+from redis.exceptions import RedisError
 from rest_framework.test import APIClient, APITestCase
 
+from itou.api.siae_api.cache import bump_department_version, get_cache
 from itou.cities.factories import create_city_guerande, create_city_saint_andre
 from itou.siaes.factories import SiaeFactory, SiaeWithJobsFactory
 from itou.siaes.models import Siae
@@ -90,3 +94,103 @@ class SiaeAPIFetchListTest(APITestCase):
         body = json.loads(response.content)
         self.assertEqual(body["count"], 0)
         self.assertEqual(response.status_code, 200)
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "siae_api": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "siae_api_tests"},
+    }
+)
+class SiaeAPICacheTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        get_cache().clear()
+
+        self.saint_andre = create_city_saint_andre()
+        self.siae = SiaeWithJobsFactory(romes=("N1101",), department="44", coords=self.saint_andre.coords)
+        self.query_params = {"code_insee": self.saint_andre.code_insee, "distance_max_km": 100}
+
+    def test_cached_response(self):
+        response = self.client.get(ENDPOINT_URL, self.query_params, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 1)
+
+        with self.assertNumQueries(0):
+            cached_response = self.client.get(ENDPOINT_URL, self.query_params, format="json")
+        self.assertEqual(cached_response.status_code, 200)
+        self.assertEqual(cached_response.content, response.content)
+        self.assertEqual(cached_response["ETag"], response["ETag"])
+
+        # Unknown query parameters do not bypass the cache.
+        with self.assertNumQueries(0):
+            self.client.get(ENDPOINT_URL, {**self.query_params, "foo": "bar"}, format="json")
+
+    def test_etag(self):
+        response = self.client.get(ENDPOINT_URL, self.query_params, format="json")
+        etag = response["ETag"]
+
+        response = self.client.get(ENDPOINT_URL, self.query_params, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        response = self.client.get(ENDPOINT_URL, self.query_params, format="json", HTTP_IF_NONE_MATCH='W/"foo"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_invalidation(self):
+        response = self.client.get(ENDPOINT_URL, self.query_params, format="json")
+        [job_description] = response.json()["results"][0]["postes"]
+        self.assertEqual(job_description["description"], "")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.siae.job_description_through.update(description="Nouvelle description")
+        # `QuerySet.update()` does not send signals.
+        response = self.client.get(ENDPOINT_URL, self.query_params, format="json")
+        [job_description] = response.json()["results"][0]["postes"]
+        self.assertEqual(job_description["description"], "")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for job_description in self.siae.job_description_through.all():
+                job_description.save()
+        response = self.client.get(ENDPOINT_URL, self.query_params, format="json")
+        [job_description] = response.json()["results"][0]["postes"]
+        self.assertEqual(job_description["description"], "Nouvelle description")
+
+    def test_invalidation_when_moving_to_another_department(self):
+        with mock.patch("itou.api.siae_api.signals.bump_department_version") as bump_department_version:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.siae.department = "56"
+                self.siae.save()
+        self.assertCountEqual(
+            [call.args[0] for call in bump_department_version.call_args_list],
+            ["56", "44"],
+        )
+
+        siae = Siae.objects.get(pk=self.siae.pk)
+        with mock.patch("itou.api.siae_api.signals.bump_department_version") as bump_department_version:
+            with self.captureOnCommitCallbacks(execute=True):
+                siae.department = "29"
+                # The former department is known without querying it.
+                with self.assertNumQueries(1):
+                    siae.save(update_fields=["department"])
+        self.assertCountEqual(
+            [call.args[0] for call in bump_department_version.call_args_list],
+            ["29", "56"],
+        )
+
+    def test_cache_unavailable(self):
+        unavailable_cache = mock.Mock(**{"get.side_effect": RedisError, "set.side_effect": RedisError})
+        with mock.patch("itou.api.siae_api.cache.get_cache", return_value=unavailable_cache), mock.patch(
+            "itou.api.siae_api.viewsets.get_cache", return_value=unavailable_cache
+        ):
+            response = self.client.get(ENDPOINT_URL, self.query_params, format="json")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["count"], 1)
+            self.assertNotIn("ETag", response)
+            # Saving a siae still works.
+            bump_department_version("44")
+
+    def test_invalid_parameters_are_not_cached(self):
+        response = self.client.get(ENDPOINT_URL, {"code_insee": 12345, "distance_max_km": 10}, format="json")
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn("ETag", response)
@@ -1,12 +1,16 @@
 import logging
 
+from django.utils.cache import parse_etags
 from django_filters.filters import OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend, FilterSet
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import OpenApiExample, OpenApiParameter, extend_schema
-from rest_framework import viewsets
+from redis.exceptions import RedisError
+from rest_framework import status, viewsets
 from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
 
+from itou.api.siae_api.cache import get_cache, get_etag, get_response_cache_key
 from itou.cities.models import City
 from itou.siaes.models import Siae
 from itou.siaes.serializers import SiaeSerializer
@@ -16,6 +20,15 @@ logger = logging.getLogger("api_drf")
 CODE_INSEE_PARAM_NAME = "code_insee"
 DISTANCE_FROM_CODE_INSEE_PARAM_NAME = "distance_max_km"
 MAX_DISTANCE_RADIUS_KM = 100
+# Query parameters changing the response.
+CACHED_QUERY_PARAM_NAMES = [
+    CODE_INSEE_PARAM_NAME,
+    DISTANCE_FROM_CODE_INSEE_PARAM_NAME,
+    "o",
+    "page",
+    "page_size",
+    "format",
+]
 
 SIAE_ORDERING_FILTER_MAPPING = {
     "block_job_applications": "bloque_candidatures",
@@ -120,24 +133,59 @@ On peut spécifier la direction de tri :
         ],
     )
     def list(self, request):
-        # we need this despite the default behavior because of the documentation annotations
-        return super().list(request)
+        # Tracking is currently done via user-agent header
+        logger.info(
+            "User-Agent: %s",
+            request.headers.get("User-Agent"),
+        )
+
+        try:
+            return self._get_cached_list(request)
+        except RedisError:
+            # The cache must not take the API down with it.
+            logger.exception("Siaes API cache unavailable")
+            return super().list(request)
+
+    def _get_cached_list(self, request):
+        cache_key = self._get_cache_key(request)
+        if cache_key is None:
+            # Invalid parameters: let the usual validation raise the relevant error.
+            return super().list(request)
+
+        cache = get_cache()
+        cached_response = cache.get(cache_key)
+        if cached_response is None:
+            data = super().list(request).data
+            cached_response = {"data": data, "etag": get_etag(data)}
+            cache.set(cache_key, cached_response)
+
+        headers = {"ETag": cached_response["etag"]}
+        if_none_match = parse_etags(request.headers.get("If-None-Match", ""))
+        if cached_response["etag"] in if_none_match or "*" in if_none_match:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(cached_response["data"], headers=headers)
+
+    def _get_cache_key(self, request):
+        params = request.query_params
+        try:
+            distance = int(params.get(DISTANCE_FROM_CODE_INSEE_PARAM_NAME))
+        except (TypeError, ValueError):
+            return None
+        code_insee = params.get(CODE_INSEE_PARAM_NAME)
+        if not code_insee or distance < 0 or distance > MAX_DISTANCE_RADIUS_KM:
+            return None
+        # Other parameters are ignored by the API, don't let them bypass the cache.
+        cached_params = {name: params[name] for name in CACHED_QUERY_PARAM_NAMES if name in params}
+        return get_response_cache_key(code_insee, distance, cached_params)
 
     def get_queryset(self):
         # We only get to this point if permissions are OK
-        queryset = Siae.objects
+        queryset = Siae.objects.prefetch_related("job_description_through__appellation__rome")
 
         # Get (registered) query parameters filters
         queryset = self._filter_by_query_params(self.request, queryset)
 
-        try:
-            return queryset.order_by("id")
-        finally:
-            # Tracking is currently done via user-agent header
-            logger.info(
-                "User-Agent: %s",
-                self.request.headers.get("User-Agent"),
-            )
+        return queryset.order_by("id")
 
     def _filter_by_query_params(self, request, queryset):
         params = request.query_params
@@ -0,0 +1,128 @@
+import datetime
+import random
+import statistics
+import time
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from itou.approvals.models import PoleEmploiApproval
+
+
+NUMBER_PREFIX = "BENCH"
+FIRST_BIRTHDATE = datetime.date(1960, 1, 1)
+BIRTHDATES_COUNT = 15_000
+
+
+def get_pole_emploi_id(i):
+    # Spread ids over the whole range instead of generating them in order.
+    return f"{i * 7919 % 100_000_000:08d}"
+
+
+def get_birthdate(i):
+    return FIRST_BIRTHDATE + datetime.timedelta(days=i % BIRTHDATES_COUNT)
+
+
+def get_number(i):
+    return f"{NUMBER_PREFIX}{i:07d}"
+
+
+def lookup_for_user(i):
+    user = SimpleNamespace(pole_emploi_id=get_pole_emploi_id(i), birthdate=get_birthdate(i))
+    return PoleEmploiApproval.objects.find_for(user)
+
+
+def lookup_for_number(i):
+    return PoleEmploiApproval.objects.find_for_number(get_number(i))
+
+
+LOOKUPS = {
+    "find_for": lookup_for_user,
+    "find_for_number": lookup_for_number,
+}
+
+
+class Command(BaseCommand):
+    """
+    Measure the latency of `PoleEmploiApproval` lookups on a generated dataset.
+
+    Rows are generated in a transaction which is rolled back at the end, nothing is left in the database.
+    The command fails if a lookup is not served by an index, so that a missing index is caught
+    before reaching production where the table holds millions of rows.
+
+    To run the benchmark on 5M rows:
+        django-admin benchmark_pe_approval_lookups --rows=5000000
+    """
+
+    help = "Benchmark PoleEmploiApproval lookups on a generated dataset."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", dest="rows", type=int, default=5_000_000, help="Size of the generated dataset")
+        parser.add_argument("--lookups", dest="lookups", type=int, default=1000, help="Number of lookups to measure")
+
+    def generate_rows(self, rows):
+        self.stdout.write(f"Generating {rows} rows...")
+        table_name = PoleEmploiApproval._meta.db_table
+        # Way faster than `bulk_create` for millions of rows.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table_name}
+                    (pe_structure_code, number, pole_emploi_id, first_name, last_name, birth_name, birthdate,
+                    start_at, end_at, created_at)
+                SELECT
+                    '00000',
+                    %(prefix)s || lpad(i::text, 7, '0'),
+                    lpad((i::bigint * 7919 %% 100000000)::text, 8, '0'),
+                    'PRENOM',
+                    'NOM',
+                    'NOM',
+                    %(first_birthdate)s::date + i %% %(birthdates_count)s,
+                    date '2018-01-01' + i %% 1500,
+                    date '2020-01-01' + i %% 1500,
+                    now()
+                FROM generate_series(0, %(rows)s - 1) AS i
+                """,
+                {
+                    "prefix": NUMBER_PREFIX,
+                    "first_birthdate": FIRST_BIRTHDATE,
+                    "birthdates_count": BIRTHDATES_COUNT,
+                    "rows": rows,
+                },
+            )
+            # Up to date statistics, as after an import.
+            cursor.execute(f"ANALYZE {table_name}")
+
+    def handle(self, rows, lookups, **options):
+        if settings.ITOU_ENVIRONMENT == "PROD":
+            raise CommandError("This benchmark must not run in production.")
+
+        missing_indexes = []
+
+        with transaction.atomic():
+            self.generate_rows(rows)
+
+            for name, lookup in LOOKUPS.items():
+                plan = lookup(0).explain()
+                if "Seq Scan" in plan:
+                    missing_indexes.append(name)
+                    self.stderr.write(f"{name} is not served by an index:\n{plan}")
+
+                durations = []
+                for i in random.sample(range(rows), min(lookups, rows)):
+                    start = time.perf_counter()
+                    results = list(lookup(i))
+                    durations.append(time.perf_counter() - start)
+                    assert len(results) == 1
+
+                # Both percentiles need at least 2 measures.
+                quantiles = statistics.quantiles(durations, n=100) if len(durations) > 1 else durations * 99
+                p50, p99 = quantiles[49] * 1000, quantiles[98] * 1000
+                self.stdout.write(f"{name:>16} | {rows:>9} rows | p50 {p50:8.2f} ms | p99 {p99:8.2f} ms")
+
+            transaction.set_rollback(True)
+
+        if missing_indexes:
+            raise CommandError(f"Lookups not served by an index: {', '.join(missing_indexes)}")
@@ -1,19 +1,40 @@
 import datetime
+import io
 import logging
 import os
 
 import pandas as pd
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
 from django.utils import timezone
-from tqdm import tqdm
 
 from itou.approvals.models import PoleEmploiApproval
 
 
+# Columns of `PoleEmploiApproval` filled from the XLSX file, in the order of the staging table.
+COLUMNS = {
+    "CODE_STRUCT_AFFECT_BENE": "pe_structure_code",
+    "ID_REGIONAL_BENE": "pole_emploi_id",
+    "NUM_AGR_DEC": "number",
+    "PRENOM_BENE": "first_name",
+    "NOM_USAGE_BENE": "last_name",
+    "NOM_NAISS_BENE": "birth_name",
+    "DATE_NAISS_BENE": "birthdate",
+    "DATE_DEB": "start_at",
+    "DATE_FIN": "end_at",
+}
+
+
 class Command(BaseCommand):
     """
     Import Pole emploi's approvals (or `agrément` in French) into the database.
 
+    Rows are validated column by column, rejected rows are written to a CSV file in `settings.EXPORT_DIR`
+    along with the reason of their rejection.
+    Valid rows are copied into a staging table and then merged: approvals already known (same number)
+    are left untouched.
+
     To debug:
         django-admin import_pe_approvals --file-path=/tmp/2020_02_12_base_agrements_aura.xlsx --dry-run
         django-admin import_pe_approvals --file-path=/tmp/2020_02_12_base_agrements_aura.xlsx --dry-run --verbosity=2
@@ -29,6 +50,8 @@ class Command(BaseCommand):
     # Otherwise it would be too easy.
     FALLBACK_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
+    STAGING_TABLE_NAME = "pe_approvals_import"
+
     def add_arguments(self, parser):
         parser.add_argument(
             "--file-path",
@@ -53,144 +76,156 @@ class Command(BaseCommand):
         if verbosity > 1:
             self.logger.setLevel(logging.DEBUG)
 
-    def parse_date(self, value):
+    def parse_dates(self, values):
         """
         In some of the XLS files provided, there are find two date formats.
+        Values matching none of them are returned as `NaT`.
         """
-        value = str(value).strip()
-        try:
-            return datetime.datetime.strptime(value, self.DATE_FORMAT).date()
-        except ValueError:
-            return datetime.datetime.strptime(value, self.FALLBACK_DATE_FORMAT).date()
+        values = values.astype(str).str.strip()
+        dates = pd.to_datetime(values, format=self.DATE_FORMAT, errors="coerce")
+        return dates.fillna(pd.to_datetime(values, format=self.FALLBACK_DATE_FORMAT, errors="coerce"))
+
+    def clean(self, df):
+        """
+        Validate and format the rows of the XLSX file.
+
+        Return a dataframe of valid approvals (with `PoleEmploiApproval` column names),
+        a dataframe of rejected rows (with a `REJECTION_REASON` column), the number of canceled approvals
+        and the number of approvals by unique suffix.
+        """
+        raw_df, df = df, df.copy()
+        rejection_reasons = pd.Series(None, index=df.index, dtype=object)
+
+        def reject(mask, reason):
+            # Only keep the first reason of a row.
+            rejection_reasons.loc[mask & rejection_reasons.isna()] = reason
+
+        df["CODE_STRUCT_AFFECT_BENE"] = df["CODE_STRUCT_AFFECT_BENE"].astype(str)
+        reject(~df["CODE_STRUCT_AFFECT_BENE"].str.len().isin([4, 5]), "Invalid CODE_STRUCT_AFFECT_BENE")
+
+        # This is known as "Identifiant Pôle emploi".
+        # First 7 chars should be digits, last char should be alphanumeric.
+        df["ID_REGIONAL_BENE"] = df["ID_REGIONAL_BENE"].astype(str).str.strip()
+        reject(
+            (df["ID_REGIONAL_BENE"].str.len() != 8)
+            | ~df["ID_REGIONAL_BENE"].str[:7].str.isdigit()
+            | ~df["ID_REGIONAL_BENE"].str[7:].str.isalnum(),
+            "Invalid ID_REGIONAL_BENE",
+        )
+
+        for column in ["NOM_USAGE_BENE", "PRENOM_BENE", "NOM_NAISS_BENE"]:
+            df[column] = df[column].str.strip()
+            is_invalid = df[column].isna() | (df[column] == "") | df[column].str.contains("  ", na=False)
+            reject(is_invalid, f"Invalid {column}")
+
+        df["NUM_AGR_DEC"] = df["NUM_AGR_DEC"].str.strip().str.replace(" ", "", regex=False)
+        reject(~df["NUM_AGR_DEC"].str.len().isin([12, 15]), "Invalid NUM_AGR_DEC")
+
+        for column in ["DATE_DEB", "DATE_FIN", "DATE_NAISS_BENE"]:
+            df[column] = self.parse_dates(df[column])
+            reject(df[column].isna(), f"Invalid {column}")
+
+        # Rows are reported as they appear in the XLSX file.
+        rejected_df = raw_df[rejection_reasons.notna()].assign(REJECTION_REASON=rejection_reasons)
+        df = df[rejection_reasons.isna()]
+
+        # Same start and end dates means that the approval has been canceled.
+        is_canceled = df["DATE_DEB"] == df["DATE_FIN"]
+        count_canceled_approvals = int(is_canceled.sum())
+        df = df[~is_canceled]
+
+        # Keep track of unique suffixes added by PE at the end of a 12 chars number
+        # that increases the length to 15 chars.
+        numbers = df["NUM_AGR_DEC"]
+        unique_approval_suffixes = numbers[numbers.str.len() > 12].str[12:].value_counts().to_dict()
+
+        # Pôle emploi sends us the year in a two-digit format ("14/03/68")
+        # but strptime() will set it in the future:
+        # >>> datetime.datetime.strptime("14/03/68", "%d/%m/%y").date()
+        # datetime.date(2068, 3, 14)
+        birthdates = df["DATE_NAISS_BENE"].copy()
+        in_future = birthdates.dt.year > timezone.now().year
+        if in_future.any():
+            future = birthdates[in_future]
+            birthdates[in_future] = pd.to_datetime(
+                {"year": future.dt.year - 100, "month": future.dt.month, "day": future.dt.day}
+            )
+
+        df = df.assign(DATE_NAISS_BENE=birthdates)[list(COLUMNS)].rename(columns=COLUMNS)
+        for column in ["birthdate", "start_at", "end_at"]:
+            df[column] = df[column].dt.date
+
+        return df, rejected_df, count_canceled_approvals, unique_approval_suffixes
+
+    def write_rejected_rows(self, rejected_df):
+        log_datetime = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+        path = f"{settings.EXPORT_DIR}/{log_datetime}-rejected_pe_approvals-{settings.ITOU_ENVIRONMENT.lower()}.csv"
+        rejected_df.to_csv(path, index=False)
+        self.stdout.write(f"{len(rejected_df)} rejected rows written to `{path}`")
+
+    def load(self, df):
+        """
+        Copy approvals into a staging table and merge them into `PoleEmploiApproval`.
+        Way faster than `bulk_create` for hundreds of thousands of rows.
+
+        Return the number of new approvals.
+        """
+        table_name = PoleEmploiApproval._meta.db_table
+        columns = ", ".join(df.columns)
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                CREATE TEMPORARY TABLE {self.STAGING_TABLE_NAME}
+                AS SELECT {columns} FROM {table_name} WITH NO DATA
+                """
+            )
+            cursor.copy_expert(f"COPY {self.STAGING_TABLE_NAME} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+            # Ignoring conflicts allows us to update the database when a new source file is available:
+            # approvals already known and duplicates within the file are skipped.
+            cursor.execute(
+                f"""
+                INSERT INTO {table_name} ({columns}, created_at)
+                SELECT {columns}, now() FROM {self.STAGING_TABLE_NAME}
+                ON CONFLICT (number) DO NOTHING
+                """
+            )
+            inserted_count = cursor.rowcount
+            cursor.execute(f"DROP TABLE {self.STAGING_TABLE_NAME}")
+        return inserted_count
 
     def handle(self, file_path, dry_run=False, **options):
 
         self.set_logger(options.get("verbosity"))
 
-        now = timezone.now().date()
-
         count_before = PoleEmploiApproval.objects.count()
-        count_canceled_approvals = 0
-        unique_approval_suffixes = {}
 
         file_size_in_bytes = os.path.getsize(file_path)
         self.stdout.write(f"Opening a {file_size_in_bytes >> 20} MB file… (this will take some time)")
 
-        bulk_create_queue = []
-        chunk_size = 5000
-
         df = pd.read_excel(file_path)
         df["DATE_HISTO"] = pd.to_datetime(df.DATE_HISTO, format=self.DATE_FORMAT)
-        df.sort_values("DATE_HISTO")
         first_approval_date = df.iloc[0].DATE_HISTO.strftime(self.DATE_FORMAT)
         last_approval_date = df.iloc[-1].DATE_HISTO.strftime(self.DATE_FORMAT)
 
         self.stdout.write("Ready.")
         self.stdout.write(f"Importing up to {len(df)} approvals from {first_approval_date} to {last_approval_date}")
 
-        pbar = tqdm(total=len(df))
-        for idx, row in df.iterrows():
-            pbar.update(1)
-
-            if idx == 0:
-                # Skip XLSX header.
-                continue
-
-            CODE_STRUCT_AFFECT_BENE = str(row["CODE_STRUCT_AFFECT_BENE"])
-            assert len(CODE_STRUCT_AFFECT_BENE) in [4, 5]
-
-            # This is known as "Identifiant Pôle emploi".
-            ID_REGIONAL_BENE = str(row["ID_REGIONAL_BENE"]).strip()
-            if len(ID_REGIONAL_BENE) < 8:
-                self.logger.debug("-" * 80)
-                self.logger.debug("Bad format for ID_REGIONAL_BENE (PE ID) found, skipping…")
-                self.logger.debug("%s", ID_REGIONAL_BENE)
-                continue
-            # Check the format of ID_REGIONAL_BENE.
-            # First 7 chars should be digits.
-            assert ID_REGIONAL_BENE[:7].isdigit()
-            # Last char should be alphanumeric.
-            assert ID_REGIONAL_BENE[7:].isalnum()
-
-            NOM_USAGE_BENE = row["NOM_USAGE_BENE"].strip()
-            assert "  " not in NOM_USAGE_BENE
-            # max length 29
-
-            PRENOM_BENE = row["PRENOM_BENE"].strip()
-            assert "  " not in PRENOM_BENE
-            # max length 13
-
-            NOM_NAISS_BENE = row["NOM_NAISS_BENE"].strip()
-            assert "  " not in NOM_NAISS_BENE
-            # max length 25
-
-            NUM_AGR_DEC = row["NUM_AGR_DEC"].strip().replace(" ", "")
-            assert " " not in NUM_AGR_DEC
-            if len(NUM_AGR_DEC) not in [12, 15]:
-                self.stderr.write("-" * 80)
-                self.stderr.write("Invalid number, skipping…")
-                self.stderr.write(CODE_STRUCT_AFFECT_BENE)
-                self.stderr.write(ID_REGIONAL_BENE)
-                self.stderr.write(NOM_USAGE_BENE)
-                self.stderr.write(PRENOM_BENE)
-                self.stderr.write(NOM_NAISS_BENE)
-                self.stderr.write(NUM_AGR_DEC)
-                continue
-
-            # Keep track of unique suffixes added by PE at the end of a 12 chars number
-            # that increases the length to 15 chars.
-            if len(NUM_AGR_DEC) > 12:
-                suffix = NUM_AGR_DEC[12:]
-                unique_approval_suffixes[suffix] = unique_approval_suffixes.get(suffix, 0) + 1
-
-            DATE_DEB_AGR_DEC = self.parse_date(row["DATE_DEB"])
-            DATE_FIN_AGR_DEC = self.parse_date(row["DATE_FIN"])
-            DATE_NAISS_BENE = self.parse_date(row["DATE_NAISS_BENE"])
-
-            # Same start and end dates means that the approval has been canceled.
-            if DATE_DEB_AGR_DEC == DATE_FIN_AGR_DEC:
-                count_canceled_approvals += 1
-                self.logger.debug("-" * 80)
-                self.logger.debug("Canceled approval found, skipping…")
-                self.logger.debug("%s - %s - %s", NUM_AGR_DEC, NOM_USAGE_BENE, PRENOM_BENE)
-                continue
-
-            # Pôle emploi sends us the year in a two-digit format ("14/03/68")
-            # but strptime() will set it in the future:
-            # >>> datetime.datetime.strptime("14/03/68", "%d/%m/%y").date()
-            # datetime.date(2068, 3, 14)
-            if DATE_NAISS_BENE.year > now.year:
-                str_d = DATE_NAISS_BENE.strftime("%Y-%m-%d")
-                # Replace the first 2 digits by "19".
-                str_d = f"19{str_d[2:]}"
-                DATE_NAISS_BENE = datetime.datetime.strptime(str_d, "%Y-%m-%d")
-
-            if not dry_run:
-                pe_approval = PoleEmploiApproval()
-                pe_approval.pe_structure_code = CODE_STRUCT_AFFECT_BENE
-                pe_approval.pole_emploi_id = ID_REGIONAL_BENE
-                pe_approval.number = NUM_AGR_DEC
-                pe_approval.first_name = PRENOM_BENE
-                pe_approval.last_name = NOM_USAGE_BENE
-                pe_approval.birth_name = NOM_NAISS_BENE
-                pe_approval.birthdate = DATE_NAISS_BENE
-                pe_approval.start_at = DATE_DEB_AGR_DEC
-                pe_approval.end_at = DATE_FIN_AGR_DEC
-                bulk_create_queue.append(pe_approval)
-                if len(bulk_create_queue) > chunk_size:
-                    # Setting the ignore_conflicts parameter to True tells the
-                    # database to ignore failure to insert any rows that fail
-                    # constraints such as duplicate unique values.
-                    # This allows us to update the database when a new source
-                    # file is available.
-                    PoleEmploiApproval.objects.bulk_create(bulk_create_queue, ignore_conflicts=True)
-                    bulk_create_queue = []
-
-        pbar.close()
-
-        # Create any remaining objects.
-        if not dry_run and bulk_create_queue:
-            PoleEmploiApproval.objects.bulk_create(bulk_create_queue, ignore_conflicts=True)
+        # Skip XLSX header.
+        df = df.iloc[1:]
+
+        df, rejected_df, count_canceled_approvals, unique_approval_suffixes = self.clean(df)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            for reason, count in rejected_df["REJECTION_REASON"].value_counts().items():
+                self.logger.debug("%s: %s rows", reason, count)
+        if not rejected_df.empty:
+            self.write_rejected_rows(rejected_df)
+
+        if not dry_run:
+            self.load(df)
 
         count_after = PoleEmploiApproval.objects.count()
 
@@ -199,5 +234,6 @@ class Command(BaseCommand):
         self.stdout.write(f"After: {count_after}")
         self.stdout.write(f"New objects: {count_after - count_before} (in case of dry run this will always be zero)")
         self.stdout.write(f"Skipped {count_canceled_approvals} canceled approvals")
+        self.stdout.write(f"Rejected {len(rejected_df)} invalid rows")
         self.stdout.write(f"Unique suffixes: {unique_approval_suffixes}")
         self.stdout.write("Done.")
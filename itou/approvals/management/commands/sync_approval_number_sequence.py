@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from itou.approvals.models import Approval
+
+
+class Command(BaseCommand):
+    """
+    Make the sequence allocating the numbers of the PASS IAE restart right after the greatest number issued by Itou.
+
+    Needed once approvals are loaded from fixtures: their numbers were not allocated by the sequence.
+
+    To run the command:
+        django-admin sync_approval_number_sequence
+    """
+
+    help = "Make the sequence allocating PASS IAE numbers restart after the greatest number issued by Itou."
+
+    def handle(self, **options):
+        Approval.sync_number_sequence()
+        self.stdout.write("Synced the sequence of PASS IAE numbers.")
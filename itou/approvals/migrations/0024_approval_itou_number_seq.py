@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def sync_number_sequence(apps, schema_editor):
+    """
+    Start the sequence right after the last number issued by Itou.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT setval(
+                'approvals_approval_itou_number_seq',
+                COALESCE(substring(MAX(number) FROM %(start)s)::integer, 0) + 1,
+                false
+            )
+            FROM approvals_approval
+            WHERE number LIKE %(pattern)s
+            """,
+            {"start": len(settings.ASP_ITOU_PREFIX) + 1, "pattern": f"{settings.ASP_ITOU_PREFIX}%"},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("approvals", "0023_remove_approval_create_employee_record"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="CREATE SEQUENCE approvals_approval_itou_number_seq",
+            reverse_sql="DROP SEQUENCE approvals_approval_itou_number_seq",
+        ),
+        migrations.RunPython(sync_number_sequence, migrations.RunPython.noop),
+    ]
@@ -8,7 +8,7 @@ from django.contrib.postgres.constraints import ExclusionConstraint
 from django.contrib.postgres.fields import RangeBoundary, RangeOperators
 from django.core.exceptions import ValidationError
 from django.core.validators import MinLengthValidator
-from django.db import models
+from django.db import connection, models
 from django.db.models import Count, Q
 from django.db.models.functions import TruncDate
 from django.utils import timezone
@@ -138,6 +138,9 @@ class Approval(CommonApprovalMixin):
     # This prefix is used by the ASP system to identify itou as the issuer of a number.
     ASP_ITOU_PREFIX = settings.ASP_ITOU_PREFIX
 
+    # Postgres sequence allocating the numbers of the PASS IAE issued by Itou, see `get_next_number`.
+    NUMBER_SEQUENCE_NAME = "approvals_approval_itou_number_seq"
+
     # The period of time during which it is possible to prolong a PASS IAE.
     IS_OPEN_TO_PROLONGATION_BOUNDARIES_MONTHS = 3
 
@@ -183,7 +186,6 @@ class Approval(CommonApprovalMixin):
         already_exists = bool(self.pk)
 
         if not self.number:
-            # `get_next_number` will lock rows until the end of the transaction.
             self.number = self.get_next_number()
 
         if not already_exists:
@@ -358,23 +360,39 @@ class Approval(CommonApprovalMixin):
             - YEAR WITHOUT CENTURY is equal to the start year of the `JobApplication.hiring_start_at`
             - A max of 99999 approvals could be issued by year
             - We would have gone beyond, we would never have thought we could go that far
+
+        Numbers are allocated by a Postgres sequence: concurrent hires do not wait for each other.
+        A number is never allocated twice, but the number of a rolled back transaction is lost
+        and leaves a gap.
         """
-        last_itou_approval = (
-            Approval.objects
-            # select_for_update() returns a queryset that will lock rows until the end of the transaction.
-            # The lock is active for the duration of the transaction (see settings.ATOMIC_REQUESTS).
-            .select_for_update()
-            .filter(number__startswith=Approval.ASP_ITOU_PREFIX)
-            .order_by("number")
-            .last()
-        )
-        if last_itou_approval:
-            raw_number = last_itou_approval.number.removeprefix(Approval.ASP_ITOU_PREFIX)
-            next_number = int(raw_number) + 1
-            if next_number > 9999999:
-                raise RuntimeError("The maximum number of PASS IAE has been reached.")
-            return f"{Approval.ASP_ITOU_PREFIX}{next_number:07d}"
-        return f"{Approval.ASP_ITOU_PREFIX}0000001"
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(%s)", [Approval.NUMBER_SEQUENCE_NAME])
+            next_number = cursor.fetchone()[0]
+        if next_number > 9999999:
+            raise RuntimeError("The maximum number of PASS IAE has been reached.")
+        return f"{Approval.ASP_ITOU_PREFIX}{next_number:07d}"
+
+    @staticmethod
+    def sync_number_sequence():
+        """
+        Make the sequence of `get_next_number` restart right after the greatest number issued by Itou.
+
+        Only needed when numbers prefixed by `ASP_ITOU_PREFIX` were inserted without `get_next_number`,
+        e.g. by hand, from fixtures (see the `sync_approval_number_sequence` command) or when the prefix changes.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT setval(%(sequence)s, COALESCE(substring(MAX(number) FROM %(start)s)::integer, 0) + 1, false)
+                FROM {Approval._meta.db_table}
+                WHERE number LIKE %(pattern)s
+                """,
+                {
+                    "sequence": Approval.NUMBER_SEQUENCE_NAME,
+                    "start": len(Approval.ASP_ITOU_PREFIX) + 1,
+                    "pattern": f"{Approval.ASP_ITOU_PREFIX}%",
+                },
+            )
 
     @staticmethod
     def get_default_end_date(start_at):
@@ -1006,8 +1024,21 @@ class PoleEmploiApprovalManager(models.Manager):
         # Save some SQL queries.
         if not user.pole_emploi_id or not user.birthdate:
             return self.none()
+        # Served by the `pe_id_and_birthdate_idx` index.
         return self.filter(pole_emploi_id=user.pole_emploi_id, birthdate=user.birthdate).order_by("-start_at")
 
+    def find_for_number(self, number):
+        """
+        Find existing Pôle emploi's approvals whose number starts with the given one,
+        i.e. the approval itself and its amendments (numbers with a suffix, see `PoleEmploiApproval.number`).
+
+        This prefix lookup (`LIKE 'number%'`) is served by the `varchar_pattern_ops` index that Django creates
+        on PostgreSQL alongside the unique index of `number`: the default collation is not `C` thus the unique
+        index itself cannot be used for `LIKE`.
+        Check with `django-admin benchmark_pe_approval_lookups`.
+        """
+        return self.filter(number__startswith=number).order_by("-start_at")
+
 
 class PoleEmploiApproval(CommonApprovalMixin):
     """
@@ -1180,12 +1211,15 @@ class ApprovalsWrapper:
         )
     )
 
-    def __init__(self, user=None, number=None):
+    def __init__(self, user=None, number=None, merged_approvals=None):
 
         self.user = user
         self.number = number
         self.latest_approval = None
-        if user:
+        if merged_approvals is not None:
+            # Already merged, see `bulk_approvals_status()`.
+            self.merged_approvals = merged_approvals
+        elif user:
             self.merged_approvals = self._merge_approvals_for_user()
         elif number:
             self.merged_approvals = self._merge_approvals_for_number()
@@ -1238,16 +1272,17 @@ class ApprovalsWrapper:
         """
         # Truncate the number to remove any 'S01' or 'P01' suffix because the
         # number is limited to 12 digits in Approval table.
-        approvals = Approval.objects.filter(number=self.number[:12]).order_by("-start_at")
+        # Evaluated right away: a single query instead of `.exists()` then the list.
+        approvals = list(Approval.objects.filter(number=self.number[:12]).order_by("-start_at"))
 
         # If a PASS IAE exists, consider it's the latest approval
         # even if a PoleEmploiApproval is more recent.
         # Return valid and expired approvals.
-        if approvals.exists():
+        if approvals:
             return approvals
 
         today = datetime.date.today()
-        pe_approvals = PoleEmploiApproval.objects.filter(number__startswith=self.number, start_at__lte=today)
+        pe_approvals = PoleEmploiApproval.objects.find_for_number(self.number).filter(start_at__lte=today)
 
         merged_approvals = list(approvals) + list(pe_approvals)
         return self.sort_approvals(merged_approvals)
@@ -1292,3 +1327,50 @@ class ApprovalsWrapper:
         return sorted(
             approvals, key=lambda x: (-time.mktime(x.end_at.timetuple()), time.mktime(x.start_at.timetuple()))
         )
+
+
+def bulk_approvals_status(users):
+    """
+    Returns an `ApprovalsWrapper` for each given user, keyed by user id.
+
+    Same status, latest approval and waiting period as `ApprovalsWrapper(user)` (see `_merge_approvals_for_user`),
+    but for many users at once: two queries for all the users instead of up to three per user.
+    """
+    approvals_by_user = {user.pk: [] for user in users}
+    for approval in Approval.objects.filter(user__in=users).order_by("-start_at"):
+        approvals_by_user[approval.user_id].append(approval)
+
+    # Pôle emploi's approvals are only looked for when there is no valid PASS IAE.
+    pole_emploi_keys = {
+        (user.pole_emploi_id, user.birthdate)
+        for user in users
+        if user.pole_emploi_id
+        and user.birthdate
+        and not any(approval.is_valid() for approval in approvals_by_user[user.pk])
+    }
+    pe_approvals_by_key = {key: [] for key in pole_emploi_keys}
+    if pole_emploi_keys:
+        pe_approvals = PoleEmploiApproval.objects.filter(
+            pole_emploi_id__in={pole_emploi_id for pole_emploi_id, _ in pole_emploi_keys},
+            start_at__lte=datetime.date.today(),
+        ).order_by("-start_at")
+        for pe_approval in pe_approvals:
+            key = (pe_approval.pole_emploi_id, pe_approval.birthdate)
+            if key in pe_approvals_by_key:
+                pe_approvals_by_key[key].append(pe_approval)
+
+    approvals_status = {}
+    for user in users:
+        approvals = approvals_by_user[user.pk]
+        # If an ongoing PASS IAE exists, consider it's the latest valid approval
+        # even if a PoleEmploiApproval is more recent.
+        if not any(approval.is_valid() for approval in approvals):
+            approvals_numbers = {approval.number for approval in approvals}
+            pe_approvals = [
+                pe_approval
+                for pe_approval in pe_approvals_by_key.get((user.pole_emploi_id, user.birthdate), [])
+                if pe_approval.number not in approvals_numbers
+            ]
+            approvals = ApprovalsWrapper.sort_approvals(approvals + pe_approvals)
+        approvals_status[user.pk] = ApprovalsWrapper(user=user, merged_approvals=approvals)
+    return approvals_status
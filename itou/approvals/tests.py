@@ -1,15 +1,21 @@
 import datetime
+import io
+import os
+import tempfile
+import threading
 from unittest import mock
 
+import pandas as pd
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 from django.core import mail
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
 from django.template.defaultfilters import title
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
 
@@ -22,6 +28,7 @@ from itou.approvals.models import (
     PoleEmploiApproval,
     Prolongation,
     Suspension,
+    bulk_approvals_status,
 )
 from itou.approvals.notifications import NewProlongationToAuthorizedPrescriberNotification
 from itou.eligibility.factories import EligibilityDiagnosisFactory, EligibilityDiagnosisMadeBySiaeFactory
@@ -235,14 +242,23 @@ class ApprovalModelTest(TestCase):
             approval.save()
 
     def test_get_next_number(self):
+        # The sequence is not rolled back with the test transaction.
+        self.addCleanup(Approval.sync_number_sequence)
 
         # No pre-existing objects.
+        Approval.sync_number_sequence()
         expected_number = f"{Approval.ASP_ITOU_PREFIX}0000001"
         next_number = Approval.get_next_number()
         self.assertEqual(next_number, expected_number)
 
+        # Numbers are allocated once.
+        expected_number = f"{Approval.ASP_ITOU_PREFIX}0000002"
+        next_number = Approval.get_next_number()
+        self.assertEqual(next_number, expected_number)
+
         # With pre-existing objects.
         ApprovalFactory(number=f"{Approval.ASP_ITOU_PREFIX}0000040")
+        Approval.sync_number_sequence()
         expected_number = f"{Approval.ASP_ITOU_PREFIX}0000041"
         next_number = Approval.get_next_number()
         self.assertEqual(next_number, expected_number)
@@ -250,6 +266,7 @@ class ApprovalModelTest(TestCase):
 
         # With pre-existing Pôle emploi approval.
         ApprovalFactory(number="625741810182")
+        Approval.sync_number_sequence()
         expected_number = f"{Approval.ASP_ITOU_PREFIX}0000001"
         next_number = Approval.get_next_number()
         self.assertEqual(next_number, expected_number)
@@ -258,6 +275,7 @@ class ApprovalModelTest(TestCase):
         # With various pre-existing objects.
         ApprovalFactory(number=f"{Approval.ASP_ITOU_PREFIX}8888882")
         ApprovalFactory(number="625741810182")
+        Approval.sync_number_sequence()
         expected_number = f"{Approval.ASP_ITOU_PREFIX}8888883"
         next_number = Approval.get_next_number()
         self.assertEqual(next_number, expected_number)
@@ -266,16 +284,32 @@ class ApprovalModelTest(TestCase):
         demo_prefix = "XXXXX"
         with mock.patch.object(Approval, "ASP_ITOU_PREFIX", demo_prefix):
             ApprovalFactory(number=f"{demo_prefix}0044440")
+            Approval.sync_number_sequence()
             expected_number = f"{demo_prefix}0044441"
             next_number = Approval.get_next_number()
             self.assertEqual(next_number, expected_number)
             Approval.objects.all().delete()
 
         ApprovalFactory(number=f"{Approval.ASP_ITOU_PREFIX}9999999")
+        Approval.sync_number_sequence()
         with self.assertRaises(RuntimeError):
             next_number = Approval.get_next_number()
         Approval.objects.all().delete()
 
+        # Approvals loaded from fixtures.
+        ApprovalFactory(number=f"{Approval.ASP_ITOU_PREFIX}0000005")
+        call_command("sync_approval_number_sequence", stdout=io.StringIO())
+        expected_number = f"{Approval.ASP_ITOU_PREFIX}0000006"
+        next_number = Approval.get_next_number()
+        self.assertEqual(next_number, expected_number)
+
+    def test_save_allocates_number(self):
+        approval = ApprovalFactory(number=None)
+        next_approval = ApprovalFactory(number=None)
+        self.assertTrue(approval.number.startswith(Approval.ASP_ITOU_PREFIX))
+        self.assertEqual(len(approval.number), 12)
+        self.assertEqual(int(next_approval.number[-7:]), int(approval.number[-7:]) + 1)
+
     def test_is_valid(self):
 
         # Start today, end in 2 years.
@@ -530,6 +564,45 @@ class ApprovalModelTest(TestCase):
         self.assertEqual(suspension.end_at, suspension_end_at)
 
 
+class ApprovalConcurrentNumberTest(TransactionTestCase):
+    """
+    Test the allocation of numbers by concurrent hires, each one in its own transaction and connection.
+    """
+
+    HIRES = 20
+
+    def test_concurrent_hires(self):
+        job_seekers = JobSeekerFactory.create_batch(self.HIRES)
+        start_at = timezone.now().date()
+        end_at = Approval.get_default_end_date(start_at)
+        # Every transaction stays open until all approvals are saved: hires waiting for each other
+        # to allocate a number would break the barrier.
+        barrier = threading.Barrier(self.HIRES, timeout=10)
+        errors = []
+
+        def hire(job_seeker):
+            try:
+                with transaction.atomic():
+                    Approval(user=job_seeker, start_at=start_at, end_at=end_at).save()
+                    barrier.wait()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=hire, args=(job_seeker,)) for job_seeker in job_seekers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        numbers = Approval.objects.values_list("number", flat=True)
+        numbers = sorted(int(number.removeprefix(Approval.ASP_ITOU_PREFIX)) for number in numbers)
+        # No duplicates and no gaps.
+        self.assertEqual(numbers, list(range(numbers[0], numbers[0] + self.HIRES)))
+
+
 class PoleEmploiApprovalModelTest(TestCase):
     """
     Test PoleEmploiApproval model.
@@ -621,6 +694,125 @@ class PoleEmploiApprovalManagerTest(TestCase):
         self.assertEqual(search_results.first(), pe_approval)
         PoleEmploiApproval.objects.all().delete()
 
+    def test_find_for_number(self):
+        pe_approval = PoleEmploiApprovalFactory(number="625741810182")
+        pe_approval_with_suffix = PoleEmploiApprovalFactory(
+            number="625741810182S01", start_at=pe_approval.start_at + relativedelta(days=1)
+        )
+        PoleEmploiApprovalFactory(number="625741810183")
+
+        search_results = PoleEmploiApproval.objects.find_for_number("625741810182")
+        self.assertEqual(list(search_results), [pe_approval_with_suffix, pe_approval])
+        search_results = PoleEmploiApproval.objects.find_for_number("625741810182S01")
+        self.assertEqual(list(search_results), [pe_approval_with_suffix])
+
+
+class ImportPoleEmploiApprovalsTest(TestCase):
+    """
+    Test the `import_pe_approvals` management command.
+    """
+
+    COLUMNS = [
+        "DATE_HISTO",
+        "CODE_STRUCT_AFFECT_BENE",
+        "ID_REGIONAL_BENE",
+        "NOM_USAGE_BENE",
+        "PRENOM_BENE",
+        "NOM_NAISS_BENE",
+        "NUM_AGR_DEC",
+        "DATE_DEB",
+        "DATE_FIN",
+        "DATE_NAISS_BENE",
+    ]
+
+    def setUp(self):
+        export_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(export_dir.cleanup)
+        self.export_dir = export_dir.name
+        settings_override = override_settings(EXPORT_DIR=self.export_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.file_path = os.path.join(self.export_dir, "agrements.xlsx")
+        open(self.file_path, "w").close()
+
+    def get_row(self, **kwargs):
+        row = {
+            "DATE_HISTO": "01/01/20",
+            "CODE_STRUCT_AFFECT_BENE": "75021",
+            "ID_REGIONAL_BENE": "1234567A",
+            "NOM_USAGE_BENE": "DUPONT",
+            "PRENOM_BENE": "JEAN",
+            "NOM_NAISS_BENE": "DURAND",
+            "NUM_AGR_DEC": "999992012345",
+            "DATE_DEB": "01/02/20",
+            "DATE_FIN": "31/01/22",
+            "DATE_NAISS_BENE": "14/03/68",
+        }
+        return row | kwargs
+
+    def import_rows(self, rows, **options):
+        # The first row is skipped, see the command.
+        df = pd.DataFrame([self.get_row()] + rows, columns=self.COLUMNS)
+        with mock.patch("pandas.read_excel", return_value=df):
+            call_command("import_pe_approvals", file_path=self.file_path, stdout=io.StringIO(), **options)
+
+    def test_import(self):
+        existing_pe_approval = PoleEmploiApprovalFactory(number="625741810183")
+        rows = [
+            self.get_row(NUM_AGR_DEC="99999 20 12345"),
+            # Fallback date format and number with a suffix.
+            self.get_row(
+                CODE_STRUCT_AFFECT_BENE="7502",
+                ID_REGIONAL_BENE=" 1234568B ",
+                NUM_AGR_DEC="625741810182P01",
+                DATE_DEB="2020-02-01 00:00:00",
+                DATE_FIN="2022-01-31 00:00:00",
+                DATE_NAISS_BENE="1990-05-04 00:00:00",
+            ),
+            self.get_row(NUM_AGR_DEC="999992012346", ID_REGIONAL_BENE="123"),
+            self.get_row(NUM_AGR_DEC="999992012347", DATE_FIN="bad"),
+            # Canceled approval.
+            self.get_row(NUM_AGR_DEC="999992012348", DATE_FIN="01/02/20"),
+            # Already known approval.
+            self.get_row(NUM_AGR_DEC="625741810183", PRENOM_BENE="EVE"),
+        ]
+
+        self.import_rows(rows)
+
+        self.assertEqual(PoleEmploiApproval.objects.count(), 3)
+        pe_approval = PoleEmploiApproval.objects.get(number="999992012345")
+        self.assertEqual(pe_approval.pe_structure_code, "75021")
+        self.assertEqual(pe_approval.pole_emploi_id, "1234567A")
+        self.assertEqual(pe_approval.first_name, "JEAN")
+        self.assertEqual(pe_approval.last_name, "DUPONT")
+        self.assertEqual(pe_approval.birth_name, "DURAND")
+        self.assertEqual(pe_approval.birthdate, datetime.date(1968, 3, 14))
+        self.assertEqual(pe_approval.start_at, datetime.date(2020, 2, 1))
+        self.assertEqual(pe_approval.end_at, datetime.date(2022, 1, 31))
+
+        pe_approval = PoleEmploiApproval.objects.get(number="625741810182P01")
+        self.assertEqual(pe_approval.pole_emploi_id, "1234568B")
+        self.assertEqual(pe_approval.birthdate, datetime.date(1990, 5, 4))
+        self.assertEqual(pe_approval.start_at, datetime.date(2020, 2, 1))
+
+        # Already known approvals are left untouched.
+        first_name = existing_pe_approval.first_name
+        existing_pe_approval.refresh_from_db()
+        self.assertEqual(existing_pe_approval.first_name, first_name)
+
+        [rejected_file] = [name for name in os.listdir(self.export_dir) if name.endswith(".csv")]
+        rejected_df = pd.read_csv(os.path.join(self.export_dir, rejected_file), dtype=str)
+        self.assertEqual(rejected_df["NUM_AGR_DEC"].tolist(), ["999992012346", "999992012347"])
+        self.assertEqual(rejected_df["REJECTION_REASON"].tolist(), ["Invalid ID_REGIONAL_BENE", "Invalid DATE_FIN"])
+
+        # Importing the same file again does not create anything.
+        self.import_rows(rows)
+        self.assertEqual(PoleEmploiApproval.objects.count(), 3)
+
+    def test_dry_run(self):
+        self.import_rows([self.get_row()], dry_run=True)
+        self.assertFalse(PoleEmploiApproval.objects.exists())
+
 
 class ApprovalsWrapperTest(TestCase):
     """
@@ -864,6 +1056,109 @@ class ApprovalsWrapperTest(TestCase):
         diag.delete()
 
 
+class BulkApprovalsStatusTest(TestCase):
+    """
+    Test bulk_approvals_status() against ApprovalsWrapper.
+    """
+
+    def test_parity_with_approvals_wrapper(self):
+        today = timezone.now().date()
+        users = []
+
+        # No approval at all.
+        users.append(JobSeekerFactory())
+
+        # Valid PASS IAE.
+        user = JobSeekerFactory()
+        ApprovalFactory(user=user)
+        users.append(user)
+
+        # PASS IAE in waiting period.
+        user = JobSeekerFactory()
+        ApprovalFactory(
+            user=user, start_at=today - relativedelta(years=2, days=30), end_at=today - relativedelta(days=30)
+        )
+        users.append(user)
+
+        # PASS IAE whose waiting period has elapsed.
+        user = JobSeekerFactory()
+        ApprovalFactory(user=user, start_at=today - relativedelta(years=5), end_at=today - relativedelta(years=3))
+        users.append(user)
+
+        # Valid PoleEmploiApproval, and another one with the same `pole_emploi_id` for somebody else.
+        user = JobSeekerFactory()
+        PoleEmploiApprovalFactory(pole_emploi_id=user.pole_emploi_id, birthdate=user.birthdate)
+        PoleEmploiApprovalFactory(pole_emploi_id=user.pole_emploi_id, birthdate=user.birthdate - relativedelta(days=1))
+        users.append(user)
+
+        # PoleEmploiApproval in waiting period.
+        user = JobSeekerFactory()
+        PoleEmploiApprovalFactory(
+            pole_emploi_id=user.pole_emploi_id,
+            birthdate=user.birthdate,
+            start_at=today - relativedelta(years=2, days=30),
+            end_at=today - relativedelta(days=30),
+        )
+        users.append(user)
+
+        # Expired PASS IAE, its PoleEmploiApproval copy and a more recent valid PoleEmploiApproval.
+        user = JobSeekerFactory()
+        approval = ApprovalFactory(
+            user=user, start_at=today - relativedelta(years=2, days=30), end_at=today - relativedelta(days=30)
+        )
+        PoleEmploiApprovalFactory(
+            pole_emploi_id=user.pole_emploi_id,
+            birthdate=user.birthdate,
+            number=approval.number,
+            start_at=approval.start_at,
+            end_at=approval.end_at,
+        )
+        PoleEmploiApprovalFactory(
+            pole_emploi_id=user.pole_emploi_id, birthdate=user.birthdate, start_at=today - relativedelta(days=10)
+        )
+        users.append(user)
+
+        # PASS IAE starting in the future and a more recent PoleEmploiApproval.
+        user = JobSeekerFactory()
+        ApprovalFactory(user=user, start_at=today + relativedelta(days=10), end_at=today + relativedelta(years=2))
+        PoleEmploiApprovalFactory(
+            pole_emploi_id=user.pole_emploi_id, birthdate=user.birthdate, end_at=today + relativedelta(years=3)
+        )
+        users.append(user)
+
+        # Valid PoleEmploiApproval but no `pole_emploi_id`.
+        user = JobSeekerFactory(pole_emploi_id="")
+        PoleEmploiApprovalFactory(pole_emploi_id="", birthdate=user.birthdate)
+        users.append(user)
+
+        with self.assertNumQueries(2):
+            approvals_status = bulk_approvals_status(users)
+
+        self.assertEqual(len(approvals_status), len(users))
+        for user in users:
+            with self.subTest(user=user):
+                approvals_wrapper = ApprovalsWrapper(user)
+                bulk_approvals_wrapper = approvals_status[user.pk]
+                self.assertEqual(bulk_approvals_wrapper.status, approvals_wrapper.status)
+                self.assertEqual(bulk_approvals_wrapper.has_valid, approvals_wrapper.has_valid)
+                self.assertEqual(bulk_approvals_wrapper.has_in_waiting_period, approvals_wrapper.has_in_waiting_period)
+                self.assertEqual(bulk_approvals_wrapper.latest_approval, approvals_wrapper.latest_approval)
+                self.assertEqual(
+                    list(bulk_approvals_wrapper.merged_approvals), list(approvals_wrapper.merged_approvals)
+                )
+
+    def test_no_pole_emploi_query_when_valid(self):
+        users = [JobSeekerFactory(), JobSeekerFactory()]
+        for user in users:
+            ApprovalFactory(user=user)
+
+        with self.assertNumQueries(1):
+            approvals_status = bulk_approvals_status(users)
+
+        for user in users:
+            self.assertTrue(approvals_status[user.pk].has_valid)
+
+
 class AutomaticApprovalAdminViewsTest(TestCase):
     """
     Test Approval automatic admin views.
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class AspConfig(AppConfig):
     name = "itou.asp"
     verbose_name = "Référentiels de données ASP"
+
+    def ready(self):
+        """
+        When the app is loaded:
+        activate the signals invalidating the in-memory cache of the ASP referentials
+        """
+        import itou.asp.signals  # noqa F401
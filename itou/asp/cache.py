@@ -0,0 +1,142 @@
+"""
+In-memory cache of the ASP referentials (communes, countries, departments).
+
+These referentials only change when they are reloaded (see `gen_asp_ref_fixtures`), yet they are looked up
+row after row by bulk imports and forms. Each process loads a referential once, the first time it is needed,
+and then serves lookups from memory.
+
+Reloading a referential bumps a version key shared by all processes (see `signals.py`).
+Each process checks this version at most every `VERSION_CHECK_INTERVAL` seconds and reloads
+its referentials when it changed. Referentials updated without signals (e.g. raw SQL)
+or loaded with `loaddata` need a call to `bump_version()`.
+
+Lookups fall back to the database while the version can't be read.
+"""
+import datetime
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from redis.exceptions import RedisError
+
+from itou.asp.models import Commune, Country, Department
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = "asp_referentials"
+VERSION_KEY = "version"
+
+
+def get_version():
+    cache = caches[CACHE_ALIAS]
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # `add` does not override a version set meanwhile by another process.
+        cache.add(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    try:
+        caches[CACHE_ALIAS].set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+    except RedisError:
+        logger.exception("Could not bump the version of the ASP referentials")
+
+
+def is_valid_at(obj, period):
+    """
+    Objects with effect periods (see `AbstractPeriod`): `period=None` means currently valid.
+    """
+    if period is None:
+        return obj.end_date is None
+    if isinstance(period, datetime.datetime):
+        period = period.date()
+    return obj.start_date <= period and (obj.end_date is None or obj.end_date > period)
+
+
+class ReferentialCache:
+    """
+    Lookup ASP referentials by code, from memory when `settings.ASP_REFERENTIALS_CACHE_ENABLED`
+    or from the database otherwise. Both ways return the same objects.
+
+    Objects are shared by all callers and must not be modified.
+    """
+
+    VERSION_CHECK_INTERVAL = 60
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.version = None
+        self.version_checked_at = None
+        self.objects_by_code = {}
+
+    def check_version(self):
+        now = time.monotonic()
+        if self.version_checked_at is not None and now - self.version_checked_at < self.VERSION_CHECK_INTERVAL:
+            return
+        version = get_version()
+        if version != self.version:
+            self.objects_by_code = {}
+            self.version = version
+        self.version_checked_at = now
+
+    def get_objects(self, model, code):
+        """
+        Return all the objects of `model` with the given code, ordered by pk.
+        """
+        if not settings.ASP_REFERENTIALS_CACHE_ENABLED:
+            return list(model.objects.filter(code=code).order_by("pk"))
+
+        with self.lock:
+            try:
+                self.check_version()
+            except RedisError:
+                logger.exception("Could not check the version of the ASP referentials")
+                # Other processes may have reloaded the referentials meanwhile.
+                self.clear()
+                return list(model.objects.filter(code=code).order_by("pk"))
+            if model not in self.objects_by_code:
+                objects_by_code = {}
+                for obj in model.objects.order_by("pk"):
+                    objects_by_code.setdefault(obj.code, []).append(obj)
+                self.objects_by_code[model] = objects_by_code
+            return self.objects_by_code[model].get(code, [])
+
+    def get_commune(self, insee_code, period=None):
+        """
+        Commune with the given INSEE code, valid at the given period (currently valid by default).
+        """
+        return next((c for c in self.get_objects(Commune, insee_code) if is_valid_at(c, period)), None)
+
+    def get_any_commune(self, insee_code):
+        """
+        Communes store the history of city names and INSEE codes:
+        currently valid commune with the given INSEE code if any, or else an old one.
+        """
+        communes = self.get_objects(Commune, insee_code)
+        return next((c for c in communes if is_valid_at(c, None)), None) or next(iter(communes), None)
+
+    def get_first_commune(self, insee_code):
+        """
+        First commune with the given INSEE code whatever its period, like
+        `Commune.objects.by_insee_code(insee_code).first()`.
+        """
+        return next(iter(self.get_objects(Commune, insee_code)), None)
+
+    def get_department(self, code, period=None):
+        return next((d for d in self.get_objects(Department, code) if is_valid_at(d, period)), None)
+
+    def get_country(self, code):
+        return next(iter(self.get_objects(Country, code)), None)
+
+
+# Every process gets its own copy.
+referentials = ReferentialCache()
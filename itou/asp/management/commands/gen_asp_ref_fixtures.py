@@ -49,6 +49,9 @@ class Command(BaseCommand):
     Once generated, fixtures can be imported via:
     ./manage.py loaddata --app asp itou/asp/fixtures/*.json
 
+    Then let running processes reload the referentials they cache (see `itou.asp.cache`):
+    ./manage.py shell -c "from itou.asp.cache import bump_version; bump_version()"
+
     Check 'itou.asp.models' for details.
     """
 
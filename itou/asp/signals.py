@@ -0,0 +1,23 @@
+"""
+Invalidate the in-memory cache of the ASP referentials, see `cache.py`.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from itou.asp.cache import bump_version, referentials
+from itou.asp.models import Commune, Country, Department
+
+
+@receiver(post_save, sender=Commune)
+@receiver(post_delete, sender=Commune)
+@receiver(post_save, sender=Country)
+@receiver(post_delete, sender=Country)
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+def invalidate_referentials(sender, raw=False, **kwargs):
+    if raw:
+        # Loading fixtures: sent for each row, `bump_version()` is called once they are loaded instead.
+        return
+    referentials.clear()
+    transaction.on_commit(bump_version)
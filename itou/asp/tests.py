@@ -1,8 +1,12 @@
+import datetime
 from unittest import mock
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from redis.exceptions import RedisError
 
-from itou.asp.models import LaneExtension, LaneType, find_lane_type_aliases
+from itou.asp.cache import ReferentialCache, bump_version
+from itou.asp.factories import CommuneFactory, CountryFranceFactory
+from itou.asp.models import Commune, LaneExtension, LaneType, find_lane_type_aliases
 from itou.common_apps.address.format import format_address
 from itou.users.factories import JobSeekerFactory, JobSeekerWithAddressFactory
 from itou.utils.mocks.address_format import BAN_GEOCODING_API_RESULTS_MOCK, RESULTS_BY_ADDRESS
@@ -193,3 +197,83 @@ class LaneExtensionTest(TestCase):
         result, _error = format_address(user)
         self.assertEqual(result.get("non_std_extension"), "G")
         self.assertIsNone(result.get("std_extension"))
+
+
+@override_settings(ASP_REFERENTIALS_CACHE_ENABLED=True)
+class ReferentialCacheTest(TestCase):
+    def setUp(self):
+        self.referentials = ReferentialCache()
+        self.old_commune = CommuneFactory(
+            code="64483",
+            name="ST JEAN DE LUZ",
+            start_date=datetime.date(1900, 1, 1),
+            end_date=datetime.date(2000, 1, 1),
+        )
+        self.commune = CommuneFactory(code="64483", name="SAINT-JEAN-DE-LUZ", start_date=datetime.date(2000, 1, 1))
+
+    def test_get_commune(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.referentials.get_commune("64483"), self.commune)
+            self.assertEqual(self.referentials.get_commune("64483", datetime.date(1950, 1, 1)), self.old_commune)
+            self.assertEqual(self.referentials.get_commune("64483", datetime.date(2000, 1, 1)), self.commune)
+            self.assertIsNone(self.referentials.get_commune("64483", datetime.date(1800, 1, 1)))
+            self.assertIsNone(self.referentials.get_commune("99999"))
+            self.assertEqual(self.referentials.get_any_commune("64483"), self.commune)
+
+    def test_get_any_commune(self):
+        self.commune.delete()
+        self.assertEqual(self.referentials.get_any_commune("64483"), self.old_commune)
+
+    def test_get_first_commune(self):
+        # Several communes share this INSEE code: the first one is returned, even if it is no longer valid.
+        with self.assertNumQueries(1):
+            self.assertEqual(self.referentials.get_first_commune("64483"), self.old_commune)
+            self.assertEqual(self.referentials.get_any_commune("64483"), self.commune)
+            self.assertIsNone(self.referentials.get_first_commune("99999"))
+        with override_settings(ASP_REFERENTIALS_CACHE_ENABLED=False):
+            self.assertEqual(
+                self.referentials.get_first_commune("64483"), Commune.objects.by_insee_code("64483").first()
+            )
+
+    def test_get_country(self):
+        france = CountryFranceFactory()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.referentials.get_country("100"), france)
+            self.assertIsNone(self.referentials.get_country("999"))
+
+    def test_same_results_without_cache(self):
+        with override_settings(ASP_REFERENTIALS_CACHE_ENABLED=False):
+            self.assertEqual(self.referentials.get_commune("64483", datetime.date(1950, 1, 1)), self.old_commune)
+            self.assertEqual(self.referentials.get_any_commune("64483"), self.commune)
+
+    def test_version(self):
+        self.assertEqual(self.referentials.get_commune("64483"), self.commune)
+
+        # Reloaded by another process.
+        new_commune = CommuneFactory(code="37273", name="VILLE-AUX-DAMES", start_date=datetime.date(2000, 1, 1))
+        self.assertIsNone(self.referentials.get_commune("37273"))
+        bump_version()
+        self.assertIsNone(self.referentials.get_commune("37273"))
+
+        # The version is checked again.
+        with mock.patch.object(ReferentialCache, "VERSION_CHECK_INTERVAL", 0):
+            self.assertEqual(self.referentials.get_commune("37273"), new_commune)
+
+    def test_version_unavailable(self):
+        with mock.patch("itou.asp.cache.get_version", side_effect=RedisError):
+            # Looked up in the database each time.
+            with self.assertNumQueries(2):
+                self.assertEqual(self.referentials.get_commune("64483"), self.commune)
+                self.assertEqual(self.referentials.get_any_commune("64483"), self.commune)
+        with mock.patch("itou.asp.cache.caches") as caches_mock:
+            caches_mock.__getitem__.return_value.set.side_effect = RedisError
+            bump_version()
+
+    def test_loaddata(self):
+        with mock.patch("itou.asp.signals.bump_version") as bump_version_mock:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.commune.save_base(raw=True)
+            bump_version_mock.assert_not_called()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.commune.save()
+            bump_version_mock.assert_called_once_with()
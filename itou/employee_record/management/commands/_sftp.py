@@ -0,0 +1,125 @@
+"""
+Parallel download of ASP feedback files over a small pool of SFTP connections.
+
+Files are fetched into a local spool directory: a file already spooled by a previous (interrupted or failed) run
+is not downloaded again, it is removed from the spool once processed.
+"""
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+
+class SFTPConnectionPool:
+    """
+    Lazily open up to `size` SFTP connections with `connect()` and lend them to one thread at a time.
+
+    A connection which failed while lent is closed and not lent again.
+    """
+
+    def __init__(self, connect, size):
+        self.connect = connect
+        self.size = size
+        self.idle_connections = queue.Queue()
+        self.opened_connections = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self.idle_connections.get_nowait()
+        except queue.Empty:
+            # Callers never use more than `size` connections at once (see `fetch_to_spool`).
+            conn = self.connect()
+            self.opened_connections.append(conn)
+
+        try:
+            yield conn
+        except Exception:
+            self.opened_connections.remove(conn)
+            conn.close()
+            raise
+
+        self.idle_connections.put(conn)
+
+    def close(self):
+        for conn in self.opened_connections:
+            conn.close()
+        self.opened_connections = []
+
+
+def get_spool_path(spool_dir, filename):
+    return os.path.join(spool_dir, filename)
+
+
+def fetch_file_to_spool(conn, remote_dir, filename, spool_dir):
+    """
+    Download a remote file into the spool directory and return its local path.
+
+    The file is first written under a temporary name so that an interrupted download is never mistaken
+    for a complete one.
+    """
+    path = get_spool_path(spool_dir, filename)
+    tmp_path = f"{path}.tmp"
+    try:
+        with conn.cd(remote_dir):
+            with open(tmp_path, "wb") as f:
+                conn.getfo(filename, f)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    return path
+
+
+def fetch_to_spool(pool, remote_dir, filenames, spool_dir):
+    """
+    Download remote files into the spool directory, in parallel over the connections of `pool`.
+
+    Return a dict mapping each file name to either its local path or the exception raised while downloading it,
+    so that a failing file does not prevent the other ones from being processed.
+    """
+    os.makedirs(spool_dir, exist_ok=True)
+
+    results = {}
+    missing_filenames = []
+    for filename in filenames:
+        path = get_spool_path(spool_dir, filename)
+        if os.path.exists(path):
+            # Downloaded by a previous run
+            results[filename] = path
+        else:
+            missing_filenames.append(filename)
+
+    def fetch(filename):
+        with pool.connection() as conn:
+            return fetch_file_to_spool(conn, remote_dir, filename, spool_dir)
+
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        futures = {executor.submit(fetch, filename): filename for filename in missing_filenames}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as ex:
+                results[futures[future]] = ex
+
+    # Keep the remote listing order
+    return {filename: results[filename] for filename in filenames}
+
+
+def cleanup_spool(spool_dir, filenames):
+    """
+    Remove spooled files which are no longer on the remote server (i.e. processed, or removed by hand),
+    as well as leftovers of interrupted downloads.
+    """
+    if not os.path.isdir(spool_dir):
+        return
+    for name in os.listdir(spool_dir):
+        if name.endswith(".tmp") or name not in filenames:
+            os.remove(os.path.join(spool_dir, name))
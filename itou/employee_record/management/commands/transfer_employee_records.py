@@ -1,18 +1,23 @@
 import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from os import path
 
 import pysftp
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.utils import timezone
 from rest_framework.parsers import JSONParser
 from rest_framework.renderers import JSONRenderer
 
-from itou.employee_record.mocks.test_serializers import TestEmployeeRecordBatchSerializer
+from itou.employee_record.management.commands._sftp import SFTPConnectionPool, cleanup_spool, fetch_to_spool
+from itou.employee_record.mocks.test_serializers import TestEmployeeRecordBatchSerializer, TestEmployeeRecordSerializer
 from itou.employee_record.models import EmployeeRecord, EmployeeRecordBatch
 from itou.employee_record.serializers import EmployeeRecordBatchSerializer, EmployeeRecordSerializer
-from itou.utils.iterators import chunks
 
 
 # Global SFTP connection options
@@ -22,6 +27,22 @@ connection_options = None
 if settings.ASP_FS_KNOWN_HOSTS and path.exists(settings.ASP_FS_KNOWN_HOSTS):
     connection_options = pysftp.CnOpts(knownhosts=settings.ASP_FS_KNOWN_HOSTS)
 
+# Fields updated by `EmployeeRecord.update_as_sent`
+SENT_UPDATE_FIELDS = ["siret", "asp_id", "asp_batch_file", "asp_batch_line_number", "status", "updated_at"]
+
+# Fields updated by `EmployeeRecord.update_as_accepted` and `EmployeeRecord.update_as_rejected`
+FEEDBACK_UPDATE_FIELDS = [
+    "status",
+    "processed_at",
+    "asp_processing_code",
+    "asp_processing_label",
+    "archived_json",
+    "updated_at",
+]
+
+# Feedback files parsed ahead of the update of their employee records
+PARSE_MAX_WORKERS = 4
+
 
 class Command(BaseCommand):
     """
@@ -89,6 +110,64 @@ class Command(BaseCommand):
             f.write(content)
         self.logger.info("Wrote '%s' to local path '%s'", remote_path, local_path)
 
+    def _get_remote_path(self):
+        """
+        Upload file names are timestamped to the second and must be unique:
+        wait for the next second if a file has already been uploaded during the current one.
+        """
+        remote_path = EmployeeRecordBatch.REMOTE_PATH_FORMAT.format(timezone.now().strftime("%Y%m%d%H%M%S"))
+        while remote_path == self.last_remote_path:
+            time.sleep(0.1)
+            remote_path = EmployeeRecordBatch.REMOTE_PATH_FORMAT.format(timezone.now().strftime("%Y%m%d%H%M%S"))
+        self.last_remote_path = remote_path
+        return remote_path
+
+    def _get_serialized_size(self, employee_record, line_number):
+        """
+        Size in bytes of the given employee record once rendered in a batch file at the given line
+        """
+        # Same values as the ones set by EmployeeRecordBatch
+        employee_record.asp_batch_line_number = line_number
+        employee_record.asp_processing_code = None
+        employee_record.asp_processing_label = None
+
+        serializer_class = TestEmployeeRecordSerializer if self.asp_test else EmployeeRecordSerializer
+        return len(JSONRenderer().render(serializer_class(employee_record).data))
+
+    def _get_batches(self, employee_records):
+        """
+        Pack employee records into lists complying with ASP limits for a single upload file:
+        - no more than `EmployeeRecordBatch.MAX_EMPLOYEE_RECORDS` employee records
+        - no more than `EmployeeRecordBatch.MAX_SIZE_BYTES` bytes
+        """
+        batch_serializer_class = TestEmployeeRecordBatchSerializer if self.asp_test else EmployeeRecordBatchSerializer
+        # Size of the JSON envelope, i.e. a file without any employee record
+        empty_batch_size = len(JSONRenderer().render(batch_serializer_class(EmployeeRecordBatch([])).data))
+
+        batch, batch_size = [], empty_batch_size
+
+        for employee_record in employee_records:
+            # JSONRenderer is compact: employee records are only separated by a comma
+            record_size = self._get_serialized_size(employee_record, len(batch) + 1) + (1 if batch else 0)
+
+            if batch and (
+                len(batch) == EmployeeRecordBatch.MAX_EMPLOYEE_RECORDS
+                or batch_size + record_size > EmployeeRecordBatch.MAX_SIZE_BYTES
+            ):
+                yield batch
+                batch, batch_size = [], empty_batch_size
+                record_size = self._get_serialized_size(employee_record, 1)
+
+            if batch_size + record_size > EmployeeRecordBatch.MAX_SIZE_BYTES:
+                self.logger.error("Employee record is too large to be uploaded: %s", employee_record)
+                continue
+
+            batch.append(employee_record)
+            batch_size += record_size
+
+        if batch:
+            yield batch
+
     def _upload_batch_file(self, conn, employee_records, dry_run):
         """
         Render a list of employee records in JSON format then send it to SFTP upload folder
@@ -105,7 +184,7 @@ class Command(BaseCommand):
         # Using FileIO objects allows to use them as files
         # Cool side effect: no temporary file needed
         json_stream = BytesIO(json_bytes)
-        remote_path = f"RIAE_FS_{timezone.now().strftime('%Y%m%d%H%M%S')}.json"
+        remote_path = self._get_remote_path()
 
         if dry_run:
             self.logger.info("DRY-RUN: (not) sending '%s' (%d bytes)", remote_path, len(json_bytes))
@@ -127,16 +206,27 @@ class Command(BaseCommand):
             try:
                 conn.putfo(json_stream, remote_path, file_size=len(json_bytes), confirm=False)
 
-                self.logger.info("Succesfully uploaded '%s'", remote_path)
+                self.logger.info("Succesfully uploaded '%s' (%d bytes)", remote_path, len(json_bytes))
             except Exception as ex:
                 self.logger.error("Could not upload file: '%s', reason: %s", remote_path, ex)
 
                 return
 
-            # Now that file is transfered, update employee records status (SENT)
-            # and store in which file they have been sent
-            for idx, employee_record in enumerate(employee_records, 1):
-                employee_record.update_as_sent(remote_path, idx)
+        # Now that file is transfered, update employee records status (SENT)
+        # and store in which file they have been sent.
+        # All the employee records of a file are updated at once, in a single transaction.
+        sent_employee_records = []
+        for idx, employee_record in enumerate(employee_records, 1):
+            try:
+                employee_record.update_as_sent(remote_path, idx, save=False)
+                sent_employee_records.append(employee_record)
+            except ValidationError as ex:
+                self.logger.error("Can't update employee record as sent: %s, exc: %s", employee_record, ex)
+
+        with transaction.atomic():
+            EmployeeRecord.objects.bulk_update(sent_employee_records, SENT_UPDATE_FIELDS, batch_size=1000)
+
+        self.logger.info("Updated %d/%d employee record(s) as sent", len(sent_employee_records), len(employee_records))
 
     def _parse_feedback_file(self, feedback_file, batch, dry_run):
         """
@@ -144,6 +234,9 @@ class Command(BaseCommand):
         - Update status of employee records,
         - Update metadata for processed employee records.
 
+        All the employee records of the batch are fetched at once, and updated at once.
+        Processing the same file twice leaves employee records untouched.
+
         Returns the number of errors encountered
         """
         batch_filename = EmployeeRecordBatch.batch_filename_from_feedback(feedback_file)
@@ -158,6 +251,14 @@ class Command(BaseCommand):
 
             return 1
 
+        # Employee records of the batch file, by line number
+        employee_records = {
+            employee_record.asp_batch_line_number: employee_record
+            for employee_record in EmployeeRecord.objects.full_fetch().filter(asp_batch_file=batch_filename)
+        }
+        accepted_employee_records = []
+        rejected_employee_records = []
+
         for idx, employee_record in enumerate(records, 1):
             line_number = employee_record.get("numLigne")
             processing_code = employee_record.get("codeTraitement")
@@ -172,7 +273,7 @@ class Command(BaseCommand):
                 continue
 
             # Now we must find the matching FS
-            employee_record = EmployeeRecord.objects.find_by_batch(batch_filename, line_number).first()
+            employee_record = employee_records.get(int(line_number))
 
             if not employee_record:
                 self.logger.error(
@@ -185,31 +286,17 @@ class Command(BaseCommand):
 
             # Employee record succesfully processed by ASP :
             if processing_code == success_code:
-                # Archive a JSON copy of employee record (with processing code and label)
-                employee_record.asp_processing_code = processing_code
-                employee_record.asp_processing_label = processing_label
-
-                serializer = EmployeeRecordSerializer(employee_record)
-
-                if not dry_run:
-                    try:
-                        if employee_record.status != EmployeeRecord.Status.PROCESSED:
-                            employee_record.update_as_accepted(
-                                processing_code, processing_label, renderer.render(serializer.data).decode()
-                            )
-                        else:
-                            self.logger.warning("Already accepted: %s", employee_record)
-                    except Exception as ex:
-                        self.logger.warning(
-                            "Can't update employee record : %s, STATUS: %s, exc: %s",
-                            employee_record,
-                            employee_record.status,
-                            ex,
-                        )
-                else:
+                if dry_run:
                     self.logger.info(
                         "DRY-RUN: Accepted %s, code: %s, label: %s", employee_record, processing_code, processing_label
                     )
+                elif employee_record.status != EmployeeRecord.Status.PROCESSED:
+                    # Processing code and label are part of the archived JSON copy
+                    employee_record.asp_processing_code = processing_code
+                    employee_record.asp_processing_label = processing_label
+                    accepted_employee_records.append(employee_record)
+                else:
+                    self.logger.warning("Already accepted: %s", employee_record)
             else:
                 # Employee record has already been processed : SKIP
                 # (this can happen if files are processed twice
@@ -220,16 +307,61 @@ class Command(BaseCommand):
                     continue
 
                 # Employee record has not been processed by ASP :
-                if not dry_run:
-                    # Fixes unexpected stop on multiple pass on the same file
-                    if employee_record.status != EmployeeRecord.Status.REJECTED:
-                        employee_record.update_as_rejected(processing_code, processing_label)
-                    else:
-                        self.logger.warning("Already rejected: %s", employee_record)
-                else:
+                if dry_run:
                     self.logger.info(
                         "DRY-RUN: Rejected %s, code: %s, label: %s", employee_record, processing_code, processing_label
                     )
+                # Fixes unexpected stop on multiple pass on the same file
+                elif employee_record.status != EmployeeRecord.Status.REJECTED:
+                    rejected_employee_records.append((employee_record, processing_code, processing_label))
+                else:
+                    self.logger.warning("Already rejected: %s", employee_record)
+
+        if dry_run:
+            return record_errors
+
+        updated_employee_records = []
+
+        # Archive a JSON copy of accepted employee records (with processing code and label)
+        archives = EmployeeRecordSerializer(accepted_employee_records, many=True).data
+        for employee_record, archive in zip(accepted_employee_records, archives):
+            try:
+                employee_record.update_as_accepted(
+                    employee_record.asp_processing_code,
+                    employee_record.asp_processing_label,
+                    renderer.render(archive).decode(),
+                    save=False,
+                )
+                updated_employee_records.append(employee_record)
+            except ValidationError as ex:
+                self.logger.warning(
+                    "Can't update employee record : %s, STATUS: %s, exc: %s",
+                    employee_record,
+                    employee_record.status,
+                    ex,
+                )
+
+        for employee_record, processing_code, processing_label in rejected_employee_records:
+            try:
+                employee_record.update_as_rejected(processing_code, processing_label, save=False)
+                updated_employee_records.append(employee_record)
+            except ValidationError as ex:
+                self.logger.warning(
+                    "Can't update employee record : %s, STATUS: %s, exc: %s",
+                    employee_record,
+                    employee_record.status,
+                    ex,
+                )
+
+        with transaction.atomic():
+            EmployeeRecord.objects.bulk_update(updated_employee_records, FEEDBACK_UPDATE_FIELDS, batch_size=1000)
+
+        self.logger.info(
+            "Updated %d/%d employee record(s) from file: %s",
+            len(updated_employee_records),
+            len(accepted_employee_records) + len(rejected_employee_records),
+            feedback_file,
+        )
 
         return record_errors
 
@@ -237,38 +369,67 @@ class Command(BaseCommand):
         """
         Fetch remote ASP file containing the results of the processing
         of a batch of employee records
+
+        Files are downloaded in parallel into a local spool directory, then parsed in parallel too,
+        while the employee records of the files already parsed are updated one file at a time.
+        A file is only deleted (remotely and locally) if it was processed without any error.
         """
         self.logger.info("Starting DOWNLOAD")
 
         parser = JSONParser()
         count = 0
-        errors = 0
         files_to_delete = []
 
         # Get into the download folder
         with conn.cd(settings.ASP_FS_REMOTE_DOWNLOAD_DIR):
-            result_files = conn.listdir()
+            result_files = list(conn.listdir())
 
-            if len(result_files) == 0:
-                self.logger.info("No feedback files found")
-                return
+        if len(result_files) == 0:
+            self.logger.info("No feedback files found")
+            return
 
-            for result_file in result_files:
-                try:
-                    with BytesIO() as result_stream:
-                        self.logger.info("Fetching file '%s'", result_file)
+        # Files already processed or removed from the server are not needed anymore
+        cleanup_spool(settings.ASP_FS_LOCAL_SPOOL_DIR, result_files)
+
+        self.logger.info("Fetching %d file(s)", len(result_files))
+        with SFTPConnectionPool(self._get_sftp_connection, settings.ASP_FS_SFTP_POOL_SIZE) as pool:
+            spooled_files = fetch_to_spool(
+                pool, settings.ASP_FS_REMOTE_DOWNLOAD_DIR, result_files, settings.ASP_FS_LOCAL_SPOOL_DIR
+            )
 
-                        conn.getfo(result_file, result_stream)
-                        # Rewind stream
-                        result_stream.seek(0)
+        def parse(spooled_file):
+            # Like `fetch_to_spool`, return the exception raised instead of stopping the other files
+            if isinstance(spooled_file, Exception):
+                return spooled_file
+            try:
+                with open(spooled_file, "rb") as result_stream:
+                    return parser.parse(result_stream)
+            except Exception as ex:
+                return ex
 
-                        # Parse and update employee records with feedback
-                        errors += self._parse_feedback_file(result_file, parser.parse(result_stream), dry_run)
+        with ThreadPoolExecutor(max_workers=PARSE_MAX_WORKERS) as executor:
+            # Results are yielded in the order of the files
+            parsed_files = executor.map(parse, spooled_files.values())
 
-                        count += 1
-                except Exception as ex:
+            for (result_file, spooled_file), batch in zip(spooled_files.items(), parsed_files):
+                # Errors are counted per file: a bad file does not prevent the deletion of the other ones
+                errors = 0
+
+                if isinstance(spooled_file, Exception):
                     errors += 1
-                    self.logger.error("Error while parsing file '%s': %s", result_file, ex)
+                    self.logger.error("Error while fetching file '%s': %s", result_file, spooled_file)
+                elif isinstance(batch, Exception):
+                    errors += 1
+                    self.logger.error("Error while parsing file '%s': %s", result_file, batch)
+                else:
+                    try:
+                        # Update employee records with feedback
+                        errors += self._parse_feedback_file(result_file, batch, dry_run)
+
+                        count += 1
+                    except Exception as ex:
+                        errors += 1
+                        self.logger.error("Error while parsing file '%s': %s", result_file, ex)
 
                 self.logger.info("Parsed %s/%s files", count, len(result_files))
 
@@ -283,21 +444,24 @@ class Command(BaseCommand):
                 # Everything was fine, will remove file after main loop
                 files_to_delete.append(result_file)
 
-            for file in files_to_delete:
-                # All employee records processed, we can delete feedback file from server
-                if dry_run:
-                    self.logger.info("DRY-RUN: Removing file '%s'", file)
-                    continue
+        for file in files_to_delete:
+            # All employee records processed, we can delete feedback file from server
+            if dry_run:
+                self.logger.info("DRY-RUN: Removing file '%s'", file)
+                continue
 
-                self.logger.info("Deleting '%s' from SFTP server", file)
+            self.logger.info("Deleting '%s' from SFTP server", file)
 
+            with conn.cd(settings.ASP_FS_REMOTE_DOWNLOAD_DIR):
                 conn.remove(file)
+            os.remove(spooled_files[file])
 
     def upload(self, sftp, dry_run):
         """
         Upload a file composed of all ready employee records
         """
-        ready_employee_records = EmployeeRecord.objects.ready()
+        # Fetch everything needed by serializers and status updates at once
+        ready_employee_records = EmployeeRecord.objects.full_fetch().ready().order_by("pk")
 
         # FIXME: temp disabled, too much impact, must be discussed
         # As requested by ASP, we can now send employee records in bigger batches
@@ -311,7 +475,7 @@ class Command(BaseCommand):
 
         self.logger.info("Starting UPLOAD")
 
-        for batch in chunks(ready_employee_records, EmployeeRecordBatch.MAX_EMPLOYEE_RECORDS):
+        for batch in self._get_batches(ready_employee_records):
             self._upload_batch_file(sftp, batch, dry_run)
 
     def archive(self, dry_run):
@@ -365,6 +529,7 @@ class Command(BaseCommand):
             self.logger.setLevel(logging.DEBUG)
 
         self.asp_test = asp_test
+        self.last_remote_path = None
         if self.asp_test:
             self.logger.info("Using *TEST* JSON serializers (SIRET number mapping)")
 
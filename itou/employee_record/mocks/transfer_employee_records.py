@@ -1,4 +1,5 @@
 import json
+import os
 import random
 from contextlib import contextmanager
 
@@ -27,6 +28,9 @@ class SFTPConnectionMock:
     def __exit__(self, _exc_type, _exc_val, _exc_tb):
         pass
 
+    def close(self):
+        pass
+
     @property
     def pwd(self):
         return "PWD"
@@ -134,3 +138,54 @@ class SFTPBadConnectionMock(SFTPGoodConnectionMock):
     @contextmanager
     def cd(self, remotepath):
         raise Exception("SFTP/CD did crash!")
+
+
+class SFTPLocalDirectoryConnectionMock:
+    """
+    Stand-in for a pysftp / paramiko SFTP Connection object, backed by a local directory.
+
+    `root` must be set by tests to the path of the directory acting as the remote server.
+    All connections share the same files, allowing to test transfers made over several connections.
+    """
+
+    root = None
+
+    def __init__(self, *args, **kwargs):
+        self.cwd = self.root
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exc_type, _exc_val, _exc_tb):
+        self.close()
+
+    def close(self):
+        pass
+
+    @property
+    def pwd(self):
+        return self.cwd
+
+    @contextmanager
+    def cd(self, remotepath):
+        previous_cwd = self.cwd
+        self.cwd = os.path.join(self.cwd, remotepath)
+        os.makedirs(self.cwd, exist_ok=True)
+        try:
+            yield
+        finally:
+            self.cwd = previous_cwd
+
+    def putfo(self, flo, remotepath, **kwargs):
+        with open(os.path.join(self.cwd, remotepath), "wb") as f:
+            f.write(flo.read())
+
+    def getfo(self, remotepath, flo, **kwargs):
+        with open(os.path.join(self.cwd, remotepath), "rb") as f:
+            return flo.write(f.read())
+
+    def listdir(self):
+        return sorted(os.listdir(self.cwd))
+
+    def remove(self, path):
+        os.remove(os.path.join(self.cwd, path))
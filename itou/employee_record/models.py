@@ -45,6 +45,7 @@ class EmployeeRecordQuerySet(models.QuerySet):
             "job_application",
             "job_application__approval",
             "job_application__to_siae",
+            "job_application__to_siae__convention",
             "job_application__job_seeker",
             "job_application__job_seeker__birth_country",
             "job_application__job_seeker__birth_place",
@@ -278,10 +279,11 @@ class EmployeeRecord(models.Model):
         self.status = self.Status.READY
         self.save()
 
-    def update_as_sent(self, asp_filename, line_number):
+    def update_as_sent(self, asp_filename, line_number, save=True):
         """
         An employee record is sent to ASP via a JSON file,
         The file name is stored for further feedback processing (also done via a file)
+        `save` parameter is for bulk updates in management command
 
         Status: READY => SENT
         """
@@ -304,11 +306,17 @@ class EmployeeRecord(models.Model):
         self.asp_batch_file = asp_filename
         self.asp_batch_line_number = line_number
         self.status = EmployeeRecord.Status.SENT
-        self.save()
 
-    def update_as_rejected(self, code, label):
+        if save:
+            self.save()
+        else:
+            # Override .save() update of `updated_at` when using bulk updates
+            self.updated_at = timezone.now()
+
+    def update_as_rejected(self, code, label, save=True):
         """
         Update status after an ASP rejection of the employee record
+        `save` parameter is for bulk updates in management command
 
         Status: SENT => REJECTED
         """
@@ -319,9 +327,20 @@ class EmployeeRecord(models.Model):
         self.status = EmployeeRecord.Status.REJECTED
         self.asp_processing_code = code
         self.asp_processing_label = label
-        self.save()
 
-    def update_as_accepted(self, code, label, archive):
+        if save:
+            self.save()
+        else:
+            # Override .save() update of `updated_at` when using bulk updates
+            self.updated_at = timezone.now()
+
+    def update_as_accepted(self, code, label, archive, save=True):
+        """
+        Update status after an ASP acceptance of the employee record
+        `save` parameter is for bulk updates in management command
+
+        Status: SENT => PROCESSED
+        """
         if not self.status == EmployeeRecord.Status.SENT:
             raise ValidationError(self.ERROR_EMPLOYEE_RECORD_INVALID_STATE)
 
@@ -331,7 +350,12 @@ class EmployeeRecord(models.Model):
         self.asp_processing_code = code
         self.asp_processing_label = label
         self.archived_json = archive
-        self.save()
+
+        if save:
+            self.save()
+        else:
+            # Override .save() update of `updated_at` when using bulk updates
+            self.updated_at = timezone.now()
 
     def update_as_archived(self, save=True):
         """
@@ -0,0 +1,148 @@
+"""
+Conversion of job seekers addresses to the HEXA format, ahead of the creation of their employee records.
+
+Converting an address calls the geocoding API: huey workers do it so that the employee record
+creation steps only read the converted address.
+- `huey_convert_hexa_addresses` periodically converts the addresses of the job seekers
+  who may soon need an employee record, geocoding them by batches beforehand;
+- `huey_update_hexa_address` converts a single address, e.g. when a job seeker was missed by the former;
+- failed conversions are kept in a retry queue (see `get_hexa_address_retry_queue`)
+  and converted again after `HEXA_ADDRESS_RETRY_DELAY`.
+"""
+import datetime
+import logging
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils import timezone
+from huey import crontab
+from huey.contrib.djhuey import db_periodic_task, db_task
+
+from itou.employee_record.models import EmployeeRecord
+from itou.job_applications.models import JobApplication
+from itou.siaes.models import Siae
+from itou.users.models import JobSeekerProfile
+from itou.utils.apis.geocoding import get_geocoding_data_many
+from itou.utils.iterators import chunks
+
+
+logger = logging.getLogger(__name__)
+
+HEXA_ADDRESS_RETRY_DELAY = datetime.timedelta(hours=6)
+
+# Profiles converted (and thus geocoded) at once.
+BATCH_SIZE = 500
+
+HEXA_ADDRESS_FIELDS = [
+    "hexa_lane_type",
+    "hexa_lane_number",
+    "hexa_std_extension",
+    "hexa_non_std_extension",
+    "hexa_lane_name",
+    "hexa_additional_address",
+    "hexa_post_code",
+    "hexa_commune",
+    "hexa_address_source",
+    "hexa_address_converted_at",
+    "hexa_address_conversion_error",
+]
+
+
+def get_candidate_profiles():
+    """
+    Profiles of the job seekers having an accepted job application which may become an employee record
+    (see `JobApplicationQuerySet.eligible_as_employee_record`).
+
+    Missing profiles are created: they would be created by the first step of the employee record creation anyway.
+    """
+    job_applications = (
+        JobApplication.objects.accepted()
+        .exclude(approval=None)
+        .filter(
+            create_employee_record=True,
+            to_siae__kind__in=Siae.ASP_EMPLOYEE_RECORD_KINDS,
+            hiring_start_at__gte=settings.EMPLOYEE_RECORD_FEATURE_AVAILABILITY_DATE,
+        )
+        .filter(
+            Q(employee_record__isnull=True)
+            | Q(employee_record__status__in=[EmployeeRecord.Status.NEW, EmployeeRecord.Status.REJECTED])
+        )
+    )
+    job_seeker_ids = set(job_applications.values_list("job_seeker_id", flat=True))
+
+    profiles = JobSeekerProfile.objects.filter(user_id__in=job_seeker_ids)
+    missing_ids = job_seeker_ids - set(profiles.values_list("user_id", flat=True))
+    JobSeekerProfile.objects.bulk_create(
+        [JobSeekerProfile(user_id=job_seeker_id) for job_seeker_id in missing_ids],
+        # Created meanwhile by the first step of the employee record creation.
+        ignore_conflicts=True,
+    )
+    return profiles.select_related("user", "hexa_commune")
+
+
+def get_hexa_address_retry_queue(profiles):
+    """
+    Profiles whose last conversion failed and which were not fixed by hand since.
+    """
+    retry_before = timezone.now() - HEXA_ADDRESS_RETRY_DELAY
+    return [
+        profile
+        for profile in profiles
+        if profile.hexa_address_conversion_error
+        and not profile.hexa_address_filled
+        and profile.hexa_address_converted_at < retry_before
+    ]
+
+
+def convert_hexa_addresses(profiles):
+    """
+    Convert the current address of the job seekers of the given profiles to the HEXA format.
+
+    Addresses are geocoded by batches beforehand: `format_address` then reads the geocoding cache.
+    Return the number of failed conversions.
+    """
+    get_geocoding_data_many(
+        {
+            (profile.user.address_line_1, profile.user.post_code)
+            for profile in profiles
+            if profile.user.address_line_1 and profile.user.post_code
+        }
+    )
+
+    failed_count = 0
+    for profile in profiles:
+        try:
+            profile.update_hexa_address(save=False)
+        except ValidationError:
+            # The address must not be mistaken for the one of the job seeker.
+            profile.clear_hexa_address(save=False)
+            failed_count += 1
+
+    JobSeekerProfile.objects.bulk_update(profiles, HEXA_ADDRESS_FIELDS)
+    return failed_count
+
+
+def convert_candidate_hexa_addresses():
+    profiles = list(get_candidate_profiles())
+    to_convert = [profile for profile in profiles if not profile.hexa_address_is_up_to_date]
+    to_retry = get_hexa_address_retry_queue([profile for profile in profiles if profile.hexa_address_is_up_to_date])
+
+    failed_count = 0
+    for profiles_chunk in chunks(to_convert + to_retry, BATCH_SIZE):
+        failed_count += convert_hexa_addresses(profiles_chunk)
+
+    logger.info("HEXA addresses: %d converted, %d retried, %d failed", len(to_convert), len(to_retry), failed_count)
+
+
+@db_periodic_task(crontab(minute="*/15"))
+def huey_convert_hexa_addresses():
+    convert_candidate_hexa_addresses()
+
+
+@db_task()
+def huey_update_hexa_address(profile_pk):
+    profile = JobSeekerProfile.objects.select_related("user").get(pk=profile_pk)
+    # Already converted meanwhile by the periodic task.
+    if not profile.hexa_address_is_up_to_date:
+        convert_hexa_addresses([profile])
@@ -1,21 +1,30 @@
 import json
+import os
+import shutil
+import tempfile
 from datetime import date, timedelta
 from unittest import mock
 
 from django.conf import settings
 from django.core import management
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
 
+from itou.common_apps.address.format import ERROR_GEOCODING_API
+from itou.employee_record import tasks
 from itou.employee_record.factories import EmployeeRecordFactory
+from itou.employee_record.management.commands import transfer_employee_records
 from itou.employee_record.mocks.transfer_employee_records import (
     SFTPBadConnectionMock,
     SFTPConnectionMock,
     SFTPEvilConnectionMock,
     SFTPGoodConnectionMock,
+    SFTPLocalDirectoryConnectionMock,
 )
 from itou.employee_record.models import EmployeeRecord, EmployeeRecordBatch, validate_asp_batch_filename
+from itou.employee_record.serializers import EmployeeRecordBatchSerializer
 from itou.job_applications.factories import (
     JobApplicationWithApprovalFactory,
     JobApplicationWithApprovalNotCancellableFactory,
@@ -24,6 +33,8 @@ from itou.job_applications.factories import (
     JobApplicationWithoutApprovalFactory,
 )
 from itou.job_applications.models import JobApplicationWorkflow
+from itou.users.factories import JobSeekerWithMockedAddressFactory
+from itou.users.models import JobSeekerProfile
 from itou.utils.mocks.address_format import mock_get_geocoding_data
 
 
@@ -323,6 +334,12 @@ class EmployeeRecordManagementCommandTest(TestCase):
         self.employee_record = employee_record
         self.job_application = job_application
 
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        spool_settings = override_settings(ASP_FS_LOCAL_SPOOL_DIR=spool_dir)
+        spool_settings.enable()
+        self.addCleanup(spool_settings.disable)
+
     @mock.patch("pysftp.Connection", SFTPConnectionMock)
     def test_smoke_download(self):
         management.call_command("transfer_employee_records", download=True)
@@ -412,6 +429,124 @@ class EmployeeRecordManagementCommandTest(TestCase):
         self.assertEqual(employee_record.status, EmployeeRecord.Status.PROCESSED)
         self.assertEqual(employee_record.asp_processing_code, "0000")
 
+    @mock.patch("pysftp.Connection", SFTPGoodConnectionMock)
+    @mock.patch(
+        "itou.common_apps.address.format.get_geocoding_data",
+        side_effect=mock_get_geocoding_data,
+    )
+    def test_upload_several_batches(self, _mock):
+        job_application = JobApplicationWithCompleteJobSeekerProfileFactory()
+        other_employee_record = EmployeeRecord.from_job_application(job_application)
+        other_employee_record.update_as_ready()
+
+        management.call_command("transfer_employee_records", upload=True, download=False)
+
+        self.employee_record.refresh_from_db()
+        other_employee_record.refresh_from_db()
+
+        # One employee record per batch file: file names must not collide
+        for employee_record in [self.employee_record, other_employee_record]:
+            self.assertEqual(employee_record.status, EmployeeRecord.Status.SENT)
+            self.assertEqual(employee_record.asp_batch_line_number, 1)
+        self.assertNotEqual(self.employee_record.asp_batch_file, other_employee_record.asp_batch_file)
+
+    @mock.patch("pysftp.Connection", SFTPGoodConnectionMock)
+    @mock.patch(
+        "itou.common_apps.address.format.get_geocoding_data",
+        side_effect=mock_get_geocoding_data,
+    )
+    def test_upload_batches_by_size(self, _mock):
+        job_application = JobApplicationWithCompleteJobSeekerProfileFactory()
+        other_employee_record = EmployeeRecord.from_job_application(job_application)
+        other_employee_record.update_as_ready()
+
+        # Size limit only allowing a single employee record per file
+        max_size_bytes = max(
+            len(JSONRenderer().render(EmployeeRecordBatchSerializer(EmployeeRecordBatch([employee_record])).data))
+            for employee_record in EmployeeRecord.objects.full_fetch().ready()
+        )
+
+        with mock.patch("itou.employee_record.models.EmployeeRecordBatch.MAX_EMPLOYEE_RECORDS", new=700):
+            with mock.patch("itou.employee_record.models.EmployeeRecordBatch.MAX_SIZE_BYTES", new=max_size_bytes):
+                management.call_command("transfer_employee_records", upload=True, download=False)
+
+        self.employee_record.refresh_from_db()
+        other_employee_record.refresh_from_db()
+
+        for employee_record in [self.employee_record, other_employee_record]:
+            self.assertEqual(employee_record.status, EmployeeRecord.Status.SENT)
+            self.assertEqual(employee_record.asp_batch_line_number, 1)
+        self.assertNotEqual(self.employee_record.asp_batch_file, other_employee_record.asp_batch_file)
+
+    @mock.patch("pysftp.Connection", SFTPGoodConnectionMock)
+    @mock.patch(
+        "itou.common_apps.address.format.get_geocoding_data",
+        side_effect=mock_get_geocoding_data,
+    )
+    def test_upload_single_batch(self, _mock):
+        job_application = JobApplicationWithCompleteJobSeekerProfileFactory()
+        other_employee_record = EmployeeRecord.from_job_application(job_application)
+        other_employee_record.update_as_ready()
+
+        with mock.patch("itou.employee_record.models.EmployeeRecordBatch.MAX_EMPLOYEE_RECORDS", new=700):
+            management.call_command("transfer_employee_records", upload=True, download=False)
+
+        self.employee_record.refresh_from_db()
+        other_employee_record.refresh_from_db()
+
+        # Both employee records are sent in the same file, in creation order
+        self.assertEqual(self.employee_record.status, EmployeeRecord.Status.SENT)
+        self.assertEqual(other_employee_record.status, EmployeeRecord.Status.SENT)
+        self.assertEqual(self.employee_record.asp_batch_file, other_employee_record.asp_batch_file)
+        self.assertEqual(self.employee_record.asp_batch_line_number, 1)
+        self.assertEqual(other_employee_record.asp_batch_line_number, 2)
+
+    @mock.patch(
+        "itou.common_apps.address.format.get_geocoding_data",
+        side_effect=mock_get_geocoding_data,
+    )
+    def test_parse_feedback_file(self, _mock):
+        filename = "RIAE_FS_20210819100001.json"
+        feedback_filename = EmployeeRecordBatch.feedback_filename(filename)
+        self.employee_record.update_as_sent(filename, 1)
+
+        job_application = JobApplicationWithCompleteJobSeekerProfileFactory()
+        other_employee_record = EmployeeRecord.from_job_application(job_application)
+        other_employee_record.update_as_ready()
+        other_employee_record.update_as_sent(filename, 2)
+
+        batch = {
+            "lignesTelechargement": [
+                {"numLigne": 1, "codeTraitement": "0000", "libelleTraitement": "OK"},
+                {"numLigne": 2, "codeTraitement": "3436", "libelleTraitement": "Doublon"},
+                {"numLigne": 3, "codeTraitement": "0000", "libelleTraitement": "OK"},
+            ]
+        }
+        command = transfer_employee_records.Command()
+
+        # Line 3 does not match any employee record
+        self.assertEqual(command._parse_feedback_file(feedback_filename, batch, dry_run=False), 1)
+
+        self.employee_record.refresh_from_db()
+        self.assertEqual(self.employee_record.status, EmployeeRecord.Status.PROCESSED)
+        self.assertEqual(self.employee_record.asp_processing_code, "0000")
+        self.assertEqual(json.loads(self.employee_record.archived_json).get("codeTraitement"), "0000")
+
+        other_employee_record.refresh_from_db()
+        self.assertEqual(other_employee_record.status, EmployeeRecord.Status.REJECTED)
+        self.assertEqual(other_employee_record.asp_processing_code, "3436")
+        self.assertEqual(other_employee_record.asp_processing_label, "Doublon")
+
+        # Processing the same file again changes nothing
+        updated_at = [self.employee_record.updated_at, other_employee_record.updated_at]
+        self.assertEqual(command._parse_feedback_file(feedback_filename, batch, dry_run=False), 1)
+
+        self.employee_record.refresh_from_db()
+        other_employee_record.refresh_from_db()
+        self.assertEqual(self.employee_record.status, EmployeeRecord.Status.PROCESSED)
+        self.assertEqual(other_employee_record.status, EmployeeRecord.Status.REJECTED)
+        self.assertEqual([self.employee_record.updated_at, other_employee_record.updated_at], updated_at)
+
     @mock.patch("pysftp.Connection", SFTPGoodConnectionMock)
     @mock.patch(
         "itou.common_apps.address.format.get_geocoding_data",
@@ -490,6 +625,97 @@ class EmployeeRecordManagementCommandTest(TestCase):
         self.assertIsNone(self.employee_record.archived_json)
 
 
+class EmployeeRecordDownloadTest(TestCase):
+    """
+    Download of feedback files, with a local directory acting as the SFTP server
+    """
+
+    fixtures = ["test_INSEE_communes.json", "test_asp_INSEE_countries.json"]
+
+    batch_filename = "RIAE_FS_20210819100001.json"
+
+    @mock.patch(
+        "itou.common_apps.address.format.get_geocoding_data",
+        side_effect=mock_get_geocoding_data,
+    )
+    def setUp(self, _mock):
+        job_application = JobApplicationWithCompleteJobSeekerProfileFactory()
+        self.employee_record = EmployeeRecord.from_job_application(job_application)
+        self.employee_record.update_as_ready()
+        self.employee_record.update_as_sent(self.batch_filename, 1)
+
+        self.remote_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.remote_dir)
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir)
+
+        spool_settings = override_settings(ASP_FS_LOCAL_SPOOL_DIR=self.spool_dir, ASP_FS_SFTP_POOL_SIZE=2)
+        spool_settings.enable()
+        self.addCleanup(spool_settings.disable)
+        root_patcher = mock.patch.object(SFTPLocalDirectoryConnectionMock, "root", self.remote_dir)
+        root_patcher.start()
+        self.addCleanup(root_patcher.stop)
+
+        self.download_dir = os.path.join(self.remote_dir, settings.ASP_FS_REMOTE_DOWNLOAD_DIR)
+        os.makedirs(self.download_dir)
+
+    def write_feedback_file(self, path, filename, content):
+        with open(os.path.join(path, EmployeeRecordBatch.feedback_filename(filename)), "w") as f:
+            f.write(content)
+
+    def feedback_content(self, line_number=1):
+        return json.dumps(
+            {"lignesTelechargement": [{"numLigne": line_number, "codeTraitement": "0000", "libelleTraitement": "OK"}]}
+        )
+
+    @mock.patch("pysftp.Connection", SFTPLocalDirectoryConnectionMock)
+    @mock.patch(
+        "itou.common_apps.address.format.get_geocoding_data",
+        side_effect=mock_get_geocoding_data,
+    )
+    def test_download_errors_per_file(self, _mock):
+        # Sorted before the good file: it must not prevent its deletion
+        broken_filename = "RIAE_FS_20210819100000.json"
+        unknown_line_filename = "RIAE_FS_20210819100002.json"
+        self.write_feedback_file(self.download_dir, broken_filename, "{")
+        self.write_feedback_file(self.download_dir, self.batch_filename, self.feedback_content())
+        self.write_feedback_file(self.download_dir, unknown_line_filename, self.feedback_content())
+
+        management.call_command("transfer_employee_records", upload=False, download=True)
+
+        self.employee_record.refresh_from_db()
+        self.assertEqual(self.employee_record.status, EmployeeRecord.Status.PROCESSED)
+
+        # Only the successfully processed file is deleted, both on the server and in the spool
+        remaining_filenames = [
+            EmployeeRecordBatch.feedback_filename(broken_filename),
+            EmployeeRecordBatch.feedback_filename(unknown_line_filename),
+        ]
+        self.assertEqual(sorted(os.listdir(self.download_dir)), remaining_filenames)
+        self.assertEqual(sorted(os.listdir(self.spool_dir)), remaining_filenames)
+
+    @mock.patch("pysftp.Connection", SFTPLocalDirectoryConnectionMock)
+    @mock.patch(
+        "itou.common_apps.address.format.get_geocoding_data",
+        side_effect=mock_get_geocoding_data,
+    )
+    def test_download_resumes_from_spool(self, _mock):
+        # A file downloaded by a previous run is not downloaded again
+        self.write_feedback_file(self.download_dir, self.batch_filename, "garbage")
+        self.write_feedback_file(self.spool_dir, self.batch_filename, self.feedback_content())
+        # Leftovers of an interrupted run
+        self.write_feedback_file(self.spool_dir, "RIAE_FS_20210819100003.json", self.feedback_content())
+        with open(os.path.join(self.spool_dir, "RIAE_FS_20210819100004_FichierRetour.json.tmp"), "w") as f:
+            f.write("{")
+
+        management.call_command("transfer_employee_records", upload=False, download=True)
+
+        self.employee_record.refresh_from_db()
+        self.assertEqual(self.employee_record.status, EmployeeRecord.Status.PROCESSED)
+        self.assertEqual(os.listdir(self.download_dir), [])
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+
 class JobApplicationConstraintsTest(TestCase):
     """
     Check constraints between job applications and employee records
@@ -536,3 +762,73 @@ class JobApplicationConstraintsTest(TestCase):
         process_code, process_message = "0000", "La ligne de la fiche salarié a été enregistrée avec succès."
         self.employee_record.update_as_accepted(process_code, process_message, "{}")
         self.assertFalse(self.job_application.can_be_cancelled)
+
+
+class HexaAddressTasksTest(TestCase):
+
+    fixtures = ["test_INSEE_communes.json"]
+
+    def setUp(self):
+        job_application = JobApplicationWithApprovalNotCancellableFactory(
+            job_seeker=JobSeekerWithMockedAddressFactory()
+        )
+        self.job_seeker = job_application.job_seeker
+
+    @mock.patch(
+        "itou.common_apps.address.format.get_geocoding_data",
+        side_effect=mock_get_geocoding_data,
+    )
+    def test_convert_candidate_hexa_addresses(self, _mock):
+        tasks.convert_candidate_hexa_addresses()
+
+        # Profile is created if needed
+        profile = JobSeekerProfile.objects.get(user=self.job_seeker)
+        self.assertTrue(profile.hexa_address_filled)
+        self.assertTrue(profile.hexa_address_is_up_to_date)
+        self.assertEqual(profile.hexa_address_conversion_error, "")
+        _mock.assert_called_once()
+
+        # Already converted
+        tasks.convert_candidate_hexa_addresses()
+        tasks.huey_update_hexa_address.call_local(profile.pk)
+        _mock.assert_called_once()
+
+        # Job seeker has moved
+        self.job_seeker.address_line_2 = "Bat A"
+        self.job_seeker.save()
+        tasks.convert_candidate_hexa_addresses()
+        self.assertEqual(_mock.call_count, 2)
+
+        # An address entered by hand is kept
+        profile.refresh_from_db()
+        profile.hexa_lane_name = "des colonies"
+        profile.set_hexa_address_entered_by_hand()
+        tasks.convert_candidate_hexa_addresses()
+        profile.refresh_from_db()
+        self.assertEqual(profile.hexa_lane_name, "des colonies")
+        self.assertEqual(_mock.call_count, 2)
+
+    def test_retry_queue(self):
+        # No mock: the address can not be geocoded
+        tasks.convert_candidate_hexa_addresses()
+
+        profile = JobSeekerProfile.objects.get(user=self.job_seeker)
+        self.assertFalse(profile.hexa_address_filled)
+        self.assertTrue(profile.hexa_address_is_up_to_date)
+        self.assertEqual(profile.hexa_address_conversion_error, ERROR_GEOCODING_API)
+        self.assertEqual(tasks.get_hexa_address_retry_queue([profile]), [])
+
+        profile.hexa_address_converted_at -= tasks.HEXA_ADDRESS_RETRY_DELAY
+        profile.save()
+        self.assertEqual(tasks.get_hexa_address_retry_queue([profile]), [profile])
+
+        with mock.patch(
+            "itou.common_apps.address.format.get_geocoding_data",
+            side_effect=mock_get_geocoding_data,
+        ):
+            tasks.convert_candidate_hexa_addresses()
+
+        profile.refresh_from_db()
+        self.assertTrue(profile.hexa_address_filled)
+        self.assertEqual(profile.hexa_address_conversion_error, "")
+        self.assertEqual(tasks.get_hexa_address_retry_queue([profile]), [])
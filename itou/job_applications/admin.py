@@ -98,7 +98,7 @@ class JobApplicationTransitionLogAdmin(admin.ModelAdmin):
 @admin.register(models.JobApplicationPoleEmploiNotificationLog)
 class JobApplicationPoleEmploiNotificationLogAdmin(admin.ModelAdmin):
     actions = None
-    list_display = ("id", "created_at", "status", "details", "job_application")
+    list_display = ("id", "created_at", "status", "details", "attempt", "retry_at", "job_application")
     list_filter = ("status",)
-    readonly_fields = ("created_at", "updated_at", "status", "details")
+    readonly_fields = ("created_at", "updated_at", "status", "details", "mode", "attempt", "retry_at")
     raw_id_fields = ("job_application",)
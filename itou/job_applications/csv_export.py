@@ -1,5 +1,9 @@
 import csv
 
+from itou.approvals.models import bulk_approvals_status
+from itou.eligibility.models import EligibilityDiagnosis
+from itou.utils.iterators import queryset_chunks
+
 
 JOB_APPLICATION_CSV_HEADERS = [
     "Nom candidat",
@@ -54,18 +58,25 @@ def _get_selected_jobs(job_application):
     return selected_jobs
 
 
-def _get_eligibility_status(job_application):
-    eligibility = "non"
-    # Eligibility diagnoses made by SIAE are ignored.
-    if job_application.job_seeker.has_valid_diagnosis():
-        eligibility = "oui"
-
-    return eligibility
+def _get_job_seekers_with_valid_diagnosis(job_seekers):
+    """
+    Returns the ids of the given job seekers having a valid diagnosis made by a prescriber.
+    Eligibility diagnoses made by SIAE are ignored.
+    """
+    return set(
+        EligibilityDiagnosis.objects.valid()
+        .by_author_kind_prescriber()
+        .filter(job_seeker__in=job_seekers)
+        .values_list("job_seeker_id", flat=True)
+    )
 
 
-def _job_application_as_dict(job_application):
+def _job_application_as_dict(job_application, approval, has_valid_diagnosis):
     """
     The main CSV export mthod: it converts a JobApplication into a CSV array data
+
+    `approval` is the valid latest approval of the job seeker if any, and `has_valid_diagnosis`
+    tells if the job seeker has a valid diagnosis made by a prescriber: see `_iter_rows`.
     """
     job_seeker = job_application.job_seeker
     siae = job_application.to_siae
@@ -73,12 +84,14 @@ def _job_application_as_dict(job_application):
     numero_pass_iae = ""
     approval_start_date = None
     approval_end_date = None
-    if job_seeker.approvals_wrapper.has_valid and job_seeker.approvals_wrapper.latest_approval is not None:
-        approval = job_seeker.approvals_wrapper.latest_approval
+    if approval is not None:
         numero_pass_iae = approval.number
         approval_start_date = approval.start_at
         approval_end_date = approval.end_at
 
+    # A diagnosis is considered valid for the duration of an approval, see `has_considered_valid`.
+    eligibility = "oui" if approval is not None or has_valid_diagnosis else "non"
+
     return {
         "Nom candidat": job_seeker.last_name,
         "Prénom candidat": job_seeker.first_name,
@@ -98,22 +111,67 @@ def _job_application_as_dict(job_application):
         "Dates de début d’embauche": _format_date(job_application.hiring_start_at),
         "Dates de fin d’embauche": _format_date(job_application.hiring_end_at),
         "Motifs de refus": job_application.get_refusal_reason_display(),
-        "Éligibilité IAE validée": _get_eligibility_status(job_application),
+        "Éligibilité IAE validée": eligibility,
         "Numéro PASS IAE": numero_pass_iae,
         "Début PASS IAE": _format_date(approval_start_date),
         "Fin PASS IAE": _format_date(approval_end_date),
     }
 
 
-def generate_csv_export(job_applications, stream):
+def _iter_rows(job_applications, chunk_size):
     """
-    Takes a list of job application, converts them to CSV and writes them in the provided stream
-    The stream can be for instance an http response, a string (io.StringIO()) or a file
+    Yields lists of CSV rows, one list per chunk of job applications.
+
+    Job applications are fetched with keyset pagination, which keeps their prefetched related objects,
+    and approvals and diagnoses are resolved in bulk for each chunk instead of for each row.
+    """
+    for chunk in queryset_chunks(job_applications, chunk_size=chunk_size, ordering=("-created_at", "pk")):
+        job_seekers = {job_application.job_seeker_id: job_application.job_seeker for job_application in chunk}
+        job_seekers = list(job_seekers.values())
+        approvals_status = bulk_approvals_status(job_seekers)
+        valid_approvals = {
+            job_seeker_id: approvals_wrapper.latest_approval
+            for job_seeker_id, approvals_wrapper in approvals_status.items()
+            if approvals_wrapper.has_valid
+        }
+        job_seekers_with_valid_diagnosis = _get_job_seekers_with_valid_diagnosis(job_seekers)
+        yield [
+            _job_application_as_dict(
+                job_application,
+                valid_approvals.get(job_application.job_seeker_id),
+                job_application.job_seeker_id in job_seekers_with_valid_diagnosis,
+            )
+            for job_application in chunk
+        ]
+
+
+class _Echo:
     """
+    An object implementing just the write method of the file-like interface:
+    csv writers then return the lines they would have written.
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_csv_export(job_applications, chunk_size=1000):
+    """
+    Takes a list of job application and yields their CSV export piece by piece,
+    e.g. as the content of a `StreamingHttpResponse`: the download starts immediately and memory use stays flat
+    whatever the number of job applications.
+    """
+    writer = csv.DictWriter(_Echo(), quoting=csv.QUOTE_ALL, fieldnames=JOB_APPLICATION_CSV_HEADERS)
 
-    rows = [_job_application_as_dict(job_application) for job_application in job_applications.iterator()]
+    yield writer.writeheader()
+    for rows in _iter_rows(job_applications, chunk_size):
+        yield "".join(writer.writerow(row) for row in rows)
 
-    writer = csv.DictWriter(stream, quoting=csv.QUOTE_ALL, fieldnames=JOB_APPLICATION_CSV_HEADERS)
 
-    writer.writeheader()
-    writer.writerows(rows)
+def generate_csv_export(job_applications, stream):
+    """
+    Takes a list of job application, converts them to CSV and writes them in the provided stream
+    The stream can be for instance an http response, a string (io.StringIO()) or a file
+    """
+    for content in iter_csv_export(job_applications):
+        stream.write(content)
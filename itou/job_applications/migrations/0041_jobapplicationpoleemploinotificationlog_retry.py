@@ -0,0 +1,30 @@
+# Generated by Django 4.0.1 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("job_applications", "0040_jobapplication_create_employee_record"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="jobapplicationpoleemploinotificationlog",
+            name="mode",
+            field=models.CharField(default="A", max_length=1, verbose_name="Statut du PASS IAE transmis"),
+        ),
+        migrations.AddField(
+            model_name="jobapplicationpoleemploinotificationlog",
+            name="attempt",
+            field=models.PositiveSmallIntegerField(default=1, verbose_name="Numéro de la tentative"),
+        ),
+        migrations.AddField(
+            model_name="jobapplicationpoleemploinotificationlog",
+            name="retry_at",
+            field=models.DateTimeField(
+                blank=True, db_index=True, null=True, verbose_name="Date de la prochaine tentative"
+            ),
+        ),
+    ]
@@ -1,7 +1,6 @@
 import datetime
 import logging
 import uuid
-from time import sleep
 
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
@@ -869,6 +868,13 @@ class JobApplication(xwf_models.WorkflowEnabled, models.Model):
         return False
 
     def _notify_pole_employ(self, mode: str) -> bool:
+        log = self.get_pole_emploi_notification_log(mode)
+        if log is None:
+            return False
+        log.save()
+        return log.status == JobApplicationPoleEmploiNotificationLog.STATUS_OK
+
+    def get_pole_emploi_notification_log(self, mode: str, attempt: int = 1):
         """
         The entire logic for notifying Pole Emploi when a job_application is accepted:
             - first, we authenticate to pole-emploi.io with the proper credentials, scopes, environment and
@@ -878,63 +884,64 @@ class JobApplication(xwf_models.WorkflowEnabled, models.Model):
             We provide what we have about this job application.
 
         This is VERY error prone and can break in a lot of places. PE’s servers can be down, we may not find
-        the job_seeker, the update may fail for various reasons. The rate limiting is low, hence…
-        those terrible `sleep` for lack of a better idea for now.
+        the job_seeker, the update may fail for various reasons. The rate limiting is low: calls wait for
+        the rate limiter shared by the process (see `itou.utils.apis.pole_emploi.rate_limiter`).
 
         In order to ensure the rest of the application process will behave properly no matter what happens here:
          - there is a lot of broad exception catching
-         - we keep logs of the successful/failed attempts
+         - we keep logs of the successful/failed attempts, failures due to PE are retried later
          - when anything break, we quit early
+
+        Return the notification log, unsaved, or None when there is nothing to notify.
+        Apart from the related objects (approval, job seeker and SIAE), no query is made:
+        notifications can be sent from many threads at once (see `tasks.notify_pole_emploi`).
         """
         # We do not send approvals that start in the future to PE, because the information system in front
         # can’t handle them. I’ll keep my opinion about this for talks that involve an unreasonnable amount of beer.
-        # Another mechanism will be in charge of sending them on their start date
+        # They are sent on their start date by `tasks.huey_notify_pole_emploi_pending`.
         if self.approval.start_at > timezone.now().date():
-            return False
+            return None
         individual = PoleEmploiIndividu.from_job_seeker(self.job_seeker)
         if individual is None or not individual.is_valid():
             # We may not have a valid user (missing NIR, for instance),
             # in which case we can bypass this process entirely
-            return False
+            return None
         log = JobApplicationPoleEmploiNotificationLog(
-            job_application=self, status=JobApplicationPoleEmploiNotificationLog.STATUS_OK
+            job_application=self,
+            mode=mode,
+            attempt=attempt,
+            status=JobApplicationPoleEmploiNotificationLog.STATUS_OK,
         )
         # Step 1: we get the API token
         try:
             token = JobApplicationPoleEmploiNotificationLog.get_token()
-            sleep(1)
         except Exception as e:
             log.status = JobApplicationPoleEmploiNotificationLog.STATUS_FAIL_AUTHENTICATION
             log.details = str(e)
-            log.save()
-            return False
+            log.schedule_retry()
+            return log
         # Step 2 : we fetch the encrypted NIR
         try:
             encrypted_nir = JobApplicationPoleEmploiNotificationLog.get_encrypted_nir_from_individual(
                 individual, token
             )
-            # 3 requests/second max. I had timeout issues so 1 second takes some margins
-            sleep(1)
         except PoleEmploiMiseAJourPassIAEException as e:
-            log = JobApplicationPoleEmploiNotificationLog(
-                job_application=self,
-                status=JobApplicationPoleEmploiNotificationLog.STATUS_FAIL_SEARCH_INDIVIDUAL,
-                details=f"{e.http_code} {e.response_code}",
-            )
-            log.save()
-            return False
+            log.status = JobApplicationPoleEmploiNotificationLog.STATUS_FAIL_SEARCH_INDIVIDUAL
+            log.details = f"{e.http_code} {e.response_code}"
+            if JobApplicationPoleEmploiNotificationLog.is_transient_failure(e.http_code):
+                log.schedule_retry()
+            return log
         # Step 3: we finally notify Pole Emploi that something happened for this user
         try:
             mise_a_jour_pass_iae(self, mode, encrypted_nir, token)
-            sleep(1)
         except PoleEmploiMiseAJourPassIAEException as e:
             log.status = JobApplicationPoleEmploiNotificationLog.STATUS_FAIL_NOTIFY_POLE_EMPLOI
             log.details = f"{e.http_code} {e.response_code}"
-            log.save()
-            return False
+            if JobApplicationPoleEmploiNotificationLog.is_transient_failure(e.http_code):
+                log.schedule_retry()
+            return log
 
-        log.save()
-        return True
+        return log
 
 
 class JobApplicationTransitionLog(xwf_models.BaseTransitionLog):
@@ -984,6 +991,13 @@ class JobApplicationPoleEmploiNotificationLog(models.Model):
 
     status = models.CharField(verbose_name="Motifs d’erreurs", max_length=30, choices=STATUS_CHOICES, blank=True)
     details = models.TextField(verbose_name="Précisions concernant le comportement obtenu", blank=True)
+    mode = models.CharField(
+        verbose_name="Statut du PASS IAE transmis", max_length=1, default=POLE_EMPLOI_PASS_APPROVED
+    )
+    attempt = models.PositiveSmallIntegerField(verbose_name="Numéro de la tentative", default=1)
+    retry_at = models.DateTimeField(
+        verbose_name="Date de la prochaine tentative", blank=True, null=True, db_index=True
+    )
 
     job_application = models.ForeignKey(
         "job_applications.JobApplication", verbose_name="Candidature", null=True, blank=True, on_delete=models.SET_NULL
@@ -1002,6 +1016,30 @@ class JobApplicationPoleEmploiNotificationLog(models.Model):
 
     API_DATE_FORMAT = "%Y-%m-%d"
 
+    # Delays before each retry of a notification which failed because of PE's servers.
+    RETRY_DELAYS = [
+        datetime.timedelta(minutes=15),
+        datetime.timedelta(hours=1),
+        datetime.timedelta(hours=6),
+        datetime.timedelta(days=1),
+    ]
+
+    @staticmethod
+    def is_transient_failure(http_code) -> bool:
+        """
+        PE's servers being unreachable, overloaded or down, unlike a job seeker unknown to PE for instance.
+        """
+        try:
+            http_code = int(http_code)
+        except (TypeError, ValueError):
+            # No response at all.
+            return True
+        return http_code == 429 or http_code >= 500
+
+    def schedule_retry(self):
+        if self.attempt <= len(self.RETRY_DELAYS):
+            self.retry_at = timezone.now() + self.RETRY_DELAYS[self.attempt - 1]
+
     @staticmethod
     def get_token() -> str:
         """returns the necessary token for Updating PoleEmploi, or raise exceptions"""
@@ -1,6 +1,140 @@
-from huey.contrib.djhuey import db_task
+"""
+Notification of Pôle emploi when a job application is accepted (see `JobApplication.get_pole_emploi_notification_log`).
+
+- `huey_notify_pole_employ` notifies PE as soon as a job application is accepted;
+- `huey_notify_pole_emploi_pending` periodically notifies PE of the approvals which started since
+  and retries the failed notifications once their `retry_at` is reached.
+
+Notifications are sent by many threads at once: the PE token is shared by all of them (see `esd.get_access_token`)
+and their calls wait for the rate limiter of the process (see `pole_emploi.rate_limiter`).
+Notification logs are only written by the calling thread.
+"""
+import concurrent.futures
+import datetime
+import logging
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from huey import crontab
+from huey.contrib.djhuey import db_periodic_task, db_task
+
+
+logger = logging.getLogger(__name__)
+
+# Threads waiting for PE's responses, the rate limiter makes sure they don't exceed PE's budget.
+MAX_WORKERS = 4
+
+# Notifications sent by a run of the periodic task, i.e. about 3 minutes at 3 requests per second.
+BATCH_SIZE = 300
+
+# Approvals which started during this period and were never notified are notified by the periodic task.
+PENDING_PERIOD = datetime.timedelta(days=7)
+# Leaves time to `huey_notify_pole_employ` to notify newly accepted job applications.
+PENDING_DELAY = datetime.timedelta(hours=1)
 
 
 @db_task()
 def huey_notify_pole_employ(self, mode: str):
     return self._notify_pole_employ(mode)
+
+
+def get_pending_job_applications():
+    """
+    Accepted job applications whose approval started during the last `PENDING_PERIOD`
+    and which were never notified, e.g. their approval started in the future when they were accepted.
+
+    Job seekers PE can't be searched for are left out (see `PoleEmploiIndividu.is_valid`):
+    no log is written for them, they would otherwise come back on every run.
+    """
+    # We need to import here in order to avoid circular reference.
+    from itou.job_applications.models import JobApplication
+
+    today = timezone.localdate()
+    return (
+        JobApplication.objects.accepted()
+        .filter(
+            approval__start_at__range=(today - PENDING_PERIOD, today),
+            approval__created_at__lt=timezone.now() - PENDING_DELAY,
+            jobapplicationpoleemploinotificationlog=None,
+            job_seeker__birthdate__isnull=False,
+            # PE is searched by the first 13 digits of the NIR.
+            job_seeker__nir__regex=r"^.{13}",
+        )
+        .exclude(job_seeker__first_name="")
+        .exclude(job_seeker__last_name="")
+        .select_related("approval", "job_seeker", "to_siae")
+    )
+
+
+def get_notifications_to_retry():
+    from itou.job_applications.models import JobApplicationPoleEmploiNotificationLog
+
+    return JobApplicationPoleEmploiNotificationLog.objects.filter(
+        retry_at__lte=timezone.now(), job_application__isnull=False
+    ).select_related("job_application__approval", "job_application__job_seeker", "job_application__to_siae")
+
+
+def notify_pole_emploi(notifications, max_workers=MAX_WORKERS):
+    """
+    Notify PE of the given `(job_application, mode, attempt)`, `max_workers` at a time.
+    Return the notification logs, saved.
+    """
+    from itou.job_applications.models import JobApplicationPoleEmploiNotificationLog
+
+    def notify(notification):
+        job_application, mode, attempt = notification
+        try:
+            return job_application.get_pole_emploi_notification_log(mode, attempt)
+        except Exception as e:
+            # We never want to lose a notification.
+            logger.exception("Failed to notify PE of job application %s", job_application.pk)
+            log = JobApplicationPoleEmploiNotificationLog(
+                job_application=job_application,
+                mode=mode,
+                attempt=attempt,
+                status=JobApplicationPoleEmploiNotificationLog.STATUS_TECHNICAL_FAILURE,
+                details=str(e),
+            )
+            log.schedule_retry()
+            return log
+        finally:
+            # Each thread has its own database connection.
+            connection.close()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        logs = [log for log in executor.map(notify, notifications) if log is not None]
+    return JobApplicationPoleEmploiNotificationLog.objects.bulk_create(logs)
+
+
+def notify_pole_emploi_pending(max_workers=MAX_WORKERS):
+    from itou.job_applications.models import JobApplicationPoleEmploiNotificationLog
+    from itou.utils.apis.pole_emploi import POLE_EMPLOI_PASS_APPROVED
+
+    failed_logs = list(get_notifications_to_retry().order_by("retry_at")[:BATCH_SIZE])
+    notifications = [(log.job_application, log.mode, log.attempt + 1) for log in failed_logs]
+    pending_job_applications = get_pending_job_applications().order_by("approval__start_at")
+    notifications += [
+        (job_application, POLE_EMPLOI_PASS_APPROVED, 1)
+        for job_application in pending_job_applications[: BATCH_SIZE - len(failed_logs)]
+    ]
+
+    logs = notify_pole_emploi(notifications, max_workers=max_workers)
+    # Whatever their outcome, failed notifications are retried once: the new logs hold the next retries.
+    JobApplicationPoleEmploiNotificationLog.objects.filter(pk__in=[log.pk for log in failed_logs]).update(
+        retry_at=None, updated_at=timezone.now()
+    )
+
+    failed_count = sum(log.status != JobApplicationPoleEmploiNotificationLog.STATUS_OK for log in logs)
+    logger.info(
+        "PE notifications: %d retried, %d pending, %d failed",
+        len(failed_logs),
+        len(notifications) - len(failed_logs),
+        failed_count,
+    )
+
+
+@db_periodic_task(crontab(minute="*/5"))
+def huey_notify_pole_emploi_pending():
+    if settings.API_ESD_SHOULD_PERFORM_MISE_A_JOUR_PASS:
+        notify_pole_emploi_pending()
@@ -5,18 +5,21 @@ from unittest.mock import ANY, PropertyMock, patch
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
 from django.core import mail
+from django.db import connection
 from django.template.defaultfilters import title
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from django_xworkflows import models as xwf_models
 
 from itou.approvals.factories import ApprovalFactory, PoleEmploiApprovalFactory
+from itou.approvals.models import Approval
 from itou.eligibility.factories import EligibilityDiagnosisFactory, EligibilityDiagnosisMadeBySiaeFactory
 from itou.eligibility.models import EligibilityDiagnosis
 from itou.employee_record.factories import EmployeeRecordFactory
 from itou.employee_record.models import EmployeeRecord
-from itou.job_applications.csv_export import generate_csv_export
+from itou.job_applications.csv_export import generate_csv_export, iter_csv_export
 from itou.job_applications.factories import (
     JobApplicationFactory,
     JobApplicationSentByAuthorizedPrescriberOrganizationFactory,
@@ -34,6 +37,7 @@ from itou.job_applications.models import (
     JobApplicationWorkflow,
 )
 from itou.job_applications.notifications import NewQualifiedJobAppEmployersNotification
+from itou.job_applications.tasks import get_pending_job_applications, notify_pole_emploi, notify_pole_emploi_pending
 from itou.jobs.factories import create_test_romes_and_appellations
 from itou.jobs.models import Appellation
 from itou.siaes.factories import SiaeFactory, SiaeWithMembershipAndJobsFactory
@@ -1198,6 +1202,53 @@ class JobApplicationCsvExportTest(TestCase):
         self.assertIn("Candidature déclinée", csv_output.getvalue())
         self.assertIn("Candidat non venu ou non joignable", csv_output.getvalue())
 
+    def test_csv_export_with_pole_emploi_approval(self, *args, **kwargs):
+        job_seeker = JobSeekerFactory()
+        pe_approval = PoleEmploiApprovalFactory(
+            pole_emploi_id=job_seeker.pole_emploi_id, birthdate=job_seeker.birthdate
+        )
+        JobApplicationFactory(job_seeker=job_seeker)
+
+        csv_output = io.StringIO()
+        generate_csv_export(JobApplication.objects.with_list_related_data(), csv_output)
+
+        self.assertIn(pe_approval.number, csv_output.getvalue())
+        self.assertIn(pe_approval.start_at.strftime("%d/%m/%Y"), csv_output.getvalue())
+        # A valid approval implies a valid eligibility.
+        self.assertIn('"oui"', csv_output.getvalue())
+
+    def test_csv_export_queries_count(self, *args, **kwargs):
+        """
+        Approvals and eligibility diagnoses are fetched in bulk: the number of queries
+        does not depend on the number of job applications.
+        """
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as context:
+                rows = list(iter_csv_export(JobApplication.objects.with_list_related_data()))
+            # Header and a single chunk.
+            self.assertEqual(len(rows), 2)
+            return len(context.captured_queries)
+
+        JobApplicationWithApprovalFactory()
+        JobApplicationSentByPrescriberFactory()
+        num_queries = count_queries()
+
+        JobApplicationWithApprovalFactory.create_batch(3)
+        JobApplicationSentByPrescriberFactory.create_batch(3)
+        self.assertEqual(count_queries(), num_queries)
+
+    def test_iter_csv_export_chunks(self, *args, **kwargs):
+        JobApplicationFactory.create_batch(3)
+
+        contents = list(iter_csv_export(JobApplication.objects.with_list_related_data(), chunk_size=2))
+
+        # Header and 2 chunks.
+        self.assertEqual(len(contents), 3)
+        csv_output = io.StringIO()
+        generate_csv_export(JobApplication.objects.with_list_related_data(), csv_output)
+        self.assertEqual("".join(contents), csv_output.getvalue())
+
 
 class JobApplicationPoleEmploiNotificationLogTest(TestCase):
     """Test that the notification system for Pole Emploi works as expected."""
@@ -1246,8 +1297,6 @@ class JobApplicationPoleEmploiNotificationLogTest(TestCase):
         self.assertEqual(encrypted_nir, self.sample_individual_search_failure.id_national_demandeur)
 
 
-# We patch sleep since it is used in the real calls, but we don’t want to slow down the tests
-@patch("itou.job_applications.models.sleep", return_value=False)
 class JobApplicationNotifyPoleEmploiIntegrationTest(TestCase):
     """
     Integration test to ensure that the entire pole emploi process works as expected. We want to document:
@@ -1264,7 +1313,7 @@ class JobApplicationNotifyPoleEmploiIntegrationTest(TestCase):
     sample_pole_emploi_individual = PoleEmploiIndividu("john", "doe", datetime.date(1987, 5, 8), "1870275051055")
 
     @patch("itou.job_applications.models.get_access_token", return_value=token)
-    def test_invalid_job_seeker_for_pole_emploi(self, access_token_mock, sleep_mock):
+    def test_invalid_job_seeker_for_pole_emploi(self, access_token_mock):
         """
         Error case: our job seeker is not valid (from PoleEmploi’s point of view: here, the NIR is missing)
          - We do not even call the APIs
@@ -1288,7 +1337,7 @@ class JobApplicationNotifyPoleEmploiIntegrationTest(TestCase):
         return_value=encrypted_nir,
     )
     @patch("itou.job_applications.models.get_access_token", return_value=token)
-    def test_notification_accepted_nominal(self, access_token_mock, nir_mock, maj_mock, sleep_mock):
+    def test_notification_accepted_nominal(self, access_token_mock, nir_mock, maj_mock):
         """
         Nominal scenario: we sent a notification for acceptation and everything worked
          - All the APIs should be called
@@ -1310,7 +1359,7 @@ class JobApplicationNotifyPoleEmploiIntegrationTest(TestCase):
     @patch("itou.job_applications.models.mise_a_jour_pass_iae")
     @patch("itou.job_applications.models.JobApplicationPoleEmploiNotificationLog.get_encrypted_nir_from_individual")
     @patch("itou.job_applications.models.get_access_token")
-    def test_notification_accepted_but_in_the_future(self, access_token_mock, nir_mock, maj_mock, sleep_mock):
+    def test_notification_accepted_but_in_the_future(self, access_token_mock, nir_mock, maj_mock):
         """
         Nominal scenario: an approval is created, but its start date is in the future.
          - we do not send it: no API call is performed
@@ -1336,7 +1385,7 @@ class JobApplicationNotifyPoleEmploiIntegrationTest(TestCase):
         return_value=encrypted_nir,
     )
     @patch("itou.job_applications.models.get_access_token", side_effect=PoleEmploiMiseAJourPassIAEException("401"))
-    def test_notification_authentication_failure(self, access_token_mock, nir_mock, maj_mock, sleep_mock):
+    def test_notification_authentication_failure(self, access_token_mock, nir_mock, maj_mock):
         """
         Authentication failed: only the get_token call should be made, and an entry with the failure should be added
         """
@@ -1348,6 +1397,7 @@ class JobApplicationNotifyPoleEmploiIntegrationTest(TestCase):
         maj_mock.assert_not_called()
         notification_log = JobApplicationPoleEmploiNotificationLog.objects.get(job_application=job_application)
         self.assertEqual(notification_log.status, JobApplicationPoleEmploiNotificationLog.STATUS_FAIL_AUTHENTICATION)
+        self.assertIsNotNone(notification_log.retry_at)
 
     @patch("itou.job_applications.models.mise_a_jour_pass_iae", return_value=True)
     @patch(
@@ -1355,7 +1405,7 @@ class JobApplicationNotifyPoleEmploiIntegrationTest(TestCase):
         side_effect=PoleEmploiMiseAJourPassIAEException("200", "R010"),
     )
     @patch("itou.job_applications.models.get_access_token", return_value=token)
-    def test_notification_recherche_individu_not_found(self, access_token_mock, nir_mock, maj_mock, sleep_mock):
+    def test_notification_recherche_individu_not_found(self, access_token_mock, nir_mock, maj_mock):
         """
         Error case: we have a valid authentification token, but the job seeker is not found on Pole Emploi’s end:
          - the mise a jour is not done
@@ -1371,6 +1421,8 @@ class JobApplicationNotifyPoleEmploiIntegrationTest(TestCase):
         self.assertEqual(
             notification_log.status, JobApplicationPoleEmploiNotificationLog.STATUS_FAIL_SEARCH_INDIVIDUAL
         )
+        # The job seeker is unknown to PE: retrying would not help.
+        self.assertIsNone(notification_log.retry_at)
 
     @patch("itou.job_applications.models.mise_a_jour_pass_iae", side_effect=PoleEmploiMiseAJourPassIAEException("500"))
     @patch(
@@ -1378,7 +1430,7 @@ class JobApplicationNotifyPoleEmploiIntegrationTest(TestCase):
         return_value=encrypted_nir,
     )
     @patch("itou.job_applications.models.get_access_token", return_value=token)
-    def test_notification_mise_a_jour_crashed(self, access_token_mock, nir_mock, maj_mock, sleep_mock):
+    def test_notification_mise_a_jour_crashed(self, access_token_mock, nir_mock, maj_mock):
         """
         Error case: valid authentification token and PoleEmploi provided us with a valid encrypted nir, but
         the mise_a_jour_pass_iae API call crashed
@@ -1395,3 +1447,116 @@ class JobApplicationNotifyPoleEmploiIntegrationTest(TestCase):
         self.assertEqual(
             notification_log.status, JobApplicationPoleEmploiNotificationLog.STATUS_FAIL_NOTIFY_POLE_EMPLOI
         )
+        self.assertIsNotNone(notification_log.retry_at)
+
+
+@patch("itou.job_applications.models.mise_a_jour_pass_iae", return_value=True)
+@patch(
+    "itou.job_applications.models.JobApplicationPoleEmploiNotificationLog.get_encrypted_nir_from_individual",
+    return_value="some_nir",
+)
+@patch("itou.job_applications.models.get_access_token", return_value="abc123")
+class PoleEmploiNotificationTasksTest(TestCase):
+    def test_retry(self, access_token_mock, nir_mock, maj_mock):
+        job_application = JobApplicationWithApprovalFactory()
+        failed_log = JobApplicationPoleEmploiNotificationLog.objects.create(
+            job_application=job_application,
+            status=JobApplicationPoleEmploiNotificationLog.STATUS_FAIL_AUTHENTICATION,
+            retry_at=timezone.now() - datetime.timedelta(minutes=1),
+        )
+        # Not yet.
+        JobApplicationPoleEmploiNotificationLog.objects.create(
+            job_application=JobApplicationWithApprovalFactory(),
+            status=JobApplicationPoleEmploiNotificationLog.STATUS_FAIL_AUTHENTICATION,
+            retry_at=timezone.now() + datetime.timedelta(minutes=1),
+        )
+
+        notify_pole_emploi_pending()
+
+        maj_mock.assert_called_once_with(job_application, POLE_EMPLOI_PASS_APPROVED, "some_nir", "abc123")
+        failed_log.refresh_from_db()
+        self.assertIsNone(failed_log.retry_at)
+        log = JobApplicationPoleEmploiNotificationLog.objects.latest("pk")
+        self.assertEqual(log.job_application, job_application)
+        self.assertEqual(log.status, JobApplicationPoleEmploiNotificationLog.STATUS_OK)
+        self.assertEqual(log.attempt, 2)
+
+        # Retried once.
+        notify_pole_emploi_pending()
+        maj_mock.assert_called_once()
+
+    def test_retry_failure(self, access_token_mock, nir_mock, maj_mock):
+        maj_mock.side_effect = PoleEmploiMiseAJourPassIAEException(500)
+        job_application = JobApplicationWithApprovalFactory()
+        retry_delays = JobApplicationPoleEmploiNotificationLog.RETRY_DELAYS
+        JobApplicationPoleEmploiNotificationLog.objects.create(
+            job_application=job_application,
+            status=JobApplicationPoleEmploiNotificationLog.STATUS_FAIL_NOTIFY_POLE_EMPLOI,
+            attempt=len(retry_delays) - 1,
+            retry_at=timezone.now(),
+        )
+
+        notify_pole_emploi_pending()
+        log = JobApplicationPoleEmploiNotificationLog.objects.latest("pk")
+        self.assertEqual(log.status, JobApplicationPoleEmploiNotificationLog.STATUS_FAIL_NOTIFY_POLE_EMPLOI)
+        self.assertEqual(log.attempt, len(retry_delays))
+        self.assertAlmostEqual(log.retry_at, timezone.now() + retry_delays[-1], delta=datetime.timedelta(minutes=1))
+
+        # Last attempt.
+        log.retry_at = timezone.now()
+        log.save()
+        notify_pole_emploi_pending()
+        log = JobApplicationPoleEmploiNotificationLog.objects.latest("pk")
+        self.assertEqual(log.attempt, len(retry_delays) + 1)
+        self.assertIsNone(log.retry_at)
+
+    def test_technical_failure(self, access_token_mock, nir_mock, maj_mock):
+        maj_mock.side_effect = KeyError("numPassIAE")
+        job_application = JobApplicationWithApprovalFactory()
+        Approval.objects.filter(pk=job_application.approval.pk).update(
+            created_at=timezone.now() - datetime.timedelta(days=1)
+        )
+
+        notify_pole_emploi_pending()
+        log = JobApplicationPoleEmploiNotificationLog.objects.get(job_application=job_application)
+        self.assertEqual(log.status, JobApplicationPoleEmploiNotificationLog.STATUS_TECHNICAL_FAILURE)
+        self.assertIsNotNone(log.retry_at)
+
+    def test_pending(self, access_token_mock, nir_mock, maj_mock):
+        yesterday = timezone.now() - datetime.timedelta(days=1)
+        # Its approval started today.
+        job_application = JobApplicationWithApprovalFactory(approval__start_at=timezone.localdate())
+        # Already notified.
+        notified_job_application = JobApplicationWithApprovalFactory()
+        JobApplicationPoleEmploiNotificationLog.objects.create(
+            job_application=notified_job_application,
+            status=JobApplicationPoleEmploiNotificationLog.STATUS_OK,
+        )
+        # Not started yet.
+        JobApplicationWithApprovalFactory(approval__start_at=timezone.localdate() + datetime.timedelta(days=1))
+        # PE can't search for job seekers without a NIR.
+        JobApplicationWithApprovalFactory(job_seeker__nir=None)
+        JobApplicationWithApprovalFactory(job_seeker__nir="")
+        Approval.objects.update(created_at=yesterday)
+        # Just accepted: notified by `huey_notify_pole_employ`.
+        JobApplicationWithApprovalFactory()
+
+        self.assertEqual(list(get_pending_job_applications()), [job_application])
+
+        notify_pole_emploi_pending(max_workers=2)
+
+        maj_mock.assert_called_once_with(job_application, POLE_EMPLOI_PASS_APPROVED, "some_nir", "abc123")
+        log = JobApplicationPoleEmploiNotificationLog.objects.get(job_application=job_application)
+        self.assertEqual(log.status, JobApplicationPoleEmploiNotificationLog.STATUS_OK)
+        self.assertEqual(log.attempt, 1)
+
+    def test_notify_many(self, access_token_mock, nir_mock, maj_mock):
+        job_applications = JobApplicationWithApprovalFactory.create_batch(5)
+        notifications = [(job_application, POLE_EMPLOI_PASS_APPROVED, 1) for job_application in job_applications]
+
+        with self.assertNumQueries(1):
+            logs = notify_pole_emploi(notifications, max_workers=3)
+
+        self.assertEqual(maj_mock.call_count, 5)
+        self.assertEqual(len(logs), 5)
+        self.assertEqual(JobApplicationPoleEmploiNotificationLog.objects.filter(status="ok").count(), 5)
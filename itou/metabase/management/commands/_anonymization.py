@@ -0,0 +1,43 @@
+"""
+Anonymization of sensitive ids, mainly job_seeker id and job_application id.
+
+The same ids are anonymized again and again by several tables (`candidats`, `candidatures`,
+`fiches_de_poste_par_candidature`...), thus hashes are memoized in a bounded per-process cache.
+
+Hashes are only kept in memory: a mapping between ids and hashes must never be written to the metabase database,
+where any Metabase user could use it to find out the real ids behind the hashes.
+"""
+from django.conf import settings
+from django.utils.crypto import salted_hmac
+
+
+class Anonymizer:
+    """
+    Memoize salted hashes of ids, keyed by (salt, id).
+
+    The cache holds at most `max_size` hashes, the oldest ones being evicted first.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        # Dicts preserve insertion order: the first key is the oldest one.
+        self.cache = {}
+
+    def remember(self, key, hashed_value):
+        if len(self.cache) >= self.max_size:
+            del self.cache[next(iter(self.cache))]
+        self.cache[key] = hashed_value
+
+    def anonymize(self, value, salt):
+        key = (salt, str(value))
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        hashed_value = salted_hmac(salt, value, secret=settings.SECRET_KEY).hexdigest()
+        self.remember(key, hashed_value)
+        return hashed_value
+
+
+# Every worker process populating metabase tables gets its own copy.
+anonymizer = Anonymizer(max_size=settings.METABASE_ANONYMIZATION_CACHE_SIZE)
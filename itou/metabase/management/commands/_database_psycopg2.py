@@ -1,5 +1,25 @@
+import datetime
+import io
+import math
+
+import pandas as pd
 import psycopg2
 from django.conf import settings
+from psycopg2 import sql
+
+
+def get_connection():
+    return psycopg2.connect(
+        host=settings.METABASE_HOST,
+        port=settings.METABASE_PORT,
+        dbname=settings.METABASE_DATABASE,
+        user=settings.METABASE_USER,
+        password=settings.METABASE_PASSWORD,
+        keepalives=1,
+        keepalives_idle=30,
+        keepalives_interval=5,
+        keepalives_count=5,
+    )
 
 
 class MetabaseDatabaseCursor:
@@ -8,17 +28,7 @@ class MetabaseDatabaseCursor:
         self.connection = None
 
     def __enter__(self):
-        self.connection = psycopg2.connect(
-            host=settings.METABASE_HOST,
-            port=settings.METABASE_PORT,
-            dbname=settings.METABASE_DATABASE,
-            user=settings.METABASE_USER,
-            password=settings.METABASE_PASSWORD,
-            keepalives=1,
-            keepalives_idle=30,
-            keepalives_interval=5,
-            keepalives_count=5,
-        )
+        self.connection = get_connection()
         self.cursor = self.connection.cursor()
         return self.cursor, self.connection
 
@@ -27,3 +37,89 @@ class MetabaseDatabaseCursor:
             self.cursor.close()
         if self.connection:
             self.connection.close()
+
+
+def format_copy_value(value):
+    """
+    Format a python value for the text format of `COPY ... FROM STDIN`.
+    See https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.2
+    """
+    # `pd.isna` catches None, float("nan"), pandas.NaT and pandas.NA (missing values of nullable dtypes).
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return "\\N"
+    if isinstance(value, float) and math.isinf(value):
+        return "Infinity" if value > 0 else "-Infinity"
+    if isinstance(value, datetime.datetime):
+        # Django datetimes are UTC aware: `date` columns thus receive the UTC date.
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        # Same format as the one used by psycopg2 to adapt timedeltas.
+        return f"{value.days} days {value.seconds}.{value.microseconds:06d} seconds"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def copy_rows(cur, table_name, column_names, rows):
+    """
+    Stream rows into given table with `COPY ... FROM STDIN`, which is much faster than multi-row INSERTs.
+
+    Rows are iterables of python values in the same order as `column_names`.
+    Return the number of copied rows.
+    """
+    buffer = io.StringIO()
+    row_count = 0
+    for row in rows:
+        buffer.write("\t".join(format_copy_value(value) for value in row))
+        buffer.write("\n")
+        row_count += 1
+    buffer.seek(0)
+    copy_query = sql.SQL("COPY {table_name} ({fields}) FROM STDIN").format(
+        table_name=sql.Identifier(table_name),
+        fields=sql.SQL(",").join([sql.Identifier(name) for name in column_names]),
+    )
+    cur.copy_expert(copy_query, buffer)
+    return row_count
+
+
+class MetabaseDatabaseLoader:
+    """
+    Load chunks of rows into metabase tables through a single connection reused for every chunk.
+
+    Each chunk is committed on its own, so that the metabase database stays available throughout the load.
+    A chunk failing because of a random disconnection is retried up to `max_attempts` times
+    on a brand new connection.
+    """
+
+    def __init__(self, max_attempts=5):
+        self.max_attempts = max_attempts
+        self.connection = None
+
+    def __enter__(self):
+        self.connection = get_connection()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if self.connection:
+            self.connection.close()
+
+    def reconnect(self):
+        if self.connection:
+            self.connection.close()
+        self.connection = get_connection()
+
+    def load_chunk(self, table_name, column_names, rows):
+        # Rows may be a generator: materialize them so that they can be sent again in case of failure.
+        rows = list(rows)
+        attempts = 0
+        while True:
+            try:
+                with self.connection.cursor() as cur:
+                    row_count = copy_rows(cur, table_name=table_name, column_names=column_names, rows=rows)
+                self.connection.commit()
+                return row_count
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                attempts += 1
+                print(f"Attempt #{attempts} to load a chunk into {table_name} failed with exception {repr(e)}.")
+                if attempts == self.max_attempts:
+                    print("No more attemps left, giving up and raising the exception.")
+                    raise
+                self.reconnect()
@@ -46,3 +46,56 @@ def switch_table_atomically(table_name):
         # Dry run tables are periodically dropped by wet runs.
         cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(get_dry_table_name(table_name))))
         conn.commit()
+
+
+def get_table_columns(cur, table_name):
+    """
+    Return the (name, type) of the columns of given table, in order.
+    """
+    cur.execute(
+        "SELECT column_name, data_type FROM information_schema.columns "
+        "WHERE table_name = %s ORDER BY ordinal_position",
+        [table_name],
+    )
+    return cur.fetchall()
+
+
+def get_watermarks_table_name():
+    """
+    We use the `z` prefix so that technical tables are listed last and do not get in the way of Metabase power users.
+    """
+    return "z_watermarks"
+
+
+def table_exists(cur, table_name):
+    cur.execute("SELECT 1 FROM information_schema.tables WHERE table_name = %s", [table_name])
+    return cur.fetchone() is not None
+
+
+def get_watermark(cur, table_name):
+    """
+    Return the datetime of the last successful population of given table, or None if unknown.
+    """
+    if not table_exists(cur, get_watermarks_table_name()):
+        return None
+    cur.execute(
+        sql.SQL("SELECT watermark FROM {} WHERE table_name = %s").format(sql.Identifier(get_watermarks_table_name())),
+        [table_name],
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def set_watermark(cur, table_name, watermark):
+    cur.execute(
+        sql.SQL("CREATE TABLE IF NOT EXISTS {} (table_name varchar PRIMARY KEY, watermark timestamptz)").format(
+            sql.Identifier(get_watermarks_table_name())
+        )
+    )
+    cur.execute(
+        sql.SQL(
+            "INSERT INTO {} (table_name, watermark) VALUES (%s, %s) "
+            "ON CONFLICT (table_name) DO UPDATE SET watermark = EXCLUDED.watermark"
+        ).format(sql.Identifier(get_watermarks_table_name())),
+        [table_name, watermark],
+    )
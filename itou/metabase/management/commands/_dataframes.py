@@ -5,6 +5,7 @@ Helper methods for manipulating dataframes used by both populate_metabase_itou a
 import pandas as pd
 from tqdm import tqdm
 
+from itou.metabase.management.commands._database_psycopg2 import MetabaseDatabaseLoader
 from itou.metabase.management.commands._database_sqlalchemy import get_pg_engine
 from itou.metabase.management.commands._database_tables import (
     get_dry_table_name,
@@ -16,14 +17,8 @@ from itou.metabase.management.commands._database_tables import (
 def store_df(df, table_name, dry_run, max_attempts=5):
     """
     Store dataframe in database.
-
-    Do this chunk by chunk to solve
-    psycopg2.OperationalError "server closed the connection unexpectedly" error.
-
-    Try up to `max_attempts` times.
     """
     if dry_run:
-        table_name = get_dry_table_name(table_name)
         df = df.head(1000)
 
     # Recipe from https://stackoverflow.com/questions/44729727/pandas-slice-large-dataframe-in-chunks
@@ -32,37 +27,44 @@ def store_df(df, table_name, dry_run, max_attempts=5):
 
     print(f"Storing {table_name} in {len(df_chunks)} chunks of (max) {rows_per_chunk} rows each ...")
 
-    attempts = 0
+    store_df_chunks(df_chunks=df_chunks or [df], table_name=table_name, dry_run=dry_run, max_attempts=max_attempts)
+
+
+def store_df_chunks(df_chunks, table_name, dry_run, max_attempts=5):
+    """
+    Store an iterable of dataframes sharing the same columns in database, e.g. the chunks of a large CSV file.
+    Only one chunk is held in memory at a time when `df_chunks` is an iterator.
+
+    The table is created from the dtypes of the first chunk by pandas, then filled chunk by chunk with
+    `COPY ... FROM STDIN` through a single connection. Each chunk is tried up to `max_attempts` times to survive
+    psycopg2.OperationalError "server closed the connection unexpectedly" errors.
+    """
+    if dry_run:
+        table_name = get_dry_table_name(table_name)
 
-    while attempts < max_attempts:
-        try:
-            if_exists = "replace"  # For the 1st chunk, drop old existing table if needed.
-            for df_chunk in tqdm(df_chunks):
+    row_count = 0
+    table_created = False
+    with MetabaseDatabaseLoader(max_attempts=max_attempts) as loader:
+        for df_chunk in tqdm(df_chunks):
+            if not table_created:
+                # Let pandas create the table with the very same column types it would have used to insert
+                # the data itself.
                 pg_engine = get_pg_engine()
-                df_chunk.to_sql(
-                    name=get_new_table_name(table_name),
-                    # Use a new connection for each chunk to avoid random disconnections.
-                    con=pg_engine,
-                    if_exists=if_exists,
-                    index=False,
-                    chunksize=1000,
-                    # INSERT by batch and not one by one. Increases speed x100.
-                    method="multi",
+                df_chunk.head(0).to_sql(
+                    name=get_new_table_name(table_name), con=pg_engine, if_exists="replace", index=False
                 )
                 pg_engine.dispose()
-                if_exists = "append"  # For all other chunks, append to table in progress.
-            break
-        except Exception as e:
-            # Catching all exceptions is a generally a code smell but we eventually reraise it so it's ok.
-            attempts += 1
-            print(f"Attempt #{attempts} failed with exception {repr(e)}.")
-            if attempts == max_attempts:
-                print("No more attemps left, giving up and raising the exception.")
-                raise
-            print("New attempt started...")
+                table_created = True
+            loader.load_chunk(
+                table_name=get_new_table_name(table_name),
+                column_names=[str(c) for c in df_chunk.columns],
+                rows=df_chunk.itertuples(index=False, name=None),
+            )
+            row_count += len(df_chunk)
 
+    assert table_created
     switch_table_atomically(table_name=table_name)
-    print(f"Stored {table_name} in database ({len(df)} rows).")
+    print(f"Stored {table_name} in database ({row_count} rows).")
     print("")
 
 
@@ -1,3 +1,5 @@
+from django.db.models import Q
+
 from itou.job_applications.models import JobApplication, JobApplicationWorkflow
 from itou.metabase.management.commands._utils import anonymize, get_choice, get_department_and_region_columns
 
@@ -105,6 +107,14 @@ def get_ja_hiring_date(ja):
     return None
 
 
+def get_changed_rows_filter(since):
+    """
+    Select job applications whose row may have changed since given datetime.
+    Every transition saves the job application and thus bumps its `updated_at`.
+    """
+    return Q(created_at__gt=since) | Q(updated_at__gt=since)
+
+
 TABLE_COLUMNS = [
     {
         "name": "id_anonymisé",
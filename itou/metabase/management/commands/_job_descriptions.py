@@ -1,6 +1,16 @@
+from django.db.models import Q
+
 from itou.metabase.management.commands._utils import get_department_and_region_columns
 
 
+def get_changed_rows_filter(since):
+    """
+    Select job descriptions whose row may have changed since given datetime,
+    including those selected by a new job application as their `total_candidatures` changed.
+    """
+    return Q(created_at__gt=since) | Q(updated_at__gt=since) | Q(jobapplication__created_at__gt=since)
+
+
 TABLE_COLUMNS = [
     {"name": "id", "type": "integer", "comment": "ID de la fiche de poste", "fn": lambda o: o.id},
     {
@@ -2,15 +2,18 @@ from datetime import date, timedelta
 from functools import partial
 from operator import attrgetter
 
+from django.db.models import Max, OuterRef, Q, Subquery
 from django.utils import timezone
 
 from itou.eligibility.models import AdministrativeCriteria, EligibilityDiagnosis
-from itou.job_applications.models import JobApplicationWorkflow
+from itou.job_applications.models import JobApplication, JobApplicationWorkflow
 from itou.metabase.management.commands._utils import (
     anonymize,
     get_choice,
     get_department_and_region_columns,
     get_hiring_siae,
+    get_subquery_aggregate,
+    get_subquery_count,
 )
 
 
@@ -105,6 +108,26 @@ def get_latest_diagnosis_criteria(job_seeker, criteria_id):
     return None
 
 
+def get_changed_rows_filter(since):
+    """
+    Select job seekers whose row may have changed since given datetime.
+    """
+    changed_rows_filter = (
+        Q(date_joined__gt=since)
+        # The `actif` column depends on a 7 days sliding window: job seekers who logged in during the
+        # 7 days preceding the previous run may have become inactive since then.
+        | Q(last_login__gt=since - timedelta(days=7))
+        | Q(job_applications__created_at__gt=since)
+        | Q(job_applications__updated_at__gt=since)
+        | Q(eligibility_diagnoses__created_at__gt=since)
+        | Q(eligibility_diagnoses__updated_at__gt=since)
+    )
+    if since.year != timezone.now().year:
+        # The `age` column only depends on the year of birth and thus changes for everyone on January 1st.
+        changed_rows_filter |= Q(birthdate__isnull=False)
+    return changed_rows_filter
+
+
 def _format_criteria_name_as_column_comment(criteria):
     column_comment = (
         criteria.name.replace("'", " ")
@@ -179,6 +202,7 @@ TABLE_COLUMNS += [
         "type": "integer",
         "comment": "Nombre de candidatures",
         "fn": lambda o: o.job_applications.count(),
+        "annotation": get_subquery_count(JobApplication.objects.all(), "job_seeker"),
     },
     {
         "name": "total_embauches",
@@ -188,18 +212,23 @@ TABLE_COLUMNS += [
         "fn": lambda o: len(
             [ja for ja in o.job_applications.all() if ja.state == JobApplicationWorkflow.STATE_ACCEPTED]
         ),
+        "annotation": get_subquery_count(
+            JobApplication.objects.filter(state=JobApplicationWorkflow.STATE_ACCEPTED), "job_seeker"
+        ),
     },
     {
         "name": "total_diagnostics",
         "type": "integer",
         "comment": "Nombre de diagnostics",
         "fn": lambda o: o.eligibility_diagnoses.count(),
+        "annotation": get_subquery_count(EligibilityDiagnosis.objects.all(), "job_seeker"),
     },
     {
         "name": "date_diagnostic",
         "type": "date",
         "comment": "Date du dernier diagnostic",
         "fn": lambda o: getattr(get_latest_diagnosis(o), "created_at", None),
+        "annotation": get_subquery_aggregate(EligibilityDiagnosis.objects.all(), "job_seeker", Max("created_at")),
     },
     {
         "name": "type_auteur_diagnostic",
@@ -220,6 +249,12 @@ TABLE_COLUMNS += [
         "type": "varchar",
         "comment": "Type de la structure destinataire de la dernière embauche du candidat",
         "fn": lambda o: get_hiring_siae(o).kind if get_hiring_siae(o) else None,
+        # Same latest hiring as the one of `get_hiring_siae`.
+        "annotation": Subquery(
+            JobApplication.objects.filter(job_seeker=OuterRef("pk"), state=JobApplicationWorkflow.STATE_ACCEPTED)
+            .order_by("-created_at")
+            .values("to_siae__kind")[:1]
+        ),
     },
     {
         "name": "total_critères_niveau_1",
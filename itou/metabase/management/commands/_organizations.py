@@ -1,3 +1,5 @@
+from django.db.models import Max, Min
+
 from itou.job_applications.models import JobApplication, JobApplicationWorkflow
 from itou.metabase.management.commands._utils import (
     get_address_columns,
@@ -5,8 +7,10 @@ from itou.metabase.management.commands._utils import (
     get_establishment_is_active_column,
     get_establishment_last_login_date_column,
     get_first_membership_join_date,
+    get_subquery_aggregate,
+    get_subquery_count,
 )
-from itou.prescribers.models import PrescriberOrganization
+from itou.prescribers.models import PrescriberMembership, PrescriberOrganization
 from itou.users.models import User
 
 
@@ -105,6 +109,7 @@ TABLE_COLUMNS += [
         "type": "date",
         "comment": "Date inscription du premier compte prescripteur",
         "fn": get_org_first_join_date,
+        "annotation": get_subquery_aggregate(PrescriberMembership.objects.all(), "organization", Min("joined_at")),
     },
     {
         "name": "code_safir",
@@ -117,32 +122,45 @@ TABLE_COLUMNS += [
         "type": "integer",
         "comment": "Nombre de comptes prescripteurs rattachés à cette organisation",
         "fn": get_org_members_count,
+        "annotation": get_subquery_count(PrescriberMembership.objects.all(), "organization"),
     },
     {
         "name": "total_candidatures",
         "type": "integer",
         "comment": "Nombre de candidatures émises par cette organisation",
         "fn": get_org_job_applications_count,
+        "annotation": get_subquery_count(JobApplication.objects.all(), "sender_prescriber_organization"),
     },
     {
         "name": "total_embauches",
         "type": "integer",
         "comment": "Nombre de candidatures en état accepté émises par cette organisation",
         "fn": get_org_accepted_job_applications_count,
+        "annotation": get_subquery_count(
+            JobApplication.objects.filter(state=JobApplicationWorkflow.STATE_ACCEPTED),
+            "sender_prescriber_organization",
+        ),
     },
     {
         "name": "date_dernière_candidature",
         "type": "date",
         "comment": "Date de la dernière création de candidature",
         "fn": get_org_last_job_application_creation_date,
+        "annotation": get_subquery_aggregate(
+            JobApplication.objects.all(), "sender_prescriber_organization", Max("created_at")
+        ),
     },
     {"name": "longitude", "type": "float", "comment": "Longitude", "fn": lambda o: o.longitude},
     {"name": "latitude", "type": "float", "comment": "Latitude", "fn": lambda o: o.latitude},
 ]
 
-TABLE_COLUMNS += get_establishment_last_login_date_column()
+TABLE_COLUMNS += get_establishment_last_login_date_column(
+    membership_model=PrescriberMembership, organization_field="organization"
+)
 
-TABLE_COLUMNS += get_establishment_is_active_column()
+TABLE_COLUMNS += get_establishment_is_active_column(
+    membership_model=PrescriberMembership, organization_field="organization"
+)
 
 TABLE_COLUMNS += [
     {
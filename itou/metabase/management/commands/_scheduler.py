@@ -0,0 +1,81 @@
+"""
+Dependency-aware scheduler running the steps of metabase commands in a process pool.
+"""
+import multiprocessing
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django import db
+
+
+StepResult = namedtuple("StepResult", ["name", "duration", "error"])
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(round(seconds), 60)
+    return f"{minutes} min {seconds} s" if minutes else f"{seconds} s"
+
+
+def run_timed_step(run_step, name):
+    """
+    Run a single step in a worker process and report its duration and failure if any, so that a failing step
+    does not prevent independent steps from completing.
+    """
+    start = time.perf_counter()
+    try:
+        run_step(name)
+    except Exception as e:
+        # Catching all exceptions is generally a code smell but the error is reported and the command eventually
+        # fails once every other step is done.
+        traceback.print_exc()
+        return StepResult(name=name, duration=time.perf_counter() - start, error=repr(e))
+    return StepResult(name=name, duration=time.perf_counter() - start, error=None)
+
+
+def run_steps(steps, run_step, max_workers):
+    """
+    Run steps in parallel, each step starting as soon as all the steps it depends on succeeded.
+
+    `steps` maps each step name to the list of step names it depends on.
+    `run_step` is a module level function called in a worker process with a step name.
+
+    Steps depending on a failed step are not run and reported as such.
+    Return the list of `StepResult`, in completion order.
+    """
+    results = {}
+    pending = dict(steps)
+    running = {}
+
+    # Forked workers must not share the connection to the itou database of the parent process:
+    # each of them opens its own connection as soon as it needs it.
+    db.connections.close_all()
+
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("fork")) as executor:
+        while pending or running:
+            scheduled = False
+            for name, dependencies in list(pending.items()):
+                failed_dependencies = [d for d in dependencies if d in results and results[d].error]
+                if failed_dependencies:
+                    error = f"Non exécutée car {', '.join(failed_dependencies)} a échoué"
+                    results[name] = StepResult(name=name, duration=0, error=error)
+                elif all(d in results for d in dependencies):
+                    running[executor.submit(run_timed_step, run_step, name)] = name
+                else:
+                    continue
+                del pending[name]
+                scheduled = True
+
+            if not running:
+                if not scheduled:
+                    raise ValueError(f"Unresolvable dependencies for steps {', '.join(pending)}")
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                result = future.result()
+                results[result.name] = result
+
+    return list(results.values())
@@ -1,14 +1,18 @@
+from django.db.models import FloatField, Max, Min
+from django.db.models.functions import Cast, Coalesce, NullIf, Round
 from django.utils import timezone
 
-from itou.job_applications.models import JobApplication, JobApplicationWorkflow
+from itou.job_applications.models import JobApplication, JobApplicationTransitionLog, JobApplicationWorkflow
 from itou.metabase.management.commands._utils import (
     get_address_columns,
     get_choice,
     get_establishment_is_active_column,
     get_establishment_last_login_date_column,
     get_first_membership_join_date,
+    get_subquery_aggregate,
+    get_subquery_count,
 )
-from itou.siaes.models import Siae
+from itou.siaes.models import Siae, SiaeJobDescription, SiaeMembership
 
 
 ONE_MONTH_AGO = timezone.now() - timezone.timedelta(days=30)
@@ -41,6 +45,29 @@ def get_siae_last_month_hirings(siae):
     ]
 
 
+def get_received_job_applications_count(**filters):
+    return get_subquery_count(JobApplication.objects.filter(**filters), "to_siae")
+
+
+def get_job_descriptions_count(**filters):
+    return get_subquery_count(SiaeJobDescription.objects.filter(**filters), "siae")
+
+
+def get_last_month_conversion_rate():
+    last_month_job_applications = get_received_job_applications_count(created_at__gt=ONE_MONTH_AGO)
+    last_month_hirings = get_received_job_applications_count(
+        created_at__gt=ONE_MONTH_AGO, state=JobApplicationWorkflow.STATE_ACCEPTED
+    )
+    # `NullIf` avoids a division by zero for siaes without any job application, which then get a zero rate.
+    return Coalesce(
+        Round(
+            Cast(last_month_hirings, FloatField()) / NullIf(Cast(last_month_job_applications, FloatField()), 0.0),
+            precision=2,
+        ),
+        0.0,
+    )
+
+
 TABLE_COLUMNS = [
     {"name": "id", "type": "integer", "comment": "ID de la structure", "fn": lambda o: o.id},
     {
@@ -79,24 +106,28 @@ TABLE_COLUMNS += [
         "type": "date",
         "comment": "Date inscription du premier compte employeur",
         "fn": get_siae_first_join_date,
+        "annotation": get_subquery_aggregate(SiaeMembership.objects.all(), "siae", Min("joined_at")),
     },
     {
         "name": "total_membres",
         "type": "integer",
         "comment": "Nombre de comptes employeur rattachés à la structure",
         "fn": lambda o: o.members.count(),
+        "annotation": get_subquery_count(SiaeMembership.objects.all(), "siae"),
     },
     {
         "name": "total_candidatures",
         "type": "integer",
         "comment": "Nombre de candidatures dont la structure est destinataire",
         "fn": lambda o: len(o.job_applications_received.all()),
+        "annotation": get_received_job_applications_count(),
     },
     {
         "name": "total_candidatures_30j",
         "type": "integer",
         "comment": "Nombre de candidatures dans les 30 jours glissants dont la structure est destinataire",
         "fn": lambda o: len(get_siae_last_month_job_applications(o)),
+        "annotation": get_received_job_applications_count(created_at__gt=ONE_MONTH_AGO),
     },
     {
         "name": "total_embauches",
@@ -106,6 +137,7 @@ TABLE_COLUMNS += [
         "fn": lambda o: len(
             [ja for ja in o.job_applications_received.all() if ja.state == JobApplicationWorkflow.STATE_ACCEPTED]
         ),
+        "annotation": get_received_job_applications_count(state=JobApplicationWorkflow.STATE_ACCEPTED),
     },
     {
         "name": "total_embauches_30j",
@@ -114,6 +146,9 @@ TABLE_COLUMNS += [
             "Nombre de candidatures en état accepté dans les 30 jours glissants " "dont la structure est destinataire"
         ),
         "fn": lambda o: len(get_siae_last_month_hirings(o)),
+        "annotation": get_received_job_applications_count(
+            created_at__gt=ONE_MONTH_AGO, state=JobApplicationWorkflow.STATE_ACCEPTED
+        ),
     },
     {
         "name": "taux_conversion_30j",
@@ -125,6 +160,7 @@ TABLE_COLUMNS += [
             else 0.0,
             2,
         ),
+        "annotation": get_last_month_conversion_rate(),
     },
     {
         "name": "total_auto_prescriptions",
@@ -134,6 +170,7 @@ TABLE_COLUMNS += [
         "fn": lambda o: len(
             [ja for ja in o.job_applications_received.all() if ja.sender_kind == JobApplication.SENDER_KIND_SIAE_STAFF]
         ),
+        "annotation": get_received_job_applications_count(sender_kind=JobApplication.SENDER_KIND_SIAE_STAFF),
     },
     {
         "name": "total_candidatures_autonomes",
@@ -143,6 +180,7 @@ TABLE_COLUMNS += [
         "fn": lambda o: len(
             [ja for ja in o.job_applications_received.all() if ja.sender_kind == JobApplication.SENDER_KIND_JOB_SEEKER]
         ),
+        "annotation": get_received_job_applications_count(sender_kind=JobApplication.SENDER_KIND_JOB_SEEKER),
     },
     {
         "name": "total_candidatures_via_prescripteur",
@@ -152,6 +190,7 @@ TABLE_COLUMNS += [
         "fn": lambda o: len(
             [ja for ja in o.job_applications_received.all() if ja.sender_kind == JobApplication.SENDER_KIND_PRESCRIBER]
         ),
+        "annotation": get_received_job_applications_count(sender_kind=JobApplication.SENDER_KIND_PRESCRIBER),
     },
     {
         "name": "total_candidatures_non_traitées",
@@ -161,6 +200,7 @@ TABLE_COLUMNS += [
         "fn": lambda o: len(
             [ja for ja in o.job_applications_received.all() if ja.state == JobApplicationWorkflow.STATE_NEW]
         ),
+        "annotation": get_received_job_applications_count(state=JobApplicationWorkflow.STATE_NEW),
     },
     {
         "name": "total_candidatures_en_étude",
@@ -170,12 +210,13 @@ TABLE_COLUMNS += [
         "fn": lambda o: len(
             [ja for ja in o.job_applications_received.all() if ja.state == JobApplicationWorkflow.STATE_PROCESSING]
         ),
+        "annotation": get_received_job_applications_count(state=JobApplicationWorkflow.STATE_PROCESSING),
     },
 ]
 
-TABLE_COLUMNS += get_establishment_last_login_date_column()
+TABLE_COLUMNS += get_establishment_last_login_date_column(membership_model=SiaeMembership, organization_field="siae")
 
-TABLE_COLUMNS += get_establishment_is_active_column()
+TABLE_COLUMNS += get_establishment_is_active_column(membership_model=SiaeMembership, organization_field="siae")
 
 TABLE_COLUMNS += [
     {
@@ -183,18 +224,25 @@ TABLE_COLUMNS += [
         "type": "date",
         "comment": "Date de dernière évolution candidature sauf passage obsolète",
         "fn": get_siae_last_ja_transition_date,
+        "annotation": get_subquery_aggregate(
+            JobApplicationTransitionLog.objects.exclude(to_state=JobApplicationWorkflow.STATE_OBSOLETE),
+            "job_application__to_siae",
+            Max("timestamp"),
+        ),
     },
     {
         "name": "total_fiches_de_poste_actives",
         "type": "integer",
         "comment": "Nombre de fiches de poste actives de la structure",
         "fn": lambda o: len([jd for jd in o.job_description_through.all() if jd.is_active]),
+        "annotation": get_job_descriptions_count(is_active=True),
     },
     {
         "name": "total_fiches_de_poste_inactives",
         "type": "integer",
         "comment": "Nombre de fiches de poste inactives de la structure",
         "fn": lambda o: len([jd for jd in o.job_description_through.all() if not jd.is_active]),
+        "annotation": get_job_descriptions_count(is_active=False),
     },
     {"name": "longitude", "type": "float", "comment": "Longitude", "fn": lambda o: o.longitude},
     {"name": "latitude", "type": "float", "comment": "Latitude", "fn": lambda o: o.latitude},
@@ -1,13 +1,14 @@
 import os
 from operator import attrgetter
 
-from django.conf import settings
+from django.db.models import Count, Exists, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import timezone
-from django.utils.crypto import salted_hmac
 from psycopg2 import sql
 
 from itou.common_apps.address.departments import DEPARTMENT_TO_REGION, DEPARTMENTS
 from itou.job_applications.models import JobApplicationWorkflow
+from itou.metabase.management.commands._anonymization import anonymizer
 from itou.metabase.management.commands._database_psycopg2 import MetabaseDatabaseCursor
 from itou.metabase.management.commands._database_tables import (
     get_dry_table_name,
@@ -57,8 +58,47 @@ def anonymize(value, salt):
     """
     Use a salted hash to anonymize sensitive ids,
     mainly job_seeker id and job_application id.
+    Hashes are memoized, see `_anonymization.Anonymizer`.
     """
-    return salted_hmac(salt, value, secret=settings.SECRET_KEY).hexdigest()
+    return anonymizer.anonymize(value, salt)
+
+
+def get_subquery_aggregate(queryset, outer_ref_field, aggregate):
+    """
+    Build a correlated subquery computing `aggregate` over the rows of `queryset` related to each object of the
+    outer query, e.g. the number of job applications received by each siae.
+
+    A subquery is way more efficient than a join here, and several of them can be combined on the same
+    outer query without multiplying rows. See `SiaeQuerySet.with_count_recent_received_job_apps`.
+    """
+    return Subquery(
+        queryset.filter(**{outer_ref_field: OuterRef("pk")})
+        .order_by()
+        .values(outer_ref_field)  # group rows by outer object
+        .annotate(value=aggregate)
+        .values("value")
+    )
+
+
+def get_subquery_count(queryset, outer_ref_field):
+    # `Coalesce` will return the first not null value or zero.
+    return Coalesce(get_subquery_aggregate(queryset, outer_ref_field, Count("pk")), 0)
+
+
+def get_annotation_alias(column):
+    return f"metabase_{column['name']}"
+
+
+def get_annotated_value(o, alias, fallback):
+    """
+    Read the value computed by the database for a column declaring an `annotation`.
+
+    Objects not coming from an annotated queryset, e.g. `ORG_OF_PRESCRIBERS_WITHOUT_ORG`,
+    fall back to the column python `fn`.
+    """
+    if hasattr(o, alias):
+        return getattr(o, alias)
+    return fallback(o)
 
 
 def get_first_membership_join_date(memberships):
@@ -140,7 +180,7 @@ def get_address_columns(name_suffix="", comment_suffix=""):
     ] + get_department_and_region_columns(name_suffix, comment_suffix)
 
 
-def get_establishment_last_login_date_column():
+def get_establishment_last_login_date_column(membership_model, organization_field):
     return [
         {
             "name": "date_dernière_connexion",
@@ -149,11 +189,14 @@ def get_establishment_last_login_date_column():
             "fn": lambda o: max([u.last_login for u in o.members.all() if u.last_login], default=None)
             if o.members.exists()
             else None,
+            "annotation": get_subquery_aggregate(
+                membership_model.objects.all(), organization_field, Max("user__last_login")
+            ),
         },
     ]
 
 
-def get_establishment_is_active_column():
+def get_establishment_is_active_column(membership_model, organization_field):
     return [
         {
             "name": "active",
@@ -164,33 +207,16 @@ def get_establishment_is_active_column():
             )
             if o.members.exists()
             else False,
+            "annotation": Exists(
+                membership_model.objects.filter(
+                    **{organization_field: OuterRef("pk")},
+                    user__last_login__gt=timezone.now() - timezone.timedelta(days=7),
+                )
+            ),
         },
     ]
 
 
-def chunked_queryset(queryset, chunk_size=10000):
-    """
-    Slice a queryset into chunks. This is useful to avoid memory issues when
-    iterating through large querysets.
-    Credits go to:
-    https://medium.com/@rui.jorge.rei/today-i-learned-django-memory-leak-and-the-sql-query-cache-1c152f62f64
-    Code initially adapted from https://djangosnippets.org/snippets/10599/
-    """
-    if not queryset.exists():
-        return
-    queryset = queryset.order_by("pk")
-    pks = queryset.values_list("pk", flat=True)
-    start_pk = pks[0]
-    while True:
-        try:
-            end_pk = pks.filter(pk__gte=start_pk)[chunk_size]
-        except IndexError:
-            break
-        yield queryset.filter(pk__gte=start_pk, pk__lt=end_pk)
-        start_pk = end_pk
-    yield queryset.filter(pk__gte=start_pk)
-
-
 def build_custom_table(table_name, sql_request, dry_run):
     """
     Build a new table with given sql_request.
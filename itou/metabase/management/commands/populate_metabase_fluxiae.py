@@ -3,13 +3,8 @@ Populate metabase with fluxIAE data and some custom tables for our needs.
 
 For itou data, see the other script `populate_metabase_itou.py`.
 
-At this time this script is only supposed to run manually on your local dev, not in production.
-
-It manipulates large dataframes in memory (~10M rows) and thus is not optimized for production low memory environment.
-
-This script takes ~2 hours to complete.
-
-Refactoring it for low memory use would make it even longer and is actually not trivial. It might be attempted though.
+fluxIAE exports are large (~10M rows): each of them is streamed from its CSV file to metabase chunk by chunk,
+the size of the chunks being computed so that memory use stays within `settings.METABASE_FLUXIAE_MEMORY_BUDGET`.
 
 1) Vocabulary.
 
@@ -63,9 +58,13 @@ import logging
 from django.conf import settings
 from django.core.management.base import BaseCommand
 
-from itou.metabase.management.commands._dataframes import store_df
+from itou.metabase.management.commands._dataframes import store_df_chunks
 from itou.metabase.management.commands._utils import build_custom_tables
-from itou.siaes.management.commands._import_siae.utils import get_fluxiae_df, get_fluxiae_referential_filenames, timeit
+from itou.siaes.management.commands._import_siae.utils import (
+    get_fluxiae_df_chunks,
+    get_fluxiae_referential_filenames,
+    timeit,
+)
 from itou.utils.slack import send_slack_message
 
 
@@ -75,6 +74,10 @@ if settings.METABASE_SHOW_SQL_REQUESTS:
     mylogger.setLevel(logging.DEBUG)
     mylogger.addHandler(logging.StreamHandler())
 
+# A chunk is held in memory as a dataframe, then as python rows and as text by the COPY loader.
+# Dataframe chunks are thus given only a fraction of the memory budget.
+CHUNK_MEMORY_BUDGET_RATIO = 0.25
+
 
 class Command(BaseCommand):
     """
@@ -117,8 +120,13 @@ class Command(BaseCommand):
 
     @timeit
     def populate_fluxiae_view(self, vue_name, skip_first_row=True):
-        df = get_fluxiae_df(vue_name=vue_name, skip_first_row=skip_first_row, dry_run=self.dry_run)
-        store_df(df=df, table_name=vue_name, dry_run=self.dry_run)
+        df_chunks = get_fluxiae_df_chunks(
+            vue_name=vue_name,
+            memory_budget=settings.METABASE_FLUXIAE_MEMORY_BUDGET * CHUNK_MEMORY_BUDGET_RATIO,
+            skip_first_row=skip_first_row,
+            dry_run=self.dry_run,
+        )
+        store_df_chunks(df_chunks=df_chunks, table_name=vue_name, dry_run=self.dry_run)
 
     def populate_fluxiae_referentials(self):
         for filename in get_fluxiae_referential_filenames():
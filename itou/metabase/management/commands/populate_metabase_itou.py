@@ -5,13 +5,18 @@ For fluxIAE data, see the other script `populate_metabase_fluxiae.py`.
 
 This script runs every night in production via a cronjob, but can also be run from your local dev.
 
+Tables are populated in parallel by a pool of `settings.METABASE_POPULATE_MAX_WORKERS` processes.
+
 This script reads data from the itou production database,
 transforms it for the convenience of our metabase non tech-savvy,
 french speaking only users, and injects the result into metabase.
 
 The itou production database is never modified, only read.
 
-The metabase database tables are trashed and recreated every time.
+The metabase database tables are trashed and recreated every time, except for tables supporting
+the incremental mode (the default): those only receive the rows which changed since the previous run,
+rows of deleted objects being removed by a tombstone pass. Use `--full-rebuild` to trash and recreate them anyway,
+e.g. once a week to catch up changes the incremental filters cannot see (a renamed structure, a moved job seeker...).
 
 The data is heavily denormalized among tables so that the metabase user
 has all the fields needed and thus never needs to perform joining two tables.
@@ -23,12 +28,13 @@ Its name is "Documentation ITOU METABASE [Master doc]". No direct link here for
 import gc
 import logging
 from collections import OrderedDict
+from functools import partial
+from itertools import islice
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.core.paginator import Paginator
 from django.utils import timezone
-from psycopg2 import extras as psycopg2_extras, sql
+from psycopg2 import sql
 from tqdm import tqdm
 
 from itou.approvals.models import Approval, PoleEmploiApproval
@@ -46,29 +52,52 @@ from itou.metabase.management.commands import (
     _rome_codes,
     _siaes,
 )
-from itou.metabase.management.commands._database_psycopg2 import MetabaseDatabaseCursor
+from itou.metabase.management.commands._database_psycopg2 import (
+    MetabaseDatabaseCursor,
+    MetabaseDatabaseLoader,
+    copy_rows,
+)
 from itou.metabase.management.commands._database_tables import (
     get_dry_table_name,
     get_new_table_name,
     get_old_table_name,
+    get_table_columns,
+    get_watermark,
+    set_watermark,
+    table_exists,
 )
 from itou.metabase.management.commands._dataframes import get_df_from_rows, store_df
+from itou.metabase.management.commands._scheduler import format_duration, run_steps
 from itou.metabase.management.commands._utils import (
     anonymize,
     build_custom_tables,
-    chunked_queryset,
     compose,
     convert_boolean_to_int,
+    get_annotated_value,
+    get_annotation_alias,
 )
 from itou.prescribers.models import PrescriberOrganization
 from itou.siaes.models import Siae, SiaeJobDescription
 from itou.users.models import User
+from itou.utils.iterators import queryset_chunks, queryset_iterator
 from itou.utils.slack import send_slack_message
 
 
 # Emit more verbose slack messages about every step, not just the beginning and the ending of the command.
 VERBOSE_SLACK_MESSAGES = False
 
+# How many pks of live objects are fetched at a time from the itou database during the tombstone pass.
+TOMBSTONE_KEYS_BATCH_SIZE = 10000
+
+# Column added to every table, see `populate_table`.
+UPDATE_DATE_COLUMN_NAME = "date_mise_à_jour_metabase"
+
+
+def get_update_date():
+    # As metabase daily updates run typically every night after midnight, the last day with
+    # complete data is yesterday, not today.
+    return timezone.now() + timezone.timedelta(days=-1)
+
 
 if settings.METABASE_SHOW_SQL_REQUESTS:
     # Unfortunately each SQL query log appears twice ¬_¬
@@ -90,6 +119,9 @@ class Command(BaseCommand):
 
     When ready:
         django-admin populate_metabase_itou --verbosity=2
+
+    To trash and recreate all tables instead of only injecting changed rows into incremental tables:
+        django-admin populate_metabase_itou --verbosity=2 --full-rebuild
     """
 
     help = "Populate metabase database."
@@ -98,6 +130,12 @@ class Command(BaseCommand):
         parser.add_argument(
             "--dry-run", dest="dry_run", action="store_true", help="Populate alternate tables with sample data"
         )
+        parser.add_argument(
+            "--full-rebuild",
+            dest="full_rebuild",
+            action="store_true",
+            help="Trash and recreate all tables instead of only injecting changed rows into incremental tables",
+        )
 
     def set_logger(self, verbosity):
         """
@@ -107,7 +145,9 @@ class Command(BaseCommand):
 
         self.logger = logging.getLogger(__name__)
         self.logger.propagate = False
-        self.logger.addHandler(handler)
+        # Worker processes inherit the handler of the parent process.
+        if not self.logger.handlers:
+            self.logger.addHandler(handler)
 
         self.logger.setLevel(logging.INFO)
         if verbosity > 1:
@@ -139,21 +179,133 @@ class Command(BaseCommand):
         """
         Insert chunk of objects into table.
         """
-        insert_query = sql.SQL("insert into {new_table_name} ({fields}) values %s").format(
-            new_table_name=sql.Identifier(new_table_name),
-            fields=sql.SQL(",").join(
-                [sql.Identifier(c["name"]) for c in table_columns],
+        self.loader.load_chunk(
+            table_name=new_table_name,
+            column_names=[c["name"] for c in table_columns],
+            rows=([c["fn"](o) for c in table_columns] for o in chunk),
+        )
+
+    def create_table(self, table_name, table_columns):
+        """
+        Create table and add comments on its columns.
+        """
+        create_table_query = sql.SQL("CREATE TABLE {table_name} ({fields_with_type})").format(
+            table_name=sql.Identifier(table_name),
+            fields_with_type=sql.SQL(",").join(
+                [sql.SQL(" ").join([sql.Identifier(c["name"]), sql.SQL(c["type"])]) for c in table_columns]
             ),
         )
-        dataset = [[c["fn"](o) for c in table_columns] for o in chunk]
-        psycopg2_extras.execute_values(self.cur, insert_query, dataset, template=None)
+        self.cur.execute(create_table_query)
+
+        self.commit()
+
+        for c in table_columns:
+            assert set(c.keys()) - set(["annotation"]) == set(["name", "type", "comment", "fn"])
+            column_name = c["name"]
+            column_comment = c["comment"]
+            comment_query = sql.SQL("comment on column {table_name}.{column_name} is {column_comment}").format(
+                table_name=sql.Identifier(table_name),
+                column_name=sql.Identifier(column_name),
+                column_comment=sql.Literal(column_comment),
+            )
+            self.cur.execute(comment_query)
+
         self.commit()
 
-    def populate_table(self, table_name, table_columns, queryset=None, querysets=None, extra_object=None):
+    def merge_table(self, table_name, new_table_name, column_names, upsert_key):
+        """
+        Upsert rows of the new table into the existing table.
+
+        All statements run in the same transaction so that Metabase users never see a row disappear.
+        Columns are listed by name: the columns of both tables are the same, but not necessarily in the same order.
+        Unchanged rows are kept as they are, apart from their update date: the whole table was refreshed.
+        """
+        self.cur.execute(
+            sql.SQL("DELETE FROM {table_name} WHERE {key} IN (SELECT {key} FROM {new_table_name})").format(
+                table_name=sql.Identifier(table_name),
+                new_table_name=sql.Identifier(new_table_name),
+                key=sql.Identifier(upsert_key),
+            )
+        )
+        self.cur.execute(
+            sql.SQL("INSERT INTO {table_name} ({columns}) SELECT {columns} FROM {new_table_name}").format(
+                table_name=sql.Identifier(table_name),
+                new_table_name=sql.Identifier(new_table_name),
+                columns=sql.SQL(",").join([sql.Identifier(name) for name in column_names]),
+            )
+        )
+        self.cur.execute(
+            sql.SQL(
+                "UPDATE {table_name} SET {column} = %(date)s WHERE {column} IS DISTINCT FROM %(date)s::date"
+            ).format(
+                table_name=sql.Identifier(table_name),
+                column=sql.Identifier(UPDATE_DATE_COLUMN_NAME),
+            ),
+            {"date": get_update_date()},
+        )
+        self.commit()
+
+    def delete_tombstones(self, table_name, upsert_column, querysets):
+        """
+        Delete rows whose source object no longer exists in the itou database.
+
+        The upsert key of every live object is computed from its pk only, then the rows whose key
+        is not part of this set are deleted.
+        """
+        keys_table_name = "tombstone_keys"
+        self.cur.execute(
+            sql.SQL("CREATE TEMPORARY TABLE {keys_table_name} ({key} {type}) ON COMMIT DROP").format(
+                keys_table_name=sql.Identifier(keys_table_name),
+                key=sql.Identifier(upsert_column["name"]),
+                type=sql.SQL(upsert_column["type"]),
+            )
+        )
+        for queryset in querysets:
+            pks = queryset.values_list("pk", flat=True).iterator(chunk_size=TOMBSTONE_KEYS_BATCH_SIZE)
+            for pks_chunk in iter(lambda: list(islice(pks, TOMBSTONE_KEYS_BATCH_SIZE)), []):
+                copy_rows(
+                    self.cur,
+                    table_name=keys_table_name,
+                    column_names=[upsert_column["name"]],
+                    # A bare instance holding only its pk is enough to compute the upsert key.
+                    rows=([upsert_column["fn"](queryset.model(pk=pk))] for pk in pks_chunk),
+                )
+        self.cur.execute(
+            sql.SQL(
+                "DELETE FROM {table_name} t "
+                "WHERE NOT EXISTS (SELECT 1 FROM {keys_table_name} k WHERE k.{key} = t.{key})"
+            ).format(
+                table_name=sql.Identifier(table_name),
+                keys_table_name=sql.Identifier(keys_table_name),
+                key=sql.Identifier(upsert_column["name"]),
+            )
+        )
+        self.log(f"Deleted {self.cur.rowcount} tombstoned rows from table {table_name}.")
+        self.commit()
+
+    def populate_table(
+        self,
+        table_name,
+        table_columns,
+        queryset=None,
+        querysets=None,
+        extra_object=None,
+        upsert_key=None,
+        changed_rows_filter=None,
+    ):
         """
         Generic method to populate each table.
         Create table with a temporary name, add column comments,
         inject content and finally swap with the target table.
+
+        Tables declaring an `upsert_key` (name of a column uniquely identifying a row) and a
+        `changed_rows_filter` (function returning a Q object selecting the objects whose row may have changed
+        since a given datetime) can be populated incrementally: only changed rows are injected
+        in the temporary table, which is then merged into the target table.
+
+        Columns declaring an `annotation` (an ORM expression, typically an aggregate subquery) have their value
+        computed by the database instead of their python `fn`, which is then only a fallback for objects
+        not coming from the querysets (e.g. `extra_object`). This spares huge `prefetch_related` chains.
         """
         if queryset is not None:
             assert not querysets
@@ -165,27 +317,31 @@ class Command(BaseCommand):
         new_table_name = get_new_table_name(table_name)
         old_table_name = get_old_table_name(table_name)
 
-        with MetabaseDatabaseCursor() as (cur, conn):
+        with MetabaseDatabaseCursor() as (cur, conn), MetabaseDatabaseLoader() as loader:
             self.cur = cur
             self.conn = conn
+            self.loader = loader
 
             self.cleanup_tables(table_name)
 
-            if self.dry_run:
-                total_rows = sum(
-                    [min(queryset.count(), settings.METABASE_DRY_RUN_ROWS_PER_QUERYSET) for queryset in querysets]
-                )
-            else:
-                total_rows = sum([queryset.count() for queryset in querysets])
+            # Taken before reading any data so that objects modified while the table is being populated
+            # are picked up again by the next incremental run.
+            watermark = timezone.now()
+            full_querysets = querysets
+
+            annotations = {get_annotation_alias(c): c["annotation"] for c in table_columns if "annotation" in c}
+            if annotations:
+                querysets = [qs.annotate(**annotations) for qs in querysets]
+                for c in table_columns:
+                    if "annotation" in c:
+                        c["fn"] = partial(get_annotated_value, alias=get_annotation_alias(c), fallback=c["fn"])
 
             table_columns += [
                 {
-                    "name": "date_mise_à_jour_metabase",
+                    "name": UPDATE_DATE_COLUMN_NAME,
                     "type": "date",
                     "comment": "Date de dernière mise à jour de Metabase",
-                    # As metabase daily updates run typically every night after midnight, the last day with
-                    # complete data is yesterday, not today.
-                    "fn": lambda o: timezone.now() + timezone.timedelta(days=-1),
+                    "fn": lambda o: get_update_date(),
                 },
             ]
 
@@ -196,32 +352,32 @@ class Command(BaseCommand):
                     c["type"] = "integer"
                     c["fn"] = compose(convert_boolean_to_int, c["fn"])
 
-            self.log(f"Injecting {total_rows} rows with {len(table_columns)} columns into table {table_name}:")
+            self.create_table(table_name=new_table_name, table_columns=table_columns)
 
-            # Create table.
-            create_table_query = sql.SQL("CREATE TABLE {new_table_name} ({fields_with_type})").format(
-                new_table_name=sql.Identifier(new_table_name),
-                fields_with_type=sql.SQL(",").join(
-                    [sql.SQL(" ").join([sql.Identifier(c["name"]), sql.SQL(c["type"])]) for c in table_columns]
-                ),
-            )
-            self.cur.execute(create_table_query)
+            since = None
+            if self.incremental and not self.dry_run and upsert_key and changed_rows_filter:
+                if table_exists(self.cur, table_name):
+                    since = get_watermark(self.cur, table_name)
+                # Rows of the existing table can't be merged with rows having other columns.
+                if since and get_table_columns(self.cur, table_name) != get_table_columns(self.cur, new_table_name):
+                    self.log(f"Columns of table {table_name} changed: falling back to a full rebuild.")
+                    since = None
 
-            self.commit()
+            if since:
+                self.log(f"Incremental mode: only injecting rows changed since {since}.")
+                querysets = [
+                    qs.filter(pk__in=qs.model.objects.filter(changed_rows_filter(since)).values("pk"))
+                    for qs in querysets
+                ]
 
-            # Add comments on table columns.
-            for c in table_columns:
-                assert set(c.keys()) == set(["name", "type", "comment", "fn"])
-                column_name = c["name"]
-                column_comment = c["comment"]
-                comment_query = sql.SQL("comment on column {new_table_name}.{column_name} is {column_comment}").format(
-                    new_table_name=sql.Identifier(new_table_name),
-                    column_name=sql.Identifier(column_name),
-                    column_comment=sql.Literal(column_comment),
+            if self.dry_run:
+                total_rows = sum(
+                    [min(queryset.count(), settings.METABASE_DRY_RUN_ROWS_PER_QUERYSET) for queryset in querysets]
                 )
-                self.cur.execute(comment_query)
+            else:
+                total_rows = sum([queryset.count() for queryset in querysets])
 
-            self.commit()
+            self.log(f"Injecting {total_rows} rows with {len(table_columns)} columns into table {table_name}:")
 
             if extra_object:
                 # Insert extra object without counter/tqdm for simplicity.
@@ -235,29 +391,51 @@ class Command(BaseCommand):
                         total_injections = min(total_injections, settings.METABASE_DRY_RUN_ROWS_PER_QUERYSET)
 
                     # Insert rows by batch of settings.METABASE_INSERT_BATCH_SIZE.
-                    for chunk_qs in chunked_queryset(queryset, chunk_size=settings.METABASE_INSERT_BATCH_SIZE):
-                        injections_left = total_injections - injections
-                        if chunk_qs.count() > injections_left:
-                            chunk_qs = chunk_qs[:injections_left]
-                        self.inject_chunk(table_columns=table_columns, chunk=chunk_qs, new_table_name=new_table_name)
-                        injections += chunk_qs.count()
-                        progress_bar.update(chunk_qs.count())
+                    for chunk in queryset_chunks(queryset, chunk_size=settings.METABASE_INSERT_BATCH_SIZE):
+                        chunk = chunk[: total_injections - injections]
+                        self.inject_chunk(table_columns=table_columns, chunk=chunk, new_table_name=new_table_name)
+                        injections += len(chunk)
+                        progress_bar.update(len(chunk))
+                        if injections >= total_injections:
+                            break
 
                     # Trigger garbage collection to optimize memory use.
                     gc.collect()
 
-            # Swap new and old table nicely to minimize downtime.
-            self.cur.execute(
-                sql.SQL("ALTER TABLE IF EXISTS {} RENAME TO {}").format(
-                    sql.Identifier(table_name), sql.Identifier(old_table_name)
+            if since:
+                self.merge_table(
+                    table_name=table_name,
+                    new_table_name=new_table_name,
+                    column_names=[c["name"] for c in table_columns],
+                    upsert_key=upsert_key,
                 )
-            )
-            self.cur.execute(
-                sql.SQL("ALTER TABLE {} RENAME TO {}").format(
-                    sql.Identifier(new_table_name), sql.Identifier(table_name)
+                upsert_column = next(c for c in table_columns if c["name"] == upsert_key)
+                self.delete_tombstones(table_name=table_name, upsert_column=upsert_column, querysets=full_querysets)
+            else:
+                if upsert_key:
+                    # Speed up merges of subsequent incremental runs.
+                    self.cur.execute(
+                        sql.SQL("CREATE INDEX ON {} ({})").format(
+                            sql.Identifier(new_table_name), sql.Identifier(upsert_key)
+                        )
+                    )
+                # Swap new and old table nicely to minimize downtime.
+                self.cur.execute(
+                    sql.SQL("ALTER TABLE IF EXISTS {} RENAME TO {}").format(
+                        sql.Identifier(table_name), sql.Identifier(old_table_name)
+                    )
                 )
-            )
-            self.commit()
+                self.cur.execute(
+                    sql.SQL("ALTER TABLE {} RENAME TO {}").format(
+                        sql.Identifier(new_table_name), sql.Identifier(table_name)
+                    )
+                )
+                self.commit()
+
+            if upsert_key and not self.dry_run:
+                set_watermark(self.cur, table_name=table_name, watermark=watermark)
+                self.commit()
+
             self.cleanup_tables(table_name)
             self.log("")
 
@@ -265,18 +443,8 @@ class Command(BaseCommand):
         """
         Populate siaes table with various statistics.
         """
-        queryset = (
-            Siae.objects.active()
-            .prefetch_related(
-                "members",
-                "convention",
-                "siaemembership_set",
-                "job_applications_received",
-                "job_applications_received__logs",
-                "job_description_through",
-            )
-            .all()
-        )
+        # Statistics are computed by the database, see `_siaes.TABLE_COLUMNS` annotations.
+        queryset = Siae.objects.active().select_related("convention").all()
 
         self.populate_table(table_name="structures", table_columns=_siaes.TABLE_COLUMNS, queryset=queryset)
 
@@ -294,7 +462,11 @@ class Command(BaseCommand):
         )
 
         self.populate_table(
-            table_name="fiches_de_poste", table_columns=_job_descriptions.TABLE_COLUMNS, queryset=queryset
+            table_name="fiches_de_poste",
+            table_columns=_job_descriptions.TABLE_COLUMNS,
+            queryset=queryset,
+            upsert_key="id",
+            changed_rows_filter=_job_descriptions.get_changed_rows_filter,
         )
 
     def populate_organizations(self):
@@ -303,9 +475,8 @@ class Command(BaseCommand):
         and add a special "ORG_OF_PRESCRIBERS_WITHOUT_ORG" to gather stats
         of prescriber users *without* any organization.
         """
-        queryset = PrescriberOrganization.objects.prefetch_related(
-            "prescribermembership_set", "members", "jobapplication_set"
-        ).all()
+        # Statistics are computed by the database, see `_organizations.TABLE_COLUMNS` annotations.
+        queryset = PrescriberOrganization.objects.all()
 
         self.populate_table(
             table_name="organisations",
@@ -326,7 +497,11 @@ class Command(BaseCommand):
         )
 
         self.populate_table(
-            table_name="candidatures", table_columns=_job_applications.TABLE_COLUMNS, queryset=queryset
+            table_name="candidatures",
+            table_columns=_job_applications.TABLE_COLUMNS,
+            queryset=queryset,
+            upsert_key="id_anonymisé",
+            changed_rows_filter=_job_applications.get_changed_rows_filter,
         )
 
     def populate_selected_jobs(self):
@@ -338,13 +513,12 @@ class Command(BaseCommand):
         self.log(f"Preparing content for {table_name} table by chunk of {chunk_size} items...")
 
         # Iterating directly on this very large queryset results in psycopg2.errors.DiskFull error.
-        # We use pagination to mitigate this issue.
+        # We use keyset pagination to mitigate this issue.
         queryset = JobApplication.objects.prefetch_related("selected_jobs").all()
-        paginator = Paginator(queryset, chunk_size)
 
         rows = []
-        for page_idx in tqdm(range(1, paginator.num_pages + 1)):
-            for ja in paginator.page(page_idx).object_list:
+        for chunk in tqdm(queryset_chunks(queryset, chunk_size=chunk_size)):
+            for ja in chunk:
                 for jd in ja.selected_jobs.all():
                     # We want to preserve the order of columns.
                     row = OrderedDict()
@@ -390,19 +564,24 @@ class Command(BaseCommand):
         """
         queryset = (
             User.objects.filter(is_job_seeker=True)
+            .select_related("created_by")
             .prefetch_related(
                 "eligibility_diagnoses",
                 "eligibility_diagnoses__administrative_criteria",
                 "eligibility_diagnoses__author_prescriber_organization",
                 "eligibility_diagnoses__author_siae",
-                "job_applications",
-                "job_applications__to_siae",
                 "socialaccount_set",
             )
             .all()
         )
 
-        self.populate_table(table_name="candidats", table_columns=_job_seekers.TABLE_COLUMNS, queryset=queryset)
+        self.populate_table(
+            table_name="candidats",
+            table_columns=_job_seekers.TABLE_COLUMNS,
+            queryset=queryset,
+            upsert_key="id_anonymisé",
+            changed_rows_filter=_job_seekers.get_changed_rows_filter,
+        )
 
     def populate_rome_codes(self):
         queryset = Rome.objects.all()
@@ -443,7 +622,7 @@ class Command(BaseCommand):
         """
         fatal_errors = 0
         self.log("Checking data for inconsistencies.")
-        for approval in Approval.objects.prefetch_related("user").all():
+        for approval in queryset_iterator(Approval.objects.select_related("user")):
             user = approval.user
             if not user.is_job_seeker:
                 self.log(f"FATAL ERROR: user {user.id} has an approval but is not a job seeker")
@@ -458,6 +637,13 @@ class Command(BaseCommand):
     def build_custom_tables(self):
         build_custom_tables(dry_run=self.dry_run)
 
+    def run_step(self, step_name):
+        if VERBOSE_SLACK_MESSAGES:
+            send_slack_message(f"Début de l'étape {step_name} :rocket:")
+        getattr(self, step_name)()
+        if VERBOSE_SLACK_MESSAGES:
+            send_slack_message(f"Fin de l'étape {step_name} :white_check_mark:")
+
     def populate_metabase_itou(self):
         if not settings.ALLOW_POPULATING_METABASE:
             self.log("Populating metabase is not allowed in this environment.")
@@ -467,36 +653,63 @@ class Command(BaseCommand):
             ":rocket: Début de la mise à jour quotidienne de Metabase avec les dernières données C1 :rocket:"
         )
 
-        updates = [
-            self.populate_siaes,
-            self.populate_job_descriptions,
-            self.populate_organizations,
-            self.populate_job_seekers,
-            self.populate_job_applications,
-            self.populate_selected_jobs,
-            self.populate_approvals,
-            self.populate_rome_codes,
-            self.populate_insee_codes,
-            self.populate_departments,
-            self.build_custom_tables,
-            self.report_data_inconsistencies,
+        populate_steps = [
+            "populate_siaes",
+            "populate_job_descriptions",
+            "populate_organizations",
+            "populate_job_seekers",
+            "populate_job_applications",
+            "populate_selected_jobs",
+            "populate_approvals",
+            "populate_rome_codes",
+            "populate_insee_codes",
+            "populate_departments",
         ]
+        # Populate steps are independent from each other, custom tables are built from their results.
+        steps = {step_name: [] for step_name in populate_steps}
+        steps["build_custom_tables"] = populate_steps
+        steps["report_data_inconsistencies"] = []
+
+        results = run_steps(
+            steps=steps,
+            run_step=partial(
+                run_populate_step, dry_run=self.dry_run, incremental=self.incremental, verbosity=self.verbosity
+            ),
+            max_workers=settings.METABASE_POPULATE_MAX_WORKERS,
+        )
 
-        for update in updates:
-            if VERBOSE_SLACK_MESSAGES:
-                send_slack_message(f"Début de l'étape {update.__name__} :rocket:")
-            update()
-            if VERBOSE_SLACK_MESSAGES:
-                send_slack_message(f"Fin de l'étape {update.__name__} :white_check_mark:")
+        summary = "\n".join(
+            f"• {result.name} : {format_duration(result.duration)}" + (f" :x: {result.error}" if result.error else "")
+            for result in results
+        )
+        failed_steps = [result.name for result in results if result.error]
+        if failed_steps:
+            send_slack_message(
+                ":x: Échec de la mise à jour quotidienne de Metabase avec les dernières données C1 :x:\n" + summary
+            )
+            raise RuntimeError(f"Metabase population failed at steps {', '.join(failed_steps)}, see command output")
 
         send_slack_message(
             ":white_check_mark: Fin de la mise à jour quotidienne de Metabase avec les"
-            " dernières données C1 :white_check_mark:"
+            " dernières données C1 :white_check_mark:\n" + summary
         )
 
-    def handle(self, dry_run=False, **options):
-        self.set_logger(options.get("verbosity"))
+    def handle(self, dry_run=False, full_rebuild=False, **options):
+        self.verbosity = options.get("verbosity")
+        self.set_logger(self.verbosity)
         self.dry_run = dry_run
+        self.incremental = not full_rebuild
         self.populate_metabase_itou()
         self.log("-" * 80)
         self.log("Done.")
+
+
+def run_populate_step(step_name, dry_run, incremental, verbosity):
+    """
+    Entry point of worker processes: each step runs on a command instance of its own.
+    """
+    command = Command()
+    command.set_logger(verbosity)
+    command.dry_run = dry_run
+    command.incremental = incremental
+    command.run_step(step_name)
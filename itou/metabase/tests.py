@@ -0,0 +1,257 @@
+import datetime
+from unittest import mock
+
+import pandas as pd
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.test import SimpleTestCase, TestCase
+from django.utils.crypto import salted_hmac
+
+from itou.job_applications.factories import JobApplicationFactory
+from itou.job_applications.models import JobApplication
+from itou.metabase.management.commands._anonymization import Anonymizer
+from itou.metabase.management.commands._database_psycopg2 import copy_rows, format_copy_value
+from itou.metabase.management.commands._database_tables import get_watermark
+from itou.metabase.management.commands._scheduler import run_steps, run_timed_step
+from itou.metabase.management.commands.populate_metabase_itou import Command
+
+
+class TestDatabaseConnection:
+    """
+    Stand-in for the connection to the metabase database: the test database is used instead,
+    and everything written by a test is rolled back with its transaction.
+    """
+
+    def cursor(self):
+        return connection.connection.cursor()
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MetabaseDatabaseTestCase(TestCase):
+    def setUp(self):
+        connection.ensure_connection()
+        patcher = mock.patch(
+            "itou.metabase.management.commands._database_psycopg2.get_connection",
+            return_value=TestDatabaseConnection(),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetch_rows(self, query, params=None):
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+
+class FormatCopyValueTest(SimpleTestCase):
+    def test_missing_values(self):
+        for value in [None, float("nan"), pd.NaT, pd.NA]:
+            with self.subTest(value=value):
+                self.assertEqual(format_copy_value(value), "\\N")
+
+    def test_escaping(self):
+        self.assertEqual(format_copy_value("a\tb\nc\rd\\e"), "a\\tb\\nc\\rd\\\\e")
+        # Not a missing value.
+        self.assertEqual(format_copy_value("\\N"), "\\\\N")
+
+    def test_values(self):
+        self.assertEqual(format_copy_value(42), "42")
+        self.assertEqual(format_copy_value(float("inf")), "Infinity")
+        self.assertEqual(format_copy_value(float("-inf")), "-Infinity")
+        self.assertEqual(format_copy_value(datetime.date(2022, 1, 31)), "2022-01-31")
+        self.assertEqual(
+            format_copy_value(datetime.datetime(2022, 1, 31, 12, 30, tzinfo=datetime.timezone.utc)),
+            "2022-01-31T12:30:00+00:00",
+        )
+        self.assertEqual(
+            format_copy_value(datetime.timedelta(days=2, seconds=3, microseconds=4)), "2 days 3.000004 seconds"
+        )
+
+
+class CopyRowsTest(MetabaseDatabaseTestCase):
+    def test_copy_rows(self):
+        rows = [
+            (1, "tab\tnewline\ncarriage return\rbackslash\\", 1.5),
+            (2, "\\N", None),
+            (3, None, float("nan")),
+            (4, "", pd.NA),
+        ]
+        with TestDatabaseConnection().cursor() as cursor:
+            cursor.execute("CREATE TABLE copy_test (id integer, text varchar, number float)")
+            row_count = copy_rows(cursor, "copy_test", ["id", "text", "number"], rows)
+        self.assertEqual(row_count, 4)
+        self.assertEqual(
+            self.fetch_rows("SELECT id, text, number FROM copy_test ORDER BY id"),
+            [
+                (1, "tab\tnewline\ncarriage return\rbackslash\\", 1.5),
+                (2, "\\N", None),
+                (3, None, None),
+                (4, "", None),
+            ],
+        )
+
+
+def get_table_columns(extra_columns=()):
+    # `populate_table` adds its own columns to the given list.
+    return [
+        {"name": "id", "type": "varchar", "comment": "ID", "fn": lambda o: str(o.pk)},
+        *extra_columns,
+        {"name": "état", "type": "varchar", "comment": "État", "fn": lambda o: o.state},
+    ]
+
+
+def get_changed_rows_filter(since):
+    return Q(created_at__gt=since) | Q(updated_at__gt=since)
+
+
+class PopulateTableTest(MetabaseDatabaseTestCase):
+    def populate_table(self, table_columns):
+        command = Command()
+        command.set_logger(verbosity=1)
+        command.dry_run = False
+        command.incremental = True
+        command.populate_table(
+            table_name="candidatures_test",
+            table_columns=table_columns,
+            queryset=JobApplication.objects.all(),
+            upsert_key="id",
+            changed_rows_filter=get_changed_rows_filter,
+        )
+
+    def test_incremental(self):
+        job_application, deleted_job_application, unchanged_job_application = JobApplicationFactory.create_batch(3)
+        self.populate_table(get_table_columns())
+        self.assertCountEqual(
+            self.fetch_rows("SELECT id, état FROM candidatures_test"),
+            [
+                (str(job_application.pk), "new"),
+                (str(deleted_job_application.pk), "new"),
+                (str(unchanged_job_application.pk), "new"),
+            ],
+        )
+        with connection.cursor() as cursor:
+            watermark = get_watermark(cursor, "candidatures_test")
+        self.assertIsNotNone(watermark)
+
+        job_application.process()
+        deleted_job_application.delete()
+        new_job_application = JobApplicationFactory()
+        old_update_date = datetime.date(2000, 1, 1)
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE candidatures_test SET date_mise_à_jour_metabase = %s", [old_update_date])
+
+        inject_chunk = mock.patch.object(Command, "inject_chunk", autospec=True, side_effect=Command.inject_chunk)
+        with inject_chunk as inject_chunk_mock:
+            self.populate_table(get_table_columns())
+        # Only the changed rows were injected.
+        [injected_chunk] = [kwargs["chunk"] for _args, kwargs in inject_chunk_mock.call_args_list]
+        self.assertCountEqual(injected_chunk, [job_application, new_job_application])
+        # Changed rows were merged and the row of the deleted job application removed.
+        self.assertCountEqual(
+            self.fetch_rows("SELECT id, état FROM candidatures_test"),
+            [
+                (str(job_application.pk), "processing"),
+                (str(new_job_application.pk), "new"),
+                (str(unchanged_job_application.pk), "new"),
+            ],
+        )
+        # The update date of unchanged rows is refreshed as well.
+        [[update_date]] = self.fetch_rows("SELECT DISTINCT date_mise_à_jour_metabase FROM candidatures_test")
+        self.assertNotEqual(update_date, old_update_date)
+        with connection.cursor() as cursor:
+            self.assertGreater(get_watermark(cursor, "candidatures_test"), watermark)
+
+    def test_columns_changed(self):
+        job_application = JobApplicationFactory()
+        self.populate_table(get_table_columns())
+
+        # No job application changed, yet the new column must be filled for every row.
+        extra_column = {"name": "message", "type": "varchar", "comment": "Message", "fn": lambda o: o.message}
+        self.populate_table(get_table_columns(extra_columns=[extra_column]))
+        self.assertEqual(
+            self.fetch_rows("SELECT id, message, état FROM candidatures_test"),
+            [(str(job_application.pk), job_application.message, "new")],
+        )
+
+
+def run_test_step(name):
+    # Steps are run by worker processes: this function must be importable.
+    if name.startswith("failing"):
+        raise ValueError(f"{name} failed")
+
+
+@mock.patch("itou.metabase.management.commands._scheduler.traceback.print_exc")
+class SchedulerTest(SimpleTestCase):
+    def test_run_timed_step(self, print_exc):
+        self.assertEqual(run_timed_step(run_test_step, "step").error, None)
+        self.assertEqual(run_timed_step(run_test_step, "failing_step").error, "ValueError('failing_step failed')")
+        print_exc.assert_called_once()
+
+    def test_run_steps(self, print_exc):
+        steps = {
+            "failing_step": [],
+            "step": [],
+            "step_depending_on_failing_step": ["failing_step"],
+            "step_depending_on_step": ["step"],
+            "failing_step_depending_on_step": ["step"],
+        }
+        results = run_steps(steps=steps, run_step=run_test_step, max_workers=2)
+
+        errors = {result.name: result.error for result in results}
+        self.assertEqual(
+            errors,
+            {
+                "failing_step": "ValueError('failing_step failed')",
+                "step": None,
+                "step_depending_on_failing_step": "Non exécutée car failing_step a échoué",
+                "step_depending_on_step": None,
+                "failing_step_depending_on_step": "ValueError('failing_step_depending_on_step failed')",
+            },
+        )
+        # Results are listed in completion order: steps run once their dependencies are done.
+        names = [result.name for result in results]
+        self.assertLess(names.index("step"), names.index("step_depending_on_step"))
+        self.assertLess(names.index("failing_step"), names.index("step_depending_on_failing_step"))
+        self.assertEqual(results[names.index("step_depending_on_failing_step")].duration, 0)
+
+    def test_run_steps_unresolvable_dependencies(self, print_exc):
+        with self.assertRaisesRegex(ValueError, "Unresolvable dependencies for steps step"):
+            run_steps(steps={"step": ["missing_step"]}, run_step=run_test_step, max_workers=1)
+
+
+class AnonymizerTest(SimpleTestCase):
+    def test_anonymize(self):
+        anonymizer = Anonymizer(max_size=10)
+        hashed_value = anonymizer.anonymize(42, salt="job_seeker.id")
+        self.assertEqual(hashed_value, salted_hmac("job_seeker.id", 42, secret=settings.SECRET_KEY).hexdigest())
+        self.assertNotIn("42", hashed_value)
+        # Ids are hashed the same whatever their type.
+        self.assertEqual(anonymizer.anonymize("42", salt="job_seeker.id"), hashed_value)
+        # Same ids of different kinds get different hashes.
+        self.assertNotEqual(anonymizer.anonymize(42, salt="job_application.id"), hashed_value)
+
+    def test_memoization(self):
+        anonymizer = Anonymizer(max_size=2)
+        with mock.patch(
+            "itou.metabase.management.commands._anonymization.salted_hmac", wraps=salted_hmac
+        ) as salted_hmac_mock:
+            first_hash = anonymizer.anonymize(1, salt="salt")
+            self.assertEqual(anonymizer.anonymize(1, salt="salt"), first_hash)
+            self.assertEqual(salted_hmac_mock.call_count, 1)
+
+            # The oldest hash is evicted once the cache is full.
+            anonymizer.anonymize(2, salt="salt")
+            anonymizer.anonymize(3, salt="salt")
+            self.assertEqual(len(anonymizer.cache), 2)
+            self.assertNotIn(("salt", "1"), anonymizer.cache)
+            self.assertEqual(salted_hmac_mock.call_count, 3)
+
+            # Evicted hashes are computed again, identically.
+            self.assertEqual(anonymizer.anonymize(1, salt="salt"), first_hash)
+            self.assertEqual(salted_hmac_mock.call_count, 4)
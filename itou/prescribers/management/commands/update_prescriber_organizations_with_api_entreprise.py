@@ -6,7 +6,7 @@ from django.db.models import Q
 from django.utils import timezone
 
 from itou.prescribers.models import PrescriberOrganization
-from itou.utils.apis.api_entreprise import etablissement_get_or_error
+from itou.utils.apis.api_entreprise import etablissements_get_or_error
 
 
 class Command(BaseCommand):
@@ -17,8 +17,16 @@ class Command(BaseCommand):
 
     With around 5k organizations in DB, it's one update a month for every
     organization.
+
+    Organizations are fetched concurrently within the rate limit of API Entreprise
+    and saved by chunks: an interrupted run is resumed by the next one.
+
+    To update every organization:
+        django-admin update_prescriber_organizations_with_api_entreprise --max=100000 --days=0
     """
 
+    CHUNK_SIZE = 100
+
     help = "Fetch informations from API Entreprise to update organizations."
 
     def add_arguments(self, parser):
@@ -40,6 +48,15 @@ class Command(BaseCommand):
             required=False,
             default=7,
         )
+        parser.add_argument(
+            "--workers",
+            dest="workers",
+            metavar="N",
+            type=int,
+            help="Number of concurrent calls to API Entreprise",
+            required=False,
+            default=8,
+        )
 
     def set_logger(self, verbosity):
         """
@@ -55,24 +72,41 @@ class Command(BaseCommand):
         if verbosity > 1:
             self.logger.setLevel(logging.DEBUG)
 
-    def handle(self, days, n_organizations, verbosity, **options):
+    def handle(self, days, n_organizations, workers, verbosity, **options):
         self.set_logger(verbosity)
 
         prescriber_orgs = PrescriberOrganization.objects.filter(
             Q(updated_at__lte=timezone.now() - datetime.timedelta(days=days)) | Q(updated_at__isnull=True),
         ).exclude(siret__isnull=True)[:n_organizations]
+        orgs_by_siret = {}
         for prescriber_org in prescriber_orgs:
-            self.logger.info("ID %s - SIRET %s - %s", prescriber_org.pk, prescriber_org.siret, prescriber_org.name)
-            etablissement, error = etablissement_get_or_error(
-                prescriber_org.siret, reason="Update prescriber organization"
-            )
-            if error:
-                self.logger.error("| Unable to fetch information: %s", error)
-            elif prescriber_org.is_head_office != etablissement.is_head_office:
-                self.logger.debug("| New status of head office: %s", etablissement.is_head_office)
-                prescriber_org.is_head_office = etablissement.is_head_office
-
-            # Organization is saved to set updated_at field even if no changes because we don't want
-            # to block on organizations that are unrecognized by API Entreprise.
-            # Round after round, only the unrecognized organizations would be selected by the query.
-            prescriber_org.save()
+            orgs_by_siret.setdefault(prescriber_org.siret, []).append(prescriber_org)
+
+        results = etablissements_get_or_error(
+            orgs_by_siret, reason="Update prescriber organization", max_workers=workers
+        )
+        updated_orgs = []
+        for siret, etablissement, error in results:
+            for prescriber_org in orgs_by_siret[siret]:
+                self.logger.info("ID %s - SIRET %s - %s", prescriber_org.pk, siret, prescriber_org.name)
+                if error:
+                    self.logger.error("| Unable to fetch information: %s", error)
+                elif prescriber_org.is_head_office != etablissement.is_head_office:
+                    self.logger.debug("| New status of head office: %s", etablissement.is_head_office)
+                    prescriber_org.is_head_office = etablissement.is_head_office
+
+                # Organization is saved to set updated_at field even if no changes because we don't want
+                # to block on organizations that are unrecognized by API Entreprise.
+                # Round after round, only the unrecognized organizations would be selected by the query.
+                prescriber_org.updated_at = timezone.now()
+                updated_orgs.append(prescriber_org)
+
+            # Save progress regularly.
+            if len(updated_orgs) >= self.CHUNK_SIZE:
+                self.save(updated_orgs)
+                updated_orgs = []
+
+        self.save(updated_orgs)
+
+    def save(self, prescriber_orgs):
+        PrescriberOrganization.objects.bulk_update(prescriber_orgs, ["is_head_office", "updated_at"])
@@ -1,3 +1,5 @@
+from unittest import mock
+
 import httpx
 import respx
 from django.conf import settings
@@ -178,3 +180,36 @@ class PrescriberOrganizationModelTest(TestCase):
         organization.refresh_from_db()
         self.assertNotEqual(old_updated_at, organization.updated_at)
         self.assertTrue(organization.is_head_office)
+
+    @respx.mock
+    @mock.patch(
+        "itou.prescribers.management.commands.update_prescriber_organizations_with_api_entreprise.Command.CHUNK_SIZE",
+        new=1,
+    )
+    def test_update_prescribers_with_api_entreprise_by_chunks(self):
+        siret = ETABLISSEMENT_API_RESULT_MOCK["etablissement"]["siret"]
+        organizations = [
+            PrescriberOrganizationFactory(siret=siret, kind=kind, is_head_office=False)
+            for kind in [PrescriberOrganization.Kind.PE, PrescriberOrganization.Kind.ML]
+        ]
+        unknown_organization = PrescriberOrganizationFactory(siret="12345678900012", is_head_office=False)
+
+        respx.get(f"{settings.API_ENTREPRISE_BASE_URL}/etablissements/{siret}").mock(
+            return_value=httpx.Response(200, json=ETABLISSEMENT_API_RESULT_MOCK)
+        )
+        respx.get(f"{settings.API_ENTREPRISE_BASE_URL}/etablissements/{unknown_organization.siret}").mock(
+            return_value=httpx.Response(422)
+        )
+
+        call_command("update_prescriber_organizations_with_api_entreprise", verbosity=0, days=7, workers=2)
+
+        # Each SIRET is fetched once.
+        self.assertEqual(respx.calls.call_count, 2)
+        for organization in organizations:
+            organization.refresh_from_db()
+            self.assertIsNotNone(organization.updated_at)
+            self.assertTrue(organization.is_head_office)
+        # Unknown organizations are saved as well, so that they do not block the next rounds.
+        unknown_organization.refresh_from_db()
+        self.assertIsNotNone(unknown_organization.updated_at)
+        self.assertFalse(unknown_organization.is_head_office)
@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+
+
+class SiaesConfig(AppConfig):
+    name = "itou.siaes"
+
+    def ready(self):
+        """
+        When the app is loaded:
+        activate the signals keeping the search index up to date
+        """
+        import itou.siaes.signals  # noqa F401
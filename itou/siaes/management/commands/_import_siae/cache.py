@@ -0,0 +1,128 @@
+"""
+
+Columnar cache of the dataframes parsed from ASP exports (fluxIAE, GEIQ, EA/EATT...).
+
+Parsing large CSV exports is slow and the very same drop is read by several commands
+(import_siae, import_geiq, import_ea_eatt, populate_metabase_fluxiae) and several times while iterating.
+The first read thus stores the parsed dataframe in a Parquet file next to the export,
+and later reads memory-map this file instead of parsing the export again.
+
+Cached dataframes are the ones returned to the caller: sensitive data is dropped before caching.
+
+"""
+import hashlib
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+CACHE_DIRNAME = ".cache"
+
+
+def get_cache_filename(filename, options):
+    """
+    The cache of an export is only valid for the given version of the file (its mtime)
+    and the given read options (e.g. converters, anonymization).
+    """
+    path, basename = os.path.split(filename)
+    options_digest = hashlib.sha1(repr(sorted(options.items())).encode()).hexdigest()[:12]
+    mtime = os.stat(filename).st_mtime_ns
+    return os.path.join(path, CACHE_DIRNAME, f"{basename}.{options_digest}.{mtime}.parquet")
+
+
+def cleanup_cache(filename, cache_filename):
+    """
+    Remove cache files of previous versions of the given export and of exports which no longer exist.
+    """
+    path = os.path.dirname(filename)
+    cache_path = os.path.dirname(cache_filename)
+    cache_prefix = os.path.basename(cache_filename).rsplit(".", 2)[0]
+    for name in os.listdir(cache_path):
+        if name.endswith(".tmp"):
+            # Being written by another command.
+            continue
+        source_basename = name.rsplit(".", 3)[0]
+        is_outdated = name.startswith(f"{cache_prefix}.") and name != os.path.basename(cache_filename)
+        if is_outdated or not os.path.exists(os.path.join(path, source_basename)):
+            os.remove(os.path.join(cache_path, name))
+
+
+def get_arrow_schema(df):
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    # Columns having no value at all in the first chunk could have values in later chunks.
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, field.with_type(pa.string()))
+    return schema
+
+
+def read_df_through_cache(filename, options, read_df):
+    """
+    Return the dataframe built by `read_df()` from `filename`, from cache if available.
+    """
+    cache_filename = get_cache_filename(filename, options)
+    if os.path.exists(cache_filename):
+        print(f"Loading {filename} from cache {cache_filename} ...")
+        return pd.read_parquet(cache_filename, engine="pyarrow", memory_map=True)
+
+    df = read_df()
+
+    os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
+    tmp_filename = f"{cache_filename}.tmp"
+    try:
+        df.to_parquet(tmp_filename, engine="pyarrow", index=False, schema=get_arrow_schema(df))
+    except pa.ArrowException as e:
+        # E.g. a column mixing strings and numbers. Not caching is not a big deal.
+        print(f"Could not cache {filename}: {repr(e)}")
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        return df
+    os.replace(tmp_filename, cache_filename)
+    cleanup_cache(filename, cache_filename)
+    return df
+
+
+def iter_df_chunks_through_cache(filename, options, read_df_chunks):
+    """
+    Yield the dataframes yielded by `read_df_chunks()` from `filename`, from cache if available.
+    Each chunk is cached as a row group of its own, so that only one chunk at a time is held in memory
+    either way.
+    """
+    cache_filename = get_cache_filename(filename, options)
+    if os.path.exists(cache_filename):
+        print(f"Loading {filename} from cache {cache_filename} ...")
+        parquet_file = pq.ParquetFile(cache_filename, memory_map=True)
+        for i in range(parquet_file.num_row_groups):
+            yield parquet_file.read_row_group(i).to_pandas()
+        return
+
+    os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
+    tmp_filename = f"{cache_filename}.tmp"
+    writer = None
+    caching = True
+    try:
+        for df in read_df_chunks():
+            if caching:
+                try:
+                    if writer is None:
+                        writer = pq.ParquetWriter(tmp_filename, schema=get_arrow_schema(df))
+                    table = pa.Table.from_pandas(df, schema=writer.schema, preserve_index=False)
+                    writer.write_table(table, row_group_size=len(df) or None)
+                except pa.ArrowException as e:
+                    # E.g. a column mixing strings and numbers. Not caching is not a big deal.
+                    print(f"Could not cache {filename}: {repr(e)}")
+                    caching = False
+            yield df
+        if caching and writer:
+            writer.close()
+            writer = None
+            os.replace(tmp_filename, cache_filename)
+            cleanup_cache(filename, cache_filename)
+    finally:
+        # The temporary file is left over when caching failed or when the caller stopped iterating early.
+        if writer:
+            writer.close()
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
@@ -6,7 +6,6 @@ All these helpers are specific to SIAE logic (not GEIQ, EA, EATT).
 
 """
 from itou.common_apps.address.departments import department_from_postcode
-from itou.siaes.management.commands._import_siae.utils import geocode_siae
 from itou.siaes.management.commands._import_siae.vue_af import ACTIVE_SIAE_KEYS
 from itou.siaes.management.commands._import_siae.vue_structure import SIRET_TO_ASP_ID
 from itou.siaes.models import Siae
@@ -68,7 +67,4 @@ def build_siae(row, kind):
     siae.post_code = row.post_code
     siae.department = department_from_postcode(siae.post_code)
 
-    if should_siae_be_created(siae):
-        siae = geocode_siae(siae)
-
     return siae
@@ -4,17 +4,23 @@ Various helpers shared by the import_siae, import_geiq and import_ea_eatt script
 
 """
 import csv
+import datetime
 import gzip
+import json
 import os
 from functools import wraps
 from time import time
 
 import pandas as pd
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 
+from itou.api.siae_api.signals import bump_department_version_on_commit
 from itou.common_apps.address.models import AddressMixin
-from itou.siaes.models import Siae
-from itou.utils.apis.geocoding import get_geocoding_data
+from itou.siaes.management.commands._import_siae.cache import iter_df_chunks_through_cache, read_df_through_cache
+from itou.siaes.models import Siae, SiaeSearchIndex
+from itou.utils.apis.geocoding import get_geocoding_data_many
 
 
 CURRENT_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -125,35 +131,44 @@ def remap_columns(df, column_mapping):
 
 
 def could_siae_be_deleted(siae):
-    if siae.members.count() >= 1 or siae.job_applications_received.count() >= 1:
+    """
+    Siaes annotated with `SiaeQuerySet.with_deletability_flags` are checked without any query.
+    """
+    if not hasattr(siae, "has_members"):
+        siae = Siae.objects.with_deletability_flags().get(pk=siae.pk)
+    if siae.has_members or siae.has_received_job_applications:
         return False
     # An ASP siae can only be deleted when all its antennas have been deleted.
     if siae.source == Siae.SOURCE_ASP:
-        return siae.convention.siaes.count() == 1
+        return siae.count_convention_siaes == 1
     return True
 
 
-def geocode_siae(siae):
-    if siae.geocoding_address is None:
-        return siae
-
-    geocoding_data = get_geocoding_data(siae.geocoding_address, post_code=siae.post_code)
+def geocode_siaes(siaes):
+    """
+    Geocode the given siaes in place, by batches.
+    """
+    geocodable_siaes = [siae for siae in siaes if siae.geocoding_address is not None]
+    geocoding_data_by_address = get_geocoding_data_many(
+        {(siae.geocoding_address, siae.post_code) for siae in geocodable_siaes}
+    )
 
-    if geocoding_data:
-        siae.geocoding_score = geocoding_data["score"]
-        # If the score is greater than API_BAN_RELIABLE_MIN_SCORE, coords are reliable:
-        # use data returned by the BAN API because it's better written using accents etc.
-        # while the source data is in all caps etc.
-        # Otherwise keep the old address (which is probably wrong or incomplete).
-        if siae.geocoding_score >= AddressMixin.API_BAN_RELIABLE_MIN_SCORE:
-            siae.address_line_1 = geocoding_data["address_line_1"]
-        # City is always good due to `postcode` passed in query.
-        # ST MAURICE DE REMENS => Saint-Maurice-de-Rémens
-        siae.city = geocoding_data["city"]
+    for siae in geocodable_siaes:
+        geocoding_data = geocoding_data_by_address[(siae.geocoding_address, siae.post_code)]
 
-        siae.coords = geocoding_data["coords"]
+        if geocoding_data:
+            siae.geocoding_score = geocoding_data["score"]
+            # If the score is greater than API_BAN_RELIABLE_MIN_SCORE, coords are reliable:
+            # use data returned by the BAN API because it's better written using accents etc.
+            # while the source data is in all caps etc.
+            # Otherwise keep the old address (which is probably wrong or incomplete).
+            if siae.geocoding_score >= AddressMixin.API_BAN_RELIABLE_MIN_SCORE:
+                siae.address_line_1 = geocoding_data["address_line_1"]
+            # City is always good due to `postcode` passed in query.
+            # ST MAURICE DE REMENS => Saint-Maurice-de-Rémens
+            siae.city = geocoding_data["city"]
 
-    return siae
+            siae.coords = geocoding_data["coords"]
 
 
 def sync_structures(df, source, kinds, build_structure, dry_run):
@@ -168,55 +183,54 @@ def sync_structures(df, source, kinds, build_structure, dry_run):
     - source: either Siae.SOURCE_GEIQ or Siae.SOURCE_EA_EATT
     - kinds: possible kinds of the structures
     - build_structure: a method building a structure from a dataframe row
+
+    Structures of the database are loaded at once along with what prevents their deletion,
+    and joined with the export to find the structures to create, update and delete.
+    Changes are applied by bulk and described in a JSON report (see `write_sync_report`).
     """
     print(f"Loaded {len(df)} {source} from export.")
 
-    db_sirets = set([siae.siret for siae in Siae.objects.filter(kind__in=kinds)])
-    df_sirets = set(df.siret.tolist())
+    siaes_by_id = {siae.pk: siae for siae in Siae.objects.filter(kind__in=kinds).with_deletability_flags()}
+    db_df = pd.DataFrame([(siae.pk, siae.siret) for siae in siaes_by_id.values()], columns=["siae_id", "siret"])
+    sirets_df = df[["siret"]].merge(db_df, on="siret", how="outer", indicator=True)
 
-    creatable_sirets = df_sirets - db_sirets
+    creatable_sirets = sirets_df.siret[sirets_df._merge == "left_only"]
     print(f"{len(creatable_sirets)} {source} will be created.")
-    updatable_sirets = db_sirets.intersection(df_sirets)
-    print(f"{len(updatable_sirets)} {source} will be updated when needed.")
-    deletable_sirets = db_sirets - df_sirets
-    print(f"{len(deletable_sirets)} {source} will be deleted when possible.")
+    updatable_ids = sirets_df.siae_id[sirets_df._merge == "both"].astype(int)
+    updatable_siaes = [siaes_by_id[siae_id] for siae_id in updatable_ids]
+    print(f"{len(updatable_siaes)} {source} will be updated when needed.")
+    deletable_ids = sirets_df.siae_id[sirets_df._merge == "right_only"].astype(int)
+    deletable_siaes = [siaes_by_id[siae_id] for siae_id in deletable_ids]
+    print(f"{len(deletable_siaes)} {source} will be deleted when possible.")
+
+    report = {"source": source, "dry_run": dry_run, "created": [], "converted": [], "deleted": [], "undeletable": []}
 
     # Create structures which do not exist in database yet.
-    siret_to_row = {row.siret: row for _, row in df.iterrows()}
-    for siret in creatable_sirets:
-        row = siret_to_row[siret]
-        siae = build_structure(row)
-        if not dry_run:
-            siae.save()
-            print(f"siae.id={siae.id} has been created.")
+    created_siaes = [build_structure(row) for _, row in df[df.siret.isin(creatable_sirets)].iterrows()]
+    geocode_siaes(created_siaes)
 
     # Update structures which already exist in database.
-    for siret in updatable_sirets:
-        siae = Siae.objects.get(siret=siret, kind__in=kinds)
-        if siae.source != source:
-            # If a user/staff created structure already exists in db and its siret is later found in an export,
-            # it makes sense to convert it.
-            print(f"siae.id={siae.id} will be converted to source={source}.")
-            if not dry_run:
-                siae.source = source
-                siae.save()
+    # If a user/staff created structure already exists in db and its siret is later found in an export,
+    # it makes sense to convert it.
+    converted_siaes = [siae for siae in updatable_siaes if siae.source != source]
+    for siae in converted_siaes:
+        report["converted"].append(
+            {"siae_id": siae.pk, "siret": siae.siret, "kind": siae.kind, "previous_source": siae.source}
+        )
+        siae.source = source
+        siae.updated_at = timezone.now()
 
     # Delete structures which no longer exist in the latest export.
-    deleted_count = 0
-    undeletable_count = 0
-    for siret in deletable_sirets:
-        siae = Siae.objects.get(siret=siret, kind__in=kinds)
-
-        one_week_ago = timezone.now() - timezone.timedelta(days=7)
+    deleted_siaes = []
+    one_week_ago = timezone.now() - timezone.timedelta(days=7)
+    for siae in deletable_siaes:
         if siae.source == Siae.SOURCE_STAFF_CREATED and siae.created_at >= one_week_ago:
             # When our staff creates a structure, let's give the user sufficient time to join it before deleting it.
             continue
 
         if could_siae_be_deleted(siae):
-            print(f"siae.id={siae.id} will be deleted.")
-            deleted_count += 1
-            if not dry_run:
-                siae.delete()
+            deleted_siaes.append(siae)
+            report["deleted"].append({"siae_id": siae.pk, "siret": siae.siret, "kind": siae.kind})
             continue
 
         if siae.source == Siae.SOURCE_USER_CREATED:
@@ -226,11 +240,43 @@ def sync_structures(df, source, kinds, build_structure, dry_run):
 
         # As of 2021/04/15, 2 GEIQ are undeletable.
         # As of 2021/04/15, 8 EA_EATT are undeletable.
-        print(f"siae.id={siae.id} siret={siae.siret} source={siae.source} cannot be deleted as it has data.")
-        undeletable_count += 1
+        report["undeletable"].append(
+            {"siae_id": siae.pk, "siret": siae.siret, "kind": siae.kind, "source": siae.source}
+        )
+
+    if not dry_run:
+        with transaction.atomic():
+            Siae.objects.bulk_create(created_siaes)
+            Siae.objects.bulk_update(converted_siaes, ["source", "updated_at"])
+            Siae.objects.filter(pk__in=[siae.pk for siae in deleted_siaes]).delete()
+            # Bulk operations do not send the signals keeping the search index and the siaes API cache up to date.
+            SiaeSearchIndex.objects.refresh(siae_ids=[siae.pk for siae in created_siaes + converted_siaes])
+            for department in {siae.department for siae in created_siaes + converted_siaes}:
+                bump_department_version_on_commit(department)
+
+    report["created"] = [
+        {"siae_id": siae.pk, "siret": siae.siret, "kind": siae.kind, "name": siae.name} for siae in created_siaes
+    ]
+
+    print(f"{len(report['created'])} {source} have been created.")
+    print(f"{len(report['converted'])} {source} have been converted to source={source}.")
+    print(f"{len(report['deleted'])} {source} can and will be deleted.")
+    print(f"{len(report['undeletable'])} {source} cannot be deleted as they have data.")
+    write_sync_report(report)
+    return report
+
 
-    print(f"{deleted_count} {source} can and will be deleted.")
-    print(f"{undeletable_count} {source} cannot be deleted as they have data.")
+def write_sync_report(report):
+    """
+    Write the changes made by `sync_structures` as JSON, for the record and for further processing.
+    `siae_id` of created structures is None in case of dry run.
+    """
+    log_datetime = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+    name = f"sync_structures-{report['source'].lower()}{'-dry_run' if report['dry_run'] else ''}"
+    path = f"{settings.EXPORT_DIR}/{log_datetime}-{name}-{settings.ITOU_ENVIRONMENT.lower()}.json"
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to `{path}`.")
 
 
 def anonymize_fluxiae_df(df):
@@ -282,28 +328,25 @@ def anonymize_fluxiae_df(df):
     return df
 
 
-def get_fluxiae_df(
-    vue_name,
-    converters=None,
-    description=None,
-    parse_dates=None,
-    skip_first_row=True,
-    anonymize_sensitive_data=True,
-    dry_run=False,
-):
+def count_fluxiae_rows(filename, dry_run=False):
     """
-    Load fluxIAE CSV file as a dataframe.
-    Any sensitive data will be dropped and/or anonymized.
+    Count data rows of a fluxIAE export without loading it in memory.
     """
-    filename = get_filename(
-        filename_prefix=vue_name,
-        filename_extension=".csv",
-        description=description,
-    )
+    with gzip.open(filename) as f:
+        # Ignore 3 rows: the `DEB*` first row, the headers row, and the `FIN*` last row.
+        nrows = -3
+        for line in f:
+            nrows += 1
+            if dry_run and nrows == 100:
+                break
+    return nrows
 
-    # Prepare parameters for pandas.read_csv method.
-    kwargs = {}
 
+def read_fluxiae_csv(filename, nrows, skip_first_row=True, **kwargs):
+    """
+    Thin wrapper around `pandas.read_csv` with the options required by all fluxIAE exports.
+    Extra `kwargs` are passed to `pandas.read_csv`, e.g. `chunksize` to get an iterator of dataframes.
+    """
     if skip_first_row:
         # Some fluxIAE exports have a leading "DEB***" row, some don't.
         kwargs["skiprows"] = 1
@@ -319,23 +362,7 @@ def get_fluxiae_df(
     # the rows in the CSV file beforehands instead. Always using the 'c' engine is proven to significantly reduce
     # the duration and frequency of the developer's headaches.
 
-    with gzip.open(filename) as f:
-        # Ignore 3 rows: the `DEB*` first row, the headers row, and the `FIN*` last row.
-        nrows = -3
-        for line in f:
-            nrows += 1
-            if dry_run and nrows == 100:
-                break
-
-    print(f"Loading {nrows} rows for {vue_name} ...")
-
-    if converters:
-        kwargs["converters"] = converters
-
-    if parse_dates:
-        kwargs["parse_dates"] = parse_dates
-
-    df = pd.read_csv(
+    return pd.read_csv(
         filename,
         sep="|",
         # Some rows have a single `"` in a field, for example in fluxIAE_Mission the mission_descriptif field of
@@ -345,18 +372,145 @@ def get_fluxiae_df(
         quoting=csv.QUOTE_NONE,
         nrows=nrows,
         **kwargs,
-        # Fix DtypeWarning (Columns have mixed types) and avoid error when field value in later rows contradicts
-        # the field data format guessed on first rows.
-        low_memory=False,
     )
 
-    # If there is only one column, something went wrong, let's break early.
-    # Most likely an incorrect skip_first_row value.
-    assert len(df.columns.tolist()) >= 2
 
-    assert len(df) == nrows
+def get_fluxiae_df(
+    vue_name,
+    converters=None,
+    description=None,
+    parse_dates=None,
+    skip_first_row=True,
+    anonymize_sensitive_data=True,
+    dry_run=False,
+):
+    """
+    Load fluxIAE CSV file as a dataframe.
+    Any sensitive data will be dropped and/or anonymized.
+    Parsed dataframes are cached, see `cache.read_df_through_cache`.
+    """
+    filename = get_filename(
+        filename_prefix=vue_name,
+        filename_extension=".csv",
+        description=description,
+    )
+
+    def read_df():
+        # Prepare parameters for pandas.read_csv method.
+        kwargs = {}
+
+        nrows = count_fluxiae_rows(filename, dry_run=dry_run)
 
-    if anonymize_sensitive_data:
-        df = anonymize_fluxiae_df(df)
+        print(f"Loading {nrows} rows for {vue_name} ...")
 
-    return df
+        if converters:
+            kwargs["converters"] = converters
+
+        if parse_dates:
+            kwargs["parse_dates"] = parse_dates
+
+        df = read_fluxiae_csv(
+            filename,
+            nrows=nrows,
+            skip_first_row=skip_first_row,
+            **kwargs,
+            # Fix DtypeWarning (Columns have mixed types) and avoid error when field value in later rows contradicts
+            # the field data format guessed on first rows.
+            low_memory=False,
+        )
+
+        # If there is only one column, something went wrong, let's break early.
+        # Most likely an incorrect skip_first_row value.
+        assert len(df.columns.tolist()) >= 2
+
+        assert len(df) == nrows
+
+        if anonymize_sensitive_data:
+            df = anonymize_fluxiae_df(df)
+
+        return df
+
+    if dry_run:
+        return read_df()
+
+    options = {
+        "converters": converters,
+        "parse_dates": parse_dates,
+        "skip_first_row": skip_first_row,
+        "anonymize_sensitive_data": anonymize_sensitive_data,
+    }
+    return read_df_through_cache(filename, options=options, read_df=read_df)
+
+
+def merge_dtypes(dtypes):
+    """
+    Merge the dtypes inferred by pandas for the same column on different chunks of a file,
+    the same way pandas would have inferred it on the whole file at once.
+    """
+    dtypes = set(dtypes)
+    if len(dtypes) == 1:
+        return dtypes.pop()
+    if all(pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype) for dtype in dtypes):
+        # E.g. an integer column with empty values in some chunks only.
+        return "float64"
+    return "object"
+
+
+def get_fluxiae_df_chunks(
+    vue_name,
+    memory_budget,
+    skip_first_row=True,
+    anonymize_sensitive_data=True,
+    dry_run=False,
+    sample_chunksize=10000,
+):
+    """
+    Load fluxIAE CSV file as an iterator of dataframes, so that only a single chunk is held in memory at a time.
+    Any sensitive data will be dropped and/or anonymized.
+
+    Types inferred by pandas could differ from one chunk to another, thus a first pass over the file infers the
+    type of each column on small chunks. The second pass then reads every chunk with these types.
+    The size of the chunks of the second pass is computed so that a chunk takes about `memory_budget` bytes.
+
+    Parsed chunks are cached, see `cache.iter_df_chunks_through_cache`.
+    """
+    filename = get_filename(filename_prefix=vue_name, filename_extension=".csv")
+
+    def read_df_chunks():
+        nrows = count_fluxiae_rows(filename, dry_run=dry_run)
+
+        column_dtypes = {}
+        bytes_per_row = 1
+        for df in read_fluxiae_csv(filename, nrows=nrows, skip_first_row=skip_first_row, chunksize=sample_chunksize):
+            # If there is only one column, something went wrong, let's break early.
+            # Most likely an incorrect skip_first_row value.
+            assert len(df.columns.tolist()) >= 2
+            for column_name, dtype in df.dtypes.items():
+                column_dtypes.setdefault(column_name, []).append(dtype)
+            if len(df):
+                bytes_per_row = max(bytes_per_row, df.memory_usage(deep=True).sum() / len(df))
+        dtype = {column_name: merge_dtypes(dtypes) for column_name, dtypes in column_dtypes.items()}
+
+        chunksize = max(int(memory_budget / bytes_per_row), 1)
+        print(f"Loading {nrows} rows for {vue_name} by chunks of {chunksize} rows ...")
+
+        loaded_rows = 0
+        for df in read_fluxiae_csv(
+            filename, nrows=nrows, skip_first_row=skip_first_row, chunksize=chunksize, dtype=dtype
+        ):
+            loaded_rows += len(df)
+            if anonymize_sensitive_data:
+                df = anonymize_fluxiae_df(df)
+            yield df
+
+        assert loaded_rows == nrows
+
+    if dry_run:
+        return read_df_chunks()
+
+    options = {
+        "memory_budget": memory_budget,
+        "skip_first_row": skip_first_row,
+        "anonymize_sensitive_data": anonymize_sensitive_data,
+    }
+    return iter_df_chunks_through_cache(filename, options=options, read_df_chunks=read_df_chunks)
@@ -5,9 +5,9 @@ import pandas as pd
 from django.core.management.base import BaseCommand
 
 from itou.common_apps.address.departments import department_from_postcode
+from itou.siaes.management.commands._import_siae.cache import read_df_through_cache
 from itou.siaes.management.commands._import_siae.utils import (
     clean_string,
-    geocode_siae,
     get_filename,
     remap_columns,
     sync_structures,
@@ -35,7 +35,10 @@ def get_ea_eatt_df():
     post_code_field_name = "CODE_POST_Signataire"
     phone_field_name = "TEL_CONT_Signataire"
 
-    df = pd.read_excel(filename, converters={siret_field_name: str, post_code_field_name: str, phone_field_name: str})
+    converters = {siret_field_name: str, post_code_field_name: str, phone_field_name: str}
+    df = read_df_through_cache(
+        filename, options={"converters": converters}, read_df=lambda: pd.read_excel(filename, converters=converters)
+    )
 
     column_mapping = {
         "Denomination_Sociale_Signataire": "name",
@@ -132,8 +135,6 @@ def build_ea_eatt(row):
     siae.city = row.city
     siae.department = row.department
 
-    siae = geocode_siae(siae)
-
     return siae
 
 
@@ -5,9 +5,9 @@ import pandas as pd
 from django.core.management.base import BaseCommand
 
 from itou.common_apps.address.departments import department_from_postcode
+from itou.siaes.management.commands._import_siae.cache import read_df_through_cache
 from itou.siaes.management.commands._import_siae.utils import (
     clean_string,
-    geocode_siae,
     get_filename,
     remap_columns,
     sync_structures,
@@ -21,7 +21,10 @@ from itou.utils.validators import validate_siret
 def get_geiq_df():
     filename = get_filename(filename_prefix="Liste_Geiq", filename_extension=".xls", description="Export GEIQ")
 
-    df = pd.read_excel(filename, converters={"siret": str, "zip": str})
+    converters = {"siret": str, "zip": str}
+    df = read_df_through_cache(
+        filename, options={"converters": converters}, read_df=lambda: pd.read_excel(filename, converters=converters)
+    )
 
     column_mapping = {
         "name": "name",
@@ -83,8 +86,6 @@ def build_geiq(row):
     siae.city = row.city
     siae.department = row.department
 
-    siae = geocode_siae(siae)
-
     return siae
 
 
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from itou.siaes.models import SiaeSearchIndex
+
+
+class Command(BaseCommand):
+    """
+    Compute again the search index of all siaes.
+
+    Signals keep the index up to date, but the job application score of a siae also changes with time passing
+    (recent job applications become old) and some changes are made without signals (`QuerySet.update()`...).
+
+    To run the command:
+        django-admin refresh_siae_search_index
+    """
+
+    help = "Compute again the search index of all siaes."
+
+    def handle(self, **options):
+        count = SiaeSearchIndex.objects.refresh()
+        self.stdout.write(f"Refreshed the search index of {count} siaes.")
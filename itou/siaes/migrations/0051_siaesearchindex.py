@@ -0,0 +1,48 @@
+# Generated by Django 4.0.1 on 2022-01-25 10:12
+
+import django.contrib.gis.db.models.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("siaes", "0050_alter_siae_department"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SiaeSearchIndex",
+            fields=[
+                (
+                    "siae",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="search_index",
+                        serialize=False,
+                        to="siaes.siae",
+                    ),
+                ),
+                ("is_active", models.BooleanField(db_index=True, default=False)),
+                ("kind", models.CharField(max_length=6)),
+                ("department", models.CharField(blank=True, max_length=3)),
+                ("post_code", models.CharField(blank=True, max_length=5)),
+                (
+                    "coords",
+                    django.contrib.gis.db.models.fields.PointField(blank=True, geography=True, null=True, srid=4326),
+                ),
+                ("block_job_applications", models.BooleanField(default=False)),
+                ("has_active_members", models.BooleanField(default=False)),
+                ("count_recent_received_job_apps", models.PositiveIntegerField(default=0)),
+                ("count_active_job_descriptions", models.PositiveIntegerField(default=0)),
+                ("job_app_score", models.FloatField(null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Index de recherche des entreprises",
+                "verbose_name_plural": "Index de recherche des entreprises",
+            },
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.conf import settings
+from django.contrib.gis.db import models as gis_models
 from django.contrib.gis.measure import D
-from django.db import models
+from django.db import models, transaction
 from django.db.models import BooleanField, Case, Count, Exists, OuterRef, Prefetch, Q, Subquery, When
 from django.db.models.functions import Cast, Coalesce
 from django.urls import reverse
@@ -87,7 +88,7 @@ class SiaeQuerySet(OrganizationQuerySet):
         See https://github.com/martsberger/django-sql-utils
         """
         # Avoid a circular import
-        job_application_model = self.model._meta.get_field("jobapplication").related_model
+        job_application_model = self.model._meta.get_field("job_applications_received").related_model
 
         sub_query = Subquery(
             (
@@ -163,6 +164,29 @@ class SiaeQuerySet(OrganizationQuerySet):
             has_active_members=Exists(SiaeMembership.objects.filter(siae=OuterRef("pk"), is_active=True))
         )
 
+    def with_deletability_flags(self):
+        """
+        Annotate what prevents import scripts from deleting a siae, see `could_siae_be_deleted`.
+        """
+        # Avoid a circular import
+        job_application_model = self.model._meta.get_field("job_applications_received").related_model
+        # Prefer sub queries to joins for performance reasons.
+        # See `self.with_count_recent_received_job_apps`.
+        convention_siaes_count = Subquery(
+            (
+                Siae.objects.filter(convention_id=OuterRef("convention_id"))
+                .values("convention")
+                .annotate(count=Count("pk"))
+                .values("count")
+            ),
+            output_field=models.IntegerField(),
+        )
+        return self.annotate(
+            has_members=Exists(SiaeMembership.objects.filter(siae=OuterRef("pk"))),
+            has_received_job_applications=Exists(job_application_model.objects.filter(to_siae=OuterRef("pk"))),
+            count_convention_siaes=Coalesce(convention_siaes_count, 0),
+        )
+
 
 class Siae(AddressMixin, OrganizationAbstract):
     """
@@ -289,6 +313,13 @@ class Siae(AddressMixin, OrganizationAbstract):
         verbose_name_plural = "Entreprises"
         unique_together = ("siret", "kind")
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Department as loaded, see `itou.api.siae_api.signals.invalidate_siae_area`.
+        instance._loaded_department = instance.__dict__.get("department")
+        return instance
+
     @property
     def accept_survey_url(self):
         """
@@ -821,3 +852,82 @@ class SiaeFinancialAnnex(models.Model):
     @property
     def is_active(self):
         return self.state in SiaeFinancialAnnex.STATES_ACTIVE and self.end_at > timezone.now()
+
+
+class SiaeSearchIndexQuerySet(models.QuerySet):
+    def within(self, point, distance_km):
+        return self.filter(coords__dwithin=(point, D(km=distance_km)))
+
+
+class SiaeSearchIndexManager(models.Manager.from_queryset(SiaeSearchIndexQuerySet)):
+    def refresh(self, siae_ids=None):
+        """
+        Compute again the search index of given siaes, or of all siaes when `siae_ids` is None.
+
+        Called by signals whenever a siae, one of its memberships, job descriptions or received job applications
+        changes, and periodically by `refresh_siae_search_index` to catch up with time passing (recent job
+        applications become old) and with changes made without signals (`QuerySet.update()`...).
+        """
+        siaes = (
+            Siae.objects.with_has_active_members()
+            .with_job_app_score()
+            .annotate(
+                is_active=Case(
+                    When(Siae.objects.all().active_lookup, then=True), default=False, output_field=BooleanField()
+                )
+            )
+            .order_by()
+        )
+        if siae_ids is not None:
+            siaes = siaes.filter(pk__in=siae_ids)
+
+        search_indexes = [
+            self.model(
+                siae_id=siae.pk,
+                is_active=siae.is_active,
+                kind=siae.kind,
+                department=siae.department,
+                post_code=siae.post_code,
+                coords=siae.coords,
+                block_job_applications=siae.block_job_applications,
+                has_active_members=siae.has_active_members,
+                count_recent_received_job_apps=siae.count_recent_received_job_apps,
+                count_active_job_descriptions=siae.count_active_job_descriptions,
+                job_app_score=siae.job_app_score,
+            )
+            for siae in siaes.iterator()
+        ]
+
+        with transaction.atomic():
+            to_delete = self.all() if siae_ids is None else self.filter(siae_id__in=siae_ids)
+            to_delete.delete()
+            self.bulk_create(search_indexes, batch_size=1000)
+        return len(search_indexes)
+
+
+class SiaeSearchIndex(models.Model):
+    """
+    Denormalized data used by the siaes search, so that it runs a single indexed query
+    instead of a bunch of correlated subqueries per siae.
+    Kept up to date by `SiaeSearchIndex.objects.refresh()`.
+    """
+
+    siae = models.OneToOneField(Siae, on_delete=models.CASCADE, primary_key=True, related_name="search_index")
+    is_active = models.BooleanField(default=False, db_index=True)
+    kind = models.CharField(max_length=6)
+    department = models.CharField(max_length=3, blank=True)
+    post_code = models.CharField(max_length=5, blank=True)
+    # A GiST index is created on spatial fields.
+    coords = gis_models.PointField(geography=True, null=True, blank=True)
+    block_job_applications = models.BooleanField(default=False)
+    has_active_members = models.BooleanField(default=False)
+    count_recent_received_job_apps = models.PositiveIntegerField(default=0)
+    count_active_job_descriptions = models.PositiveIntegerField(default=0)
+    job_app_score = models.FloatField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = SiaeSearchIndexManager()
+
+    class Meta:
+        verbose_name = "Index de recherche des entreprises"
+        verbose_name_plural = "Index de recherche des entreprises"
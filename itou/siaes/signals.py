@@ -0,0 +1,65 @@
+"""
+Keep `SiaeSearchIndex` up to date.
+
+The search index of a siae is computed again once the transaction modifying the siae is committed: the siae
+may be about to be deleted by the very same transaction (e.g. memberships are deleted before their siae).
+Changes made without signals (`QuerySet.update()`, raw SQL...) are caught up by the periodic
+`refresh_siae_search_index` command.
+"""
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from itou.job_applications.models import JobApplication
+from itou.siaes.models import Siae, SiaeConvention, SiaeJobDescription, SiaeMembership, SiaeSearchIndex
+
+
+def refresh_search_index_on_commit(siae_ids):
+    transaction.on_commit(partial(SiaeSearchIndex.objects.refresh, siae_ids=siae_ids))
+
+
+@receiver(post_save, sender=Siae)
+def refresh_siae_search_index(sender, instance, raw=False, **kwargs):
+    if raw:
+        # Loading fixtures.
+        return
+    refresh_search_index_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=SiaeMembership)
+@receiver(post_delete, sender=SiaeMembership)
+@receiver(post_save, sender=SiaeJobDescription)
+@receiver(post_delete, sender=SiaeJobDescription)
+def refresh_related_siae_search_index(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    refresh_search_index_on_commit([instance.siae_id])
+
+
+@receiver(m2m_changed, sender=Siae.jobs.through)
+def refresh_jobs_siae_search_index(sender, instance, action, reverse, pk_set, **kwargs):
+    # Job descriptions added with `siae.jobs.add()` are bulk created without `post_save` signals.
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if reverse:
+        # E.g. `appellation.siae_set.add()`: a `post_clear` does not provide the pks of the siaes.
+        refresh_search_index_on_commit(None if action == "post_clear" else list(pk_set))
+    else:
+        refresh_search_index_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=JobApplication)
+def refresh_receiving_siae_search_index(sender, instance, created, raw=False, **kwargs):
+    # The score only depends on the number of received job applications, not on their state.
+    if raw or not created:
+        return
+    refresh_search_index_on_commit([instance.to_siae_id])
+
+
+@receiver(post_save, sender=SiaeConvention)
+def refresh_convention_siaes_search_index(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    refresh_search_index_on_commit(list(instance.siaes.values_list("pk", flat=True)))
@@ -1,9 +1,14 @@
+import gzip
+import json
+import os
+import tempfile
 from datetime import timedelta
 from unittest import mock
 
+import pandas as pd
 from django.conf import settings
 from django.core import mail
-from django.test import RequestFactory, TestCase
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
 from django.utils import timezone
 
 from itou.job_applications.factories import JobApplicationFactory
@@ -11,6 +16,7 @@ from itou.job_applications.models import JobApplicationWorkflow
 from itou.siaes.factories import (
     SiaeAfterGracePeriodFactory,
     SiaeFactory,
+    SiaeMembershipFactory,
     SiaePendingGracePeriodFactory,
     SiaeWith2MembershipsFactory,
     SiaeWith4MembershipsFactory,
@@ -18,7 +24,13 @@ from itou.siaes.factories import (
     SiaeWithMembershipAndJobsFactory,
     SiaeWithMembershipFactory,
 )
-from itou.siaes.models import Siae, SiaeJobDescription
+from itou.siaes.management.commands._import_siae.utils import (
+    could_siae_be_deleted,
+    get_fluxiae_df_chunks,
+    sync_structures,
+)
+from itou.siaes.management.commands.import_geiq import build_geiq
+from itou.siaes.models import Siae, SiaeJobDescription, SiaeSearchIndex
 
 
 class SiaeFactoriesTest(TestCase):
@@ -344,3 +356,191 @@ class SiaeJobDescriptionQuerySetTest(TestCase):
         siae_job_description = SiaeJobDescription.objects.with_job_applications_count().get(pk=job_description.pk)
         self.assertTrue(hasattr(siae_job_description, "job_applications_count"))
         self.assertEqual(siae_job_description.job_applications_count, 1)
+
+
+class SiaeSearchIndexTest(TestCase):
+    def test_refresh(self):
+        siae = SiaeWithMembershipAndJobsFactory()
+        JobApplicationFactory(to_siae=siae)
+        inactive_siae = SiaeAfterGracePeriodFactory()
+
+        self.assertEqual(SiaeSearchIndex.objects.refresh(), Siae.objects.count())
+
+        search_index = SiaeSearchIndex.objects.get(siae=siae)
+        self.assertTrue(search_index.is_active)
+        self.assertTrue(search_index.has_active_members)
+        self.assertEqual(search_index.coords, siae.coords)
+        self.assertEqual(search_index.count_recent_received_job_apps, 1)
+        self.assertEqual(search_index.count_active_job_descriptions, 4)
+        self.assertEqual(search_index.job_app_score, 0.25)
+
+        search_index = SiaeSearchIndex.objects.get(siae=inactive_siae)
+        self.assertFalse(search_index.is_active)
+        self.assertFalse(search_index.has_active_members)
+        self.assertIsNone(search_index.job_app_score)
+
+    def test_refresh_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            siae = SiaeFactory()
+        self.assertFalse(SiaeSearchIndex.objects.get(siae=siae).has_active_members)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            membership = SiaeMembershipFactory(siae=siae)
+        self.assertTrue(SiaeSearchIndex.objects.get(siae=siae).has_active_members)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            membership.delete()
+        self.assertFalse(SiaeSearchIndex.objects.get(siae=siae).has_active_members)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            siae.delete()
+        self.assertFalse(SiaeSearchIndex.objects.exists())
+
+
+class FluxIAEChunksTest(SimpleTestCase):
+    def assertChunksEqual(self, df_chunks):
+        # A memory budget smaller than a row means a row per chunk.
+        self.assertEqual(len(df_chunks), 6)
+        for df in df_chunks:
+            # Sensitive columns are dropped.
+            self.assertEqual(df.columns.tolist(), ["salarie_id", "salarie_nb_heures"])
+            # Types are the same in every chunk, even though only the last one has an empty value.
+            self.assertEqual(df.dtypes["salarie_id"], "int64")
+            self.assertEqual(df.dtypes["salarie_nb_heures"], "float64")
+
+    def test_get_fluxiae_df_chunks(self):
+        rows = ["DEB|fluxIAE_Salarie", "salarie_id|salarie_nb_heures|salarie_courriel"]
+        rows += [f"{i}|{i}|salarie{i}@example.com" for i in range(5)]
+        # Empty value in the last chunk only.
+        rows += ["5||salarie5@example.com", "FIN|8"]
+        with tempfile.TemporaryDirectory() as path:
+            filename = os.path.join(path, "fluxIAE_Salarie_14122020_075350.csv.gz")
+            with gzip.open(filename, "wt") as f:
+                f.write("\n".join(rows))
+
+            get_filename_path = "itou.siaes.management.commands._import_siae.utils.get_filename"
+            with mock.patch(get_filename_path, return_value=filename):
+                df_chunks = get_fluxiae_df_chunks(vue_name="fluxIAE_Salarie", memory_budget=1, sample_chunksize=2)
+                self.assertChunksEqual(list(df_chunks))
+
+                # The second read comes from the cache.
+                with mock.patch("itou.siaes.management.commands._import_siae.utils.read_fluxiae_csv") as read_csv:
+                    df_chunks = get_fluxiae_df_chunks(vue_name="fluxIAE_Salarie", memory_budget=1, sample_chunksize=2)
+                    self.assertChunksEqual(list(df_chunks))
+                    read_csv.assert_not_called()
+
+
+class SyncStructuresTest(TestCase):
+    def setUp(self):
+        export_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(export_dir.cleanup)
+        override = override_settings(EXPORT_DIR=export_dir.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.export_dir = export_dir.name
+
+        geocoding_path = "itou.siaes.management.commands._import_siae.utils.get_geocoding_data_many"
+        patcher = mock.patch(geocoding_path, side_effect=lambda addresses: dict.fromkeys(addresses))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_df(self, sirets):
+        rows = [
+            {
+                "siret": siret,
+                "name": f"GEIQ {siret}",
+                "auth_email": f"{siret}@example.com",
+                "address_line_1": "1 rue de la Paix",
+                "address_line_2": "",
+                "post_code": "75002",
+                "city": "Paris",
+                "department": "75",
+            }
+            for siret in sirets
+        ]
+        return pd.DataFrame(rows)
+
+    def sync(self, df, dry_run=False):
+        return sync_structures(
+            df=df, source=Siae.SOURCE_GEIQ, kinds=[Siae.KIND_GEIQ], build_structure=build_geiq, dry_run=dry_run
+        )
+
+    def test_could_siae_be_deleted(self):
+        siae = SiaeFactory()
+        SiaeWithMembershipFactory(convention=siae.convention)
+        siaes = list(Siae.objects.with_deletability_flags().order_by("pk"))
+        with self.assertNumQueries(0):
+            # The convention of the ASP siae has an antenna.
+            self.assertFalse(could_siae_be_deleted(siaes[0]))
+            # The antenna has a member.
+            self.assertFalse(could_siae_be_deleted(siaes[1]))
+
+        siaes[1].delete()
+        self.assertTrue(could_siae_be_deleted(siae))
+
+    def test_sync_structures(self):
+        kwargs = {"kind": Siae.KIND_GEIQ, "convention": None}
+        converted = SiaeFactory(siret="10000000000001", source=Siae.SOURCE_USER_CREATED, department="59", **kwargs)
+        unchanged = SiaeFactory(siret="10000000000002", source=Siae.SOURCE_GEIQ, **kwargs)
+        deleted = SiaeFactory(siret="10000000000003", source=Siae.SOURCE_GEIQ, department="13", **kwargs)
+        undeletable = SiaeWithMembershipFactory(siret="10000000000004", source=Siae.SOURCE_GEIQ, **kwargs)
+        # Antennas of employers are kept.
+        SiaeWithMembershipFactory(siret="10000000000005", source=Siae.SOURCE_USER_CREATED, **kwargs)
+        # Siaes recently created by our staff are kept.
+        SiaeFactory(siret="10000000000006", source=Siae.SOURCE_STAFF_CREATED, **kwargs)
+        df = self.get_df(["10000000000001", "10000000000002", "10000000000007"])
+
+        report = self.sync(df, dry_run=True)
+        self.assertEqual(Siae.objects.count(), 6)
+        self.assertEqual([created["siae_id"] for created in report["created"]], [None])
+
+        bump_path = "itou.api.siae_api.signals.bump_department_version"
+        with mock.patch(bump_path) as bump_mock, self.captureOnCommitCallbacks(execute=True):
+            report = self.sync(df)
+        # Created, converted and deleted siaes show up in the siaes API right away.
+        self.assertEqual({call.args[0] for call in bump_mock.call_args_list}, {"75", "59", "13"})
+        created = Siae.objects.get(siret="10000000000007")
+        self.assertEqual(created.source, Siae.SOURCE_GEIQ)
+        self.assertTrue(SiaeSearchIndex.objects.filter(siae=created).exists())
+        converted.refresh_from_db()
+        self.assertEqual(converted.source, Siae.SOURCE_GEIQ)
+        self.assertFalse(Siae.objects.filter(pk=deleted.pk).exists())
+        self.assertEqual(Siae.objects.filter(pk__in=[unchanged.pk, undeletable.pk]).count(), 2)
+        self.assertEqual(
+            report,
+            {
+                "source": Siae.SOURCE_GEIQ,
+                "dry_run": False,
+                "created": [
+                    {"siae_id": created.pk, "siret": created.siret, "kind": Siae.KIND_GEIQ, "name": created.name}
+                ],
+                "converted": [
+                    {
+                        "siae_id": converted.pk,
+                        "siret": converted.siret,
+                        "kind": Siae.KIND_GEIQ,
+                        "previous_source": Siae.SOURCE_USER_CREATED,
+                    }
+                ],
+                "deleted": [{"siae_id": deleted.pk, "siret": deleted.siret, "kind": Siae.KIND_GEIQ}],
+                "undeletable": [
+                    {
+                        "siae_id": undeletable.pk,
+                        "siret": undeletable.siret,
+                        "kind": Siae.KIND_GEIQ,
+                        "source": Siae.SOURCE_GEIQ,
+                    }
+                ],
+            },
+        )
+
+        # Reports are written for dry runs as well.
+        reports = sorted(os.listdir(self.export_dir))
+        self.assertEqual(len(reports), 2)
+        [path] = [name for name in reports if "dry_run" not in name]
+        with open(os.path.join(self.export_dir, path)) as f:
+            self.assertEqual(json.load(f), report)
+
+        # Nothing left to do.
+        report = self.sync(df)
+        self.assertEqual(report["created"] + report["converted"] + report["deleted"], [])
@@ -4,12 +4,16 @@ import logging
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.db.models import Case, F, Value, When
 from django.urls import reverse
 from tqdm import tqdm
 
+from itou.approvals.models import Approval
+from itou.eligibility.models import EligibilityDiagnosis
 from itou.job_applications.models import JobApplication
 from itou.users.models import User
+from itou.utils.iterators import chunks
 
 
 class Command(BaseCommand):
@@ -38,10 +42,17 @@ class Command(BaseCommand):
 
     To merge duplicates job seekers in the database:
         django-admin deduplicate_job_seekers
+
+    Duplicates are found by the database, and easy duplicates are merged by
+    chunks of groups, each chunk in its own short transaction: the command
+    can run while the site is in use.
     """
 
     help = "Deduplicate job seekers."
 
+    # Number of groups of duplicates merged in a transaction.
+    CHUNK_SIZE = 100
+
     EASY_DUPLICATES_LOGS = []
     HARD_DUPLICATES_LOGS = []
     NIR_DUPLICATES_LOGS = []
@@ -68,53 +79,90 @@ class Command(BaseCommand):
         if verbosity >= 1:
             self.logger.setLevel(logging.DEBUG)
 
-    def handle_easy_duplicates(self, duplicates, target, nirs):
+    def handle_easy_duplicates(self, groups):
         """
         Easy duplicates: there is 0 or 1 PASS IAE in the duplicates group.
 
-        We can merge duplicates.
+        We can merge duplicates: job applications and eligibility diagnoses
+        of a chunk of groups are reassigned to their target with one query each.
         """
-        assert target.email
-
-        users_to_delete = [u for u in duplicates if u != target]
-
-        target_admin_path = reverse("admin:users_user_change", args=[target.pk])
-        target_admin_url = f"{settings.ITOU_PROTOCOL}://{settings.ITOU_FQDN}{target_admin_path}"
-        self.EASY_DUPLICATES_LOGS.append(
-            {
-                "Compte de destination": target.email,
-                "URL admin du compte de destination": target_admin_url,
-                "Nombre de doublons": len(users_to_delete),
-                "Doublons fusionnés": " ; ".join([u.email for u in users_to_delete]),
-            }
-        )
-
-        # Debug info (when verbosity >= 1).
-        self.logger.debug(f"[easy] {self.EASY_DUPLICATES_LOGS[-1].values()}")
+        with transaction.atomic():
+            user_ids = [user_id for _, group_user_ids, _ in groups for user_id in group_user_ids]
+            locked_users = User.objects.select_for_update().filter(pk__in=user_ids)
+            users = {pk: (email, nir) for pk, email, nir in locked_users.values_list("pk", "email", "nir")}
+            # A PASS IAE may have been issued since duplicates were found.
+            users_with_approval = set(
+                Approval.objects.filter(user_id__in=user_ids).values_list("user_id", flat=True).distinct()
+            )
 
-        for user in users_to_delete:
+            target_by_user_id = {}
+            nirs_to_reassign = {}
+            for pe_id, group_user_ids, target_id in groups:
+                users_to_delete = [user_id for user_id in group_user_ids if user_id != target_id]
 
-            assert user.approvals.count() == 0
+                is_deleted = any(user_id not in users for user_id in group_user_ids)
+                has_new_approval = any(user_id in users_with_approval for user_id in users_to_delete)
+                if is_deleted or has_new_approval:
+                    self.logger.debug(f"[skipped] {pe_id} changed since duplicates were found.")
+                    continue
 
-            if not self.dry_run:
-                user.job_applications.update(
-                    job_seeker=target,
-                    sender=Case(
-                        When(sender_kind=JobApplication.SENDER_KIND_JOB_SEEKER, then=Value(target.pk)),
-                        default=F("sender"),
-                        output_field=JobApplication._meta.get_field("sender"),
-                    ),
+                self.EASY_DUPLICATES_COUNT += 1
+                target_email = users[target_id][0]
+                assert target_email
+
+                target_admin_path = reverse("admin:users_user_change", args=[target_id])
+                target_admin_url = f"{settings.ITOU_PROTOCOL}://{settings.ITOU_FQDN}{target_admin_path}"
+                self.EASY_DUPLICATES_LOGS.append(
+                    {
+                        "Compte de destination": target_email,
+                        "URL admin du compte de destination": target_admin_url,
+                        "Nombre de doublons": len(users_to_delete),
+                        "Doublons fusionnés": " ; ".join([users[user_id][0] for user_id in users_to_delete]),
+                    }
                 )
-                user.eligibility_diagnoses.update(job_seeker=target)
-                user.delete()
 
-        # If only one NIR exists for all the duplicates, it is reassigned to
-        # the target account. This must be executed at the end because of the
-        # uniqueness constraint.
-        if len(nirs) == 1 and not target.nir:
-            target.nir = nirs[0]
-            if not self.dry_run:
-                target.save()
+                # Debug info (when verbosity >= 1).
+                self.logger.debug(f"[easy] {self.EASY_DUPLICATES_LOGS[-1].values()}")
+
+                for user_id in users_to_delete:
+                    target_by_user_id[user_id] = target_id
+
+                # If only one NIR exists for all the duplicates, it is reassigned to
+                # the target account.
+                nirs = [users[user_id][1] for user_id in group_user_ids if users[user_id][1]]
+                if len(nirs) == 1 and not users[target_id][1]:
+                    nirs_to_reassign[target_id] = nirs[0]
+
+            if self.dry_run or not target_by_user_id:
+                return
+
+            job_seeker_whens = [
+                When(job_seeker_id=user_id, then=Value(target_id)) for user_id, target_id in target_by_user_id.items()
+            ]
+
+            JobApplication.objects.filter(job_seeker_id__in=target_by_user_id).update(
+                job_seeker=Case(*job_seeker_whens, output_field=JobApplication._meta.get_field("job_seeker")),
+                sender=Case(
+                    *[
+                        When(
+                            sender_kind=JobApplication.SENDER_KIND_JOB_SEEKER,
+                            job_seeker_id=user_id,
+                            then=Value(target_id),
+                        )
+                        for user_id, target_id in target_by_user_id.items()
+                    ],
+                    default=F("sender"),
+                    output_field=JobApplication._meta.get_field("sender"),
+                ),
+            )
+            EligibilityDiagnosis.objects.filter(job_seeker_id__in=target_by_user_id).update(
+                job_seeker=Case(*job_seeker_whens, output_field=EligibilityDiagnosis._meta.get_field("job_seeker"))
+            )
+            User.objects.filter(pk__in=target_by_user_id).delete()
+
+            # This must be executed at the end because of the uniqueness constraint.
+            for target_id, nir in nirs_to_reassign.items():
+                User.objects.filter(pk=target_id).update(nir=nir)
 
     def handle_hard_duplicates(self, duplicates):
         """
@@ -184,20 +232,23 @@ class Command(BaseCommand):
 
         self.stdout.write("Starting. Good luck…")
 
-        duplicates_dict = User.objects.get_duplicates_by_pole_emploi_id(
-            prefetch_related_lookups=["approvals", "eligibility_diagnoses"]
-        )
+        duplicate_groups = User.objects.get_duplicate_groups()
 
-        pbar = tqdm(total=len(duplicates_dict.items()))
+        pbar = tqdm(total=len(duplicate_groups))
 
-        for pe_id, duplicates in duplicates_dict.items():
+        easy_groups = []
 
-            pbar.update(1)
+        for pe_id, user_ids, target_id in duplicate_groups:
 
-            users_with_approval = [u for u in duplicates if u.approvals.exists()]
+            # Easy cases.
+            # None or 1 PASS IAE was issued for the same person with multiple accounts.
+            if target_id:
+                easy_groups.append((pe_id, user_ids, target_id))
+                continue
 
-            # Ensure all users have the same birthdate.
-            assert all(user.birthdate == duplicates[0].birthdate for user in duplicates)
+            pbar.update(1)
+
+            duplicates = User.objects.filter(pk__in=user_ids).order_by("pk").prefetch_related("approvals")
 
             nirs = [u.nir for u in duplicates if u.nir]
             if len(nirs) > 1:
@@ -205,35 +256,16 @@ class Command(BaseCommand):
                 self.handle_nir_duplicates(duplicates)
                 continue
 
-            # Easy cases.
-            # None or 1 PASS IAE was issued for the same person with multiple accounts.
-            if len(users_with_approval) <= 1:
-
-                self.EASY_DUPLICATES_COUNT += 1
-                target = None
-
-                # Give priority to the user with a PASS IAE.
-                user_with_approval = next((u for u in duplicates if u.approvals.exists()), None)
-                if user_with_approval:
-                    target = user_with_approval
-
-                # Handle duplicates without any PASS IAE.
-                else:
-                    # Give priority to the first user who already logged in…
-                    first_autonomous_user = next((u for u in duplicates if u.last_login), None)
-                    if first_autonomous_user:
-                        target = first_autonomous_user
-                    # …or choose an arbitrary user to merge others into.
-                    else:
-                        target = duplicates[0]
-
-                self.handle_easy_duplicates(duplicates, target=target, nirs=nirs)
-
             # Hard cases.
             # More than one PASS IAE was issued for the same person.
-            elif len(users_with_approval) > 1:
-                self.HARD_DUPLICATES_COUNT += 1
-                self.handle_hard_duplicates(duplicates)
+            self.HARD_DUPLICATES_COUNT += 1
+            self.handle_hard_duplicates(duplicates)
+
+        for groups in chunks(easy_groups, self.CHUNK_SIZE):
+            self.handle_easy_duplicates(groups)
+            pbar.update(len(groups))
+
+        pbar.close()
 
         if not self.no_csv:
             self.to_csv(
@@ -17,6 +17,7 @@ from django.db.models import F, Q
 from tqdm import tqdm
 
 from itou.approvals.models import Approval
+from itou.asp.cache import referentials
 from itou.asp.models import Commune
 from itou.common_apps.address.departments import department_from_postcode
 from itou.job_applications.models import JobApplication, JobApplicationWorkflow
@@ -244,17 +245,10 @@ class Command(BaseCommand):
         return not_existing_structures
 
     def commune_from_insee_col(self, insee_code):
-        try:
-            commune = Commune.objects.current().get(code=insee_code)
-        except Commune.DoesNotExist:
-            # Communes stores the history of city names and INSEE codes.
-            # Sometimes, a commune is found twice but with the same name.
-            # As we just need a human name, we can take the first one.
-            commune = Commune.objects.filter(code=insee_code).first()
-        except Commune.MultipleObjectsReturned:
-            commune = Commune.objects.current().filter(code=insee_code).first()
-        else:
-            commune = Commune.objects.current().get(code=insee_code)
+        # Communes stores the history of city names and INSEE codes.
+        # Sometimes, a commune is found twice but with the same name.
+        # As we just need a human name, we can take the first one.
+        commune = referentials.get_any_commune(insee_code)
 
         if insee_code == "01440":
             # Veyziat has been merged with Oyonnax.
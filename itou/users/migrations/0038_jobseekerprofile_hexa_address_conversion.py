@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0037_rename_provider_json_user_external_data_source_history"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="jobseekerprofile",
+            name="hexa_address_source",
+            field=models.TextField(blank=True, default="", verbose_name="Adresse convertie au format HEXA"),
+        ),
+        migrations.AddField(
+            model_name="jobseekerprofile",
+            name="hexa_address_converted_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="Date de la dernière conversion au format HEXA"
+            ),
+        ),
+        migrations.AddField(
+            model_name="jobseekerprofile",
+            name="hexa_address_conversion_error",
+            field=models.CharField(
+                blank=True, default="", max_length=255, verbose_name="Erreur de conversion au format HEXA"
+            ),
+        ),
+    ]
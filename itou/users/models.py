@@ -1,5 +1,4 @@
 import uuid
-from collections import Counter
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser, UserManager
@@ -7,14 +6,15 @@ from django.contrib.postgres.fields import CIEmailField
 from django.core.exceptions import PermissionDenied, ValidationError
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinLengthValidator
-from django.db import models
+from django.db import connection, models
 from django.db.models import Count
 from django.utils import timezone
 from django.utils.crypto import salted_hmac
 from django.utils.functional import cached_property
 from django.utils.safestring import mark_safe
 
-from itou.approvals.models import ApprovalsWrapper
+from itou.approvals.models import Approval, ApprovalsWrapper
+from itou.asp.cache import referentials
 from itou.asp.models import (
     AllocationDuration,
     Commune,
@@ -65,59 +65,87 @@ class ItouUserManager(UserManager):
             .values_list("pole_emploi_id", flat=True)
         )
 
+    def get_duplicate_groups(self):
+        """
+        Find job seekers with the same `pole_emploi_id` and `birthdate`
+        and returns a list of `(pole_emploi_id, user_ids, target_id)` tuples:
+
+            [
+                ('5589555S', [1, 2], 2),
+                ('7744222A', [5, 8, 9], None),
+                ...
+            ]
+
+        Two users with the same `pole_emploi_id` but a different `birthdate`
+        are not guaranteed to be duplicates: only users with the most common
+        `birthdate` of a `pole_emploi_id` are kept, and only if there are
+        several of them.
+
+        `target_id` is the user into which the others can be merged, i.e.
+        the user with a PASS IAE if any, or else the first one who already
+        logged in, or else the first one. It is `None` when the group can't
+        be merged (several PASS IAE or several NIR).
+
+        Grouping is done by the database with window functions so that users
+        are never loaded in memory.
+
+        Used in the `deduplicate_job_seekers` management command.
+        Implemented as a manager method to make unit testing easier.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH candidates AS (
+                    SELECT
+                        u.id, u.pole_emploi_id, u.birthdate, u.nir, u.last_login,
+                        EXISTS (SELECT 1 FROM {Approval._meta.db_table} a WHERE a.user_id = u.id) AS has_approval,
+                        COUNT(*) OVER (PARTITION BY u.pole_emploi_id, u.birthdate) AS birthdate_count,
+                        MIN(u.id) OVER (PARTITION BY u.pole_emploi_id, u.birthdate) AS birthdate_first_id
+                    FROM {self.model._meta.db_table} u
+                    WHERE u.is_job_seeker
+                    -- Skip empty `pole_emploi_id` and cases where `00000000` was used.
+                    AND u.pole_emploi_id NOT IN ('', '00000000')
+                ),
+                majority AS (
+                    SELECT
+                        *,
+                        FIRST_VALUE(birthdate) OVER (
+                            PARTITION BY pole_emploi_id ORDER BY birthdate_count DESC, birthdate_first_id
+                        ) AS majority_birthdate
+                    FROM candidates
+                )
+                SELECT
+                    pole_emploi_id,
+                    ARRAY_AGG(id ORDER BY id),
+                    CASE
+                        WHEN COUNT(*) FILTER (WHERE has_approval) <= 1 AND COUNT(nir) FILTER (WHERE nir <> '') <= 1
+                        THEN (ARRAY_AGG(id ORDER BY has_approval DESC, last_login IS NULL, id))[1]
+                    END
+                FROM majority
+                WHERE birthdate IS NOT DISTINCT FROM majority_birthdate
+                GROUP BY pole_emploi_id
+                HAVING COUNT(*) > 1
+                ORDER BY pole_emploi_id
+                """
+            )
+            return [tuple(row) for row in cursor.fetchall()]
+
     def get_duplicates_by_pole_emploi_id(self, prefetch_related_lookups=None):
         """
-        Find duplicates with the same `pole_emploi_id` and `birthdate`
-        and returns a dict:
+        Same as `get_duplicate_groups` but returns a dict of users:
 
             {
                 '5589555S': [<User: a>, <User: b>],
                 '7744222A': [<User: x>, <User: y>, <User: z>],
                 ...
             }
-
-        Used in the `deduplicate_job_seekers` management command.
-        Implemented as a manager method to make unit testing easier.
         """
-        users = self.filter(pole_emploi_id__in=self.get_duplicated_pole_emploi_ids())
+        groups = self.get_duplicate_groups()
+        users = self.filter(pk__in=[user_id for _, user_ids, _ in groups for user_id in user_ids])
         if prefetch_related_lookups:
             users = users.prefetch_related(*prefetch_related_lookups)
-
-        result = dict()
-        for user in users:
-            result.setdefault(user.pole_emploi_id, []).append(user)
-
-        pe_id_to_remove = []
-
-        for pe_id, duplicates in result.items():
-
-            same_birthdate = all(user.birthdate == duplicates[0].birthdate for user in duplicates)
-
-            if not same_birthdate:
-
-                # Two users with the same `pole_emploi_id` but a different
-                # `birthdate` are not guaranteed to be duplicates.
-                if len(duplicates) == 2:
-                    pe_id_to_remove.append(pe_id)
-                    continue
-
-                # Keep only users with the same most common birthdate.
-                list_of_birthdates = [u.birthdate for u in duplicates]
-                c = Counter(list_of_birthdates)
-                most_common_birthdate = c.most_common(1)[0][0]
-
-                duplicates_with_same_birthdate = [u for u in duplicates if u.birthdate == most_common_birthdate]
-
-                if len(duplicates_with_same_birthdate) == 1:
-                    # We stop if there is only one user left.
-                    pe_id_to_remove.append(pe_id)
-                else:
-                    result[pe_id] = duplicates_with_same_birthdate
-
-        for pe_id in pe_id_to_remove:
-            del result[pe_id]
-
-        return result
+        users_by_pk = {user.pk: user for user in users}
+        return {pe_id: [users_by_pk[user_id] for user_id in user_ids] for pe_id, user_ids, _ in groups}
 
 
 class User(AbstractUser, AddressMixin):
@@ -813,6 +841,16 @@ class JobSeekerProfile(models.Model):
         on_delete=models.SET_NULL,
     )
 
+    # HEXA addresses are converted ahead of time by huey workers, see `itou.employee_record.tasks`.
+    # The address on one line may be longer than any of its parts.
+    hexa_address_source = models.TextField(verbose_name="Adresse convertie au format HEXA", blank=True, default="")
+    hexa_address_converted_at = models.DateTimeField(
+        verbose_name="Date de la dernière conversion au format HEXA", null=True, blank=True
+    )
+    hexa_address_conversion_error = models.CharField(
+        max_length=255, verbose_name="Erreur de conversion au format HEXA", blank=True, default=""
+    )
+
     class Meta:
         verbose_name = "Profil demandeur d'emploi"
         verbose_name_plural = "Profils demandeur d'emploi"
@@ -890,20 +928,28 @@ class JobSeekerProfile(models.Model):
         self._clean_job_seeker_situation()
         self._clean_job_seeker_hexa_address()
 
-    def update_hexa_address(self):
+    def update_hexa_address(self, save=True):
         """
         This method tries to fill the HEXA address fields
         based the current address of the job seeker (User model).
 
         Conversion from standard itou address to HEXA is making sync
-        geo API calls.
+        geo API calls: web requests should rely on the addresses converted
+        by huey workers instead (see `itou.employee_record.tasks`).
+
+        The outcome of the conversion is recorded whether it succeeds or not.
+        `save` parameter is for bulk updates.
 
         Returns current object or re-raise error,
         thus calling this method should be done in a try/except block
         """
+        self.hexa_address_source = self.user.address_on_one_line or ""
+        self.hexa_address_converted_at = timezone.now()
+
         result, error = format_address(self.user)
 
         if error:
+            self.hexa_address_conversion_error = error
             raise ValidationError(error)
 
         # Fill matching fields
@@ -917,19 +963,23 @@ class JobSeekerProfile(models.Model):
 
         # Special field: Commune object contains both city name and INSEE code
         insee_code = result.get("insee_code")
-        self.hexa_commune = Commune.objects.by_insee_code(insee_code).first()
+        self.hexa_commune = referentials.get_first_commune(insee_code)
 
         if not self.hexa_commune:
+            self.hexa_address_conversion_error = self.ERROR_HEXA_LOOKUP_COMMUNE
             raise ValidationError(self.ERROR_HEXA_LOOKUP_COMMUNE)
 
-        self.save()
+        self.hexa_address_conversion_error = ""
+
+        if save:
+            self.save()
 
         return self
 
-    def clear_hexa_address(self):
+    def clear_hexa_address(self, save=True):
         """
         Delete hexa address fields.
-        This method updates the profile in db.
+        This method updates the profile in db unless `save` is False.
         """
         self.hexa_lane_type = ""
         self.hexa_lane_number = ""
@@ -940,8 +990,29 @@ class JobSeekerProfile(models.Model):
         self.hexa_post_code = ""
         self.hexa_commune = None
 
+        if save:
+            self.save()
+
+    def set_hexa_address_entered_by_hand(self):
+        """
+        An HEXA address entered by hand replaces the conversion of the current address of the job seeker:
+        it must not be converted again until the job seeker moves.
+        """
+        self.hexa_address_source = self.user.address_on_one_line or ""
+        self.hexa_address_converted_at = timezone.now()
+        self.hexa_address_conversion_error = ""
         self.save()
 
+    @property
+    def hexa_address_is_up_to_date(self):
+        """
+        True when the current address of the job seeker has already been converted,
+        whether the conversion succeeded or not.
+        """
+        if self.hexa_address_converted_at is None:
+            return False
+        return self.hexa_address_source == (self.user.address_on_one_line or "")
+
     @property
     def is_employed(self):
         # `previous_employer_kind` field is not needed for ASP processing
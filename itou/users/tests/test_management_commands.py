@@ -1,5 +1,6 @@
 import datetime
 from dataclasses import dataclass
+from unittest import mock
 
 import pandas
 from dateutil.relativedelta import relativedelta
@@ -22,6 +23,7 @@ from itou.job_applications.models import JobApplication, JobApplicationWorkflow
 from itou.siaes.factories import SiaeFactory, SiaeWithMembershipFactory
 from itou.siaes.models import Siae
 from itou.users.factories import JobSeekerFactory, PrescriberFactory, UserFactory
+from itou.users.management.commands.deduplicate_job_seekers import Command as DeduplicateJobSeekersCommand
 from itou.users.management.commands.import_ai_employees import (
     APPROVAL_COL,
     BIRTHDATE_COL,
@@ -178,6 +180,35 @@ class DeduplicateJobSeekersManagementCommandsTest(TestCase):
         self.assertEqual(0, EligibilityDiagnosis.objects.filter(job_seeker=user2).count())
         self.assertEqual(0, EligibilityDiagnosis.objects.filter(job_seeker=user3).count())
 
+    def test_deduplicate_job_seekers_by_chunks(self):
+        """
+        Several groups of duplicates merged in several transactions.
+        """
+        targets = []
+        duplicates = []
+        for pe_id in ["6666666B", "7777777C", "8888888D"]:
+            kwargs = {"job_seeker__pole_emploi_id": pe_id, "job_seeker__birthdate": datetime.date(2002, 12, 12)}
+            targets.append(JobApplicationWithApprovalFactory(job_seeker__nir=None, **kwargs).job_seeker)
+            duplicates.append(JobApplicationWithEligibilityDiagnosis(job_seeker__nir=None, **kwargs).job_seeker)
+
+        with mock.patch.object(DeduplicateJobSeekersCommand, "CHUNK_SIZE", 2):
+            call_command("deduplicate_job_seekers", verbosity=0, no_csv=True)
+
+        for target in targets:
+            self.assertEqual(2, target.job_applications.count())
+            self.assertEqual(2, target.eligibility_diagnoses.count())
+        self.assertFalse(User.objects.filter(pk__in=[duplicate.pk for duplicate in duplicates]).exists())
+
+    def test_deduplicate_job_seekers_dry_run(self):
+        kwargs = {"job_seeker__pole_emploi_id": "6666666B", "job_seeker__birthdate": datetime.date(2002, 12, 12)}
+        JobApplicationWithApprovalFactory(**kwargs)
+        duplicate = JobApplicationWithEligibilityDiagnosis(**kwargs).job_seeker
+
+        call_command("deduplicate_job_seekers", verbosity=0, no_csv=True, dry_run=True)
+
+        self.assertEqual(1, duplicate.job_applications.count())
+        self.assertTrue(User.objects.filter(pk=duplicate.pk).exists())
+
 
 @dataclass
 class AiCSVFileMock:
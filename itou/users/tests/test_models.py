@@ -7,6 +7,7 @@ from django.test import TestCase
 from django.utils import timezone
 
 import itou.asp.factories as asp
+from itou.approvals.factories import ApprovalFactory
 from itou.asp.models import AllocationDuration, EmployerType
 from itou.institutions.factories import InstitutionWithMembershipFactory
 from itou.institutions.models import Institution
@@ -70,6 +71,40 @@ class ManagerTest(TestCase):
         }
         self.assertCountEqual(duplicated_users, expected_result)
 
+    def test_get_duplicate_groups(self):
+        birthdate = datetime.date(1988, 2, 2)
+
+        # Priority to the first user who already logged in.
+        user1 = JobSeekerFactory(pole_emploi_id="6666666B", birthdate=birthdate, last_login=None)
+        user2 = JobSeekerFactory(pole_emploi_id="6666666B", birthdate=birthdate, last_login=timezone.now())
+
+        # Priority to the user with a PASS IAE.
+        user3 = JobSeekerFactory(pole_emploi_id="7777777B", birthdate=birthdate, last_login=timezone.now())
+        user4 = JobSeekerFactory(pole_emploi_id="7777777B", birthdate=birthdate)
+        ApprovalFactory(user=user4)
+        # + 1 user using the same `pole_emploi_id` but a different birthdate.
+        JobSeekerFactory(pole_emploi_id="7777777B", birthdate=datetime.date(1978, 12, 20))
+
+        # Several PASS IAE: can't be merged.
+        user5 = JobSeekerFactory(pole_emploi_id="8888888C", birthdate=birthdate)
+        user6 = JobSeekerFactory(pole_emploi_id="8888888C", birthdate=birthdate)
+        ApprovalFactory(user=user5)
+        ApprovalFactory(user=user6)
+
+        # Not job seekers.
+        PrescriberFactory(pole_emploi_id="9999999D", birthdate=birthdate)
+        PrescriberFactory(pole_emploi_id="9999999D", birthdate=birthdate)
+
+        with self.assertNumQueries(1):
+            duplicate_groups = User.objects.get_duplicate_groups()
+
+        expected_result = [
+            ("6666666B", [user1.pk, user2.pk], user2.pk),
+            ("7777777B", [user3.pk, user4.pk], user4.pk),
+            ("8888888C", [user5.pk, user6.pk], None),
+        ]
+        self.assertEqual(duplicate_groups, expected_result)
+
 
 class ModelTest(TestCase):
     def test_prescriber_of_authorized_organization(self):
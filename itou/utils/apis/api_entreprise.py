@@ -1,4 +1,6 @@
+import functools
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 
 import httpx
@@ -6,10 +8,22 @@ from django.conf import settings
 from django.utils.http import urlencode
 
 from itou.common_apps.address.departments import department_from_postcode
+from itou.utils.apis.rate_limit import TokenBucket
 
 
 logger = logging.getLogger(__name__)
 
+# Shared by all the calls of a process, e.g. by the threads of `etablissements_get_or_error`.
+rate_limiter = TokenBucket(rate=settings.API_ENTREPRISE_RATE_LIMIT_PER_MINUTE / 60, capacity=10)
+
+
+@functools.cache
+def get_client():
+    """
+    Keep connections alive between calls.
+    """
+    return httpx.Client()
+
 
 @dataclass
 class Etablissement:
@@ -44,7 +58,8 @@ def etablissement_get_or_error(siret, reason="Inscription aux emplois de l'inclu
     headers = {"Authorization": f"Bearer {settings.API_ENTREPRISE_TOKEN}"}
 
     try:
-        r = httpx.get(url, headers=headers)
+        rate_limiter.acquire()
+        r = get_client().get(url, headers=headers)
         r.raise_for_status()
         data = r.json()
     except httpx.HTTPStatusError as e:
@@ -54,6 +69,10 @@ def etablissement_get_or_error(siret, reason="Inscription aux emplois de l'inclu
             logger.error("Error while fetching `%s`: %s", url, e)
             error = "Problème de connexion à la base Sirene. Essayez ultérieurement."
         return None, error
+    except httpx.RequestError as e:
+        logger.error("Error while fetching `%s`: %s", url, e)
+        error = "Problème de connexion à la base Sirene. Essayez ultérieurement."
+        return None, error
 
     if data and data.get("errors"):
         error = data["errors"][0]
@@ -78,3 +97,14 @@ def etablissement_get_or_error(siret, reason="Inscription aux emplois de l'inclu
     )
 
     return etablissement, None
+
+
+def etablissements_get_or_error(sirets, reason="Inscription aux emplois de l'inclusion", max_workers=8):
+    """
+    Concurrent version of `etablissement_get_or_error()`, within the rate limit of API Entreprise.
+
+    Yield a tuple (siret, etablissement, error) for each given SIRET, in the order of `sirets`.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda siret: (siret, *etablissement_get_or_error(siret, reason=reason)), sirets)
+        yield from results
@@ -5,6 +5,7 @@
 import collections
 import datetime
 import logging
+import threading
 
 import httpx
 from django.conf import settings
@@ -14,15 +15,26 @@ logger = logging.getLogger(__name__)
 
 Token = collections.namedtuple("AccessToken", ["expiration", "value"])
 
+# Tokens are shared by all the threads of a process, e.g. huey workers.
 TOKENS_CACHE = {}
+TOKENS_CACHE_LOCK = threading.Lock()
+
+# Tokens are renewed a bit before they expire so that they don't expire during the calls made with them.
+TOKEN_EXPIRATION_MARGIN = datetime.timedelta(seconds=60)
 
 
 def get_access_token(scope):
+    # Threads needing the same token wait for the first one to get it.
+    with TOKENS_CACHE_LOCK:
+        return _get_access_token(scope)
+
+
+def _get_access_token(scope):
 
     if scope in TOKENS_CACHE:
         token = TOKENS_CACHE[scope]
         now = datetime.datetime.now()
-        if now < token.expiration:
+        if now < token.expiration - TOKEN_EXPIRATION_MARGIN:
             logger.debug("Found %s in cache. Expiration = %s, now = %s.", token.value, token.expiration, now)
             return token.value
 
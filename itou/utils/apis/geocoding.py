@@ -1,13 +1,42 @@
+"""
+Geocoding with the BAN API (Base Adresse Nationale).
+
+Results are kept in database (see `GeocodingResult`) for `settings.API_BAN_CACHE_TTL_DAYS`,
+and addresses which could not be geocoded for `settings.API_BAN_CACHE_NEGATIVE_TTL_DAYS`,
+so that imports geocoding the same addresses over and over do not hit the API each time.
+Network and server errors are not cached.
+
+Bulk imports should use `get_geocoding_data_many()` which geocodes missing addresses by batches
+with the CSV endpoint of the API.
+"""
+import csv
+import datetime
+import io
 import logging
+import re
 
 import httpx
 from django.conf import settings
 from django.contrib.gis.geos import GEOSGeometry
+from django.utils import timezone
 from django.utils.http import urlencode
+from unidecode import unidecode
+
+from itou.utils.iterators import chunks
+from itou.utils.models import GeocodingResult
 
 
 logger = logging.getLogger(__name__)
 
+# Addresses sent by request to the CSV endpoint, which accepts files up to 50 MB.
+BATCH_SIZE = 1000
+
+
+class GeocodingError(Exception):
+    """
+    The API could not be reached or returned an error: the result must not be cached.
+    """
+
 
 def call_ban_geocoding_api(address, post_code=None, limit=1):
 
@@ -24,9 +53,10 @@ def call_ban_geocoding_api(address, post_code=None, limit=1):
 
     try:
         r = httpx.get(url)
-    except httpx.RequestError as e:
+        r.raise_for_status()
+    except httpx.HTTPError as e:
         logger.info("Error while fetching `%s`: %s", url, e)
-        return None
+        raise GeocodingError(e) from e
 
     try:
         return r.json()["features"][0]
@@ -35,6 +65,57 @@ def call_ban_geocoding_api(address, post_code=None, limit=1):
         return None
 
 
+def call_ban_geocoding_csv_api(addresses):
+    """
+    Geocode many `(address, post_code)` in a single request.
+
+    Return a list of BAN features (or None when no result was found) in the order of `addresses`.
+    Features only hold the fields used by `process_geocoding_data`.
+    """
+    url = f"{settings.API_BAN_BASE_URL}/search/csv/"
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["q", "postcode"])
+    writer.writerows([address, post_code or ""] for address, post_code in addresses)
+
+    try:
+        r = httpx.post(
+            url,
+            files={"data": ("addresses.csv", buffer.getvalue().encode())},
+            data={"columns": "q", "postcode": "postcode"},
+            timeout=60,
+        )
+        r.raise_for_status()
+    except httpx.HTTPError as e:
+        logger.info("Error while fetching `%s`: %s", url, e)
+        raise GeocodingError(e) from e
+
+    features = []
+    for row in csv.DictReader(io.StringIO(r.text)):
+        if not row.get("result_score"):
+            features.append(None)
+            continue
+        features.append(
+            {
+                "geometry": {"coordinates": [float(row["longitude"]), float(row["latitude"])]},
+                "properties": {
+                    "score": float(row["result_score"]),
+                    "name": row["result_name"],
+                    "housenumber": row["result_housenumber"] or None,
+                    "street": row["result_street"] or None,
+                    "postcode": row["result_postcode"],
+                    "citycode": row["result_citycode"],
+                    "city": row["result_city"],
+                },
+            }
+        )
+
+    if len(features) != len(addresses):
+        raise GeocodingError(f"{len(features)} results received for {len(addresses)} addresses")
+    return features
+
+
 def process_geocoding_data(data):
     """
     Contains parts of an address useful for objects like User
@@ -67,11 +148,92 @@ def process_geocoding_data(data):
     }
 
 
+def normalize(address, post_code=None):
+    """
+    Cache key of an address: case, accents and spacing do not change the result of the API.
+    """
+    address = re.sub(r"\s+", " ", unidecode(address or "")).strip().lower()
+    return address, (post_code or "").strip()
+
+
+def is_fresh(result, now):
+    ttl_days = settings.API_BAN_CACHE_TTL_DAYS if result.data else settings.API_BAN_CACHE_NEGATIVE_TTL_DAYS
+    return result.created_at > now - datetime.timedelta(days=ttl_days)
+
+
+def get_cached_results(keys):
+    """
+    Return the fresh cached results of the given normalized `(address, post_code)`, by key.
+    """
+    now = timezone.now()
+    results = GeocodingResult.objects.filter(address__in={address for address, _ in keys})
+    return {
+        (result.address, result.post_code): result
+        for result in results
+        if (result.address, result.post_code) in keys and is_fresh(result, now)
+    }
+
+
+def cache_results(data_by_key):
+    """
+    Store API results (None when no result was found) by normalized `(address, post_code)`,
+    replacing stale entries.
+    """
+    if not data_by_key:
+        return
+    now = timezone.now()
+    stale_results = GeocodingResult.objects.filter(address__in={address for address, _ in data_by_key})
+    GeocodingResult.objects.filter(
+        pk__in=[result.pk for result in stale_results if (result.address, result.post_code) in data_by_key]
+    ).delete()
+    GeocodingResult.objects.bulk_create(
+        [
+            GeocodingResult(address=address, post_code=post_code, data=data, created_at=now)
+            for (address, post_code), data in data_by_key.items()
+        ],
+        # Geocoded meanwhile by another process.
+        ignore_conflicts=True,
+    )
+
+
 def get_geocoding_data(address, post_code=None, limit=1):
     """
     Return a dict containing info about the given `address` or None if no result found.
     """
+    key = normalize(address, post_code)
+    cached_result = get_cached_results({key}).get(key)
+    if cached_result:
+        return process_geocoding_data(cached_result.data)
 
-    geocoding_data = call_ban_geocoding_api(address, post_code=post_code, limit=limit)
+    try:
+        geocoding_data = call_ban_geocoding_api(address, post_code=post_code, limit=limit)
+    except GeocodingError:
+        return None
+    cache_results({key: geocoding_data})
 
     return process_geocoding_data(geocoding_data)
+
+
+def get_geocoding_data_many(addresses):
+    """
+    Batch version of `get_geocoding_data()`: geocode an iterable of `(address, post_code)`.
+
+    Return a dict mapping each given `(address, post_code)` to a dict containing info about the address
+    or None if no result found (or if the API failed).
+    """
+    keys_by_address = {(address, post_code): normalize(address, post_code) for address, post_code in addresses}
+    keys = set(keys_by_address.values())
+    data_by_key = {key: result.data for key, result in get_cached_results(keys).items()}
+
+    missing_keys = sorted(keys - data_by_key.keys())
+    for missing_keys_chunk in chunks(missing_keys, BATCH_SIZE):
+        try:
+            features = call_ban_geocoding_csv_api(missing_keys_chunk)
+        except GeocodingError:
+            continue
+        new_data_by_key = dict(zip(missing_keys_chunk, features))
+        cache_results(new_data_by_key)
+        data_by_key |= new_data_by_key
+
+    logger.info("Geocoded %d addresses, %d from cache", len(keys), len(keys) - len(missing_keys))
+    return {address: process_geocoding_data(data_by_key.get(key, None)) for address, key in keys_by_address.items()}
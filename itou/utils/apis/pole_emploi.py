@@ -6,10 +6,14 @@ import httpx
 from django.conf import settings
 
 from itou.siaes.models import Siae
+from itou.utils.apis.rate_limit import TokenBucket
 
 
 logger = logging.getLogger(__name__)
 
+# Shared by all the threads of a process. No burst: PE's APIs time out when called too fast.
+rate_limiter = TokenBucket(rate=settings.API_ESD_RATE_LIMIT_PER_SECOND)
+
 # The values for the pass status in the mise à jour API
 POLE_EMPLOI_PASS_APPROVED = "A"
 POLE_EMPLOI_PASS_REFUSED = "R"
@@ -183,6 +187,7 @@ def recherche_individu_certifie_api(individu: PoleEmploiIndividu, token: str) ->
     headers = {"Authorization": token}
 
     try:
+        rate_limiter.acquire()
         r = httpx.post(url, json=individu.as_api_params(), headers=headers)
         data = r.json()
         # we can’t use `raise_for_error` since actual data are stored with status code 4xx
@@ -192,8 +197,9 @@ def recherche_individu_certifie_api(individu: PoleEmploiIndividu, token: str) ->
             # The only thing we care about is http code 200
             raise PoleEmploiMiseAJourPassIAEException(r.status_code, extract_code_sortie(data))
         return PoleEmploiIndividuResult.from_data(data)
-    except httpx.HTTPError as e:
-        raise PoleEmploiMiseAJourPassIAEException(e.response.status_code)
+    except httpx.RequestError as e:
+        # No response at all (timeout, connection error…): there is no HTTP code to store.
+        raise PoleEmploiMiseAJourPassIAEException(None, e.__class__.__name__)
     except ValueError:
         raise PoleEmploiMiseAJourPassIAEException(r.status_code)
     # should not happen, but we never want to miss an exception
@@ -226,6 +232,7 @@ def mise_a_jour_pass_iae(job_application, pass_approved_code, encrypted_identifi
 
     try:
         params = _mise_a_jour_parameters(encrypted_identifier, job_application, pass_approved_code)
+        rate_limiter.acquire()
         r = httpx.post(url, json=params, headers=headers)
         # The status code are 200, 401, 500.
         # Visibly non-200 HTTP codes do not return parsable json but I do not have samples
@@ -248,8 +255,8 @@ def mise_a_jour_pass_iae(job_application, pass_approved_code, encrypted_identifi
             return True
         except Exception:
             raise PoleEmploiMiseAJourPassIAEException(r.status_code, r.content)
-    except httpx.HTTPError as e:
-        raise PoleEmploiMiseAJourPassIAEException(e.response.status_code)
+    except httpx.RequestError as e:
+        raise PoleEmploiMiseAJourPassIAEException(None, e.__class__.__name__)
 
     raise PoleEmploiMiseAJourPassIAEException("undetected failure to update")
 
@@ -1,6 +1,8 @@
 # Iterator bazaar
 # Misc. utils functions related to list processing and iterators
 
+from django.db.models import Q
+
 
 def chunks(lst, n):
     """
@@ -8,3 +10,58 @@ def chunks(lst, n):
     """
     for i in range(0, len(lst), n):
         yield lst[i : i + n]
+
+
+def _keyset_filter(ordering, last_obj):
+    """
+    Build a filter selecting objects located after `last_obj` in the given ordering, e.g. for `("-created_at", "pk")`:
+        created_at < last_obj.created_at OR (created_at = last_obj.created_at AND pk > last_obj.pk)
+    """
+    keyset_filter = Q()
+    previous_fields = {}
+    for field in ordering:
+        name = field.lstrip("-")
+        lookup = "lt" if field.startswith("-") else "gt"
+        value = getattr(last_obj, name)
+        keyset_filter |= Q(**previous_fields, **{f"{name}__{lookup}": value})
+        previous_fields[name] = value
+    return keyset_filter
+
+
+def queryset_chunks(queryset, chunk_size=10000, ordering=("pk",)):
+    """
+    Split a queryset into lists of at most `chunk_size` objects with keyset pagination:
+        WHERE pk > <pk of the last object of the previous chunk> ORDER BY pk LIMIT <chunk_size>
+
+    Unlike LIMIT/OFFSET pagination (e.g. Django's `Paginator`), every chunk costs the same whatever its position,
+    thus iterating over the whole queryset is linear. Each chunk is a regular queryset evaluation,
+    thus `prefetch_related` lookups are honored chunk by chunk.
+
+    `ordering` must be made of model fields never null and end with a unique one.
+    """
+    # `.all()` also accepts managers.
+    queryset = queryset.all().order_by(*ordering)
+    chunk_queryset = queryset
+    while True:
+        chunk = list(chunk_queryset[:chunk_size])
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            return
+        chunk_queryset = queryset.filter(_keyset_filter(ordering, chunk[-1]))
+
+
+def queryset_iterator(queryset, chunk_size=10000, ordering=("pk",)):
+    """
+    Iterate over the objects of a large queryset with a bounded memory use.
+
+    Querysets without `prefetch_related` lookups are streamed through a server-side cursor in a single query.
+    Django ignores `prefetch_related` lookups with server-side cursors, so other querysets are fetched
+    chunk by chunk with `queryset_chunks`.
+    """
+    queryset = queryset.all()
+    if not queryset._prefetch_related_lookups:
+        yield from queryset.order_by(*ordering).iterator(chunk_size=chunk_size)
+        return
+    for chunk in queryset_chunks(queryset, chunk_size=chunk_size, ordering=ordering):
+        yield from chunk
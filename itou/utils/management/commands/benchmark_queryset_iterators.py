@@ -0,0 +1,99 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.paginator import Paginator
+from django.db import transaction
+
+from itou.approvals.models import PoleEmploiApproval
+from itou.utils.iterators import queryset_chunks, queryset_iterator
+
+
+NUMBER_PREFIX = "BENCH"
+
+
+def iterate_with_paginator(queryset, chunk_size):
+    # LIMIT/OFFSET pagination, as previously done by `populate_metabase_itou`.
+    paginator = Paginator(queryset.order_by("pk"), chunk_size)
+    for page_idx in paginator.page_range:
+        yield from paginator.page(page_idx).object_list
+
+
+def iterate_with_keyset(queryset, chunk_size):
+    for chunk in queryset_chunks(queryset, chunk_size=chunk_size):
+        yield from chunk
+
+
+def iterate_with_server_side_cursor(queryset, chunk_size):
+    return queryset_iterator(queryset, chunk_size=chunk_size)
+
+
+ITERATORS = {
+    "paginator": iterate_with_paginator,
+    "keyset": iterate_with_keyset,
+    "server_side_cursor": iterate_with_server_side_cursor,
+}
+
+
+class Command(BaseCommand):
+    """
+    Compare the ways of iterating over a large queryset on a generated dataset.
+
+    Rows are generated in a transaction which is rolled back at the end, nothing is left in the database.
+    Iterating over twice as many rows should take twice as long: the time per row should stay flat
+    for linear iterators, and grow with the dataset size for LIMIT/OFFSET pagination.
+
+    To run the benchmark on 1M rows:
+        django-admin benchmark_queryset_iterators --rows=1000000
+
+    LIMIT/OFFSET pagination is very slow on large datasets, to skip it:
+        django-admin benchmark_queryset_iterators --rows=1000000 --iterators keyset server_side_cursor
+    """
+
+    help = "Benchmark queryset iterators on a generated dataset."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", dest="rows", type=int, default=1_000_000, help="Size of the generated dataset")
+        parser.add_argument("--chunk-size", dest="chunk_size", type=int, default=10_000)
+        parser.add_argument(
+            "--iterators", dest="iterators", nargs="+", choices=ITERATORS.keys(), default=list(ITERATORS.keys())
+        )
+
+    def generate_rows(self, rows, batch_size=10_000):
+        self.stdout.write(f"Generating {rows} rows...")
+        for start in range(0, rows, batch_size):
+            PoleEmploiApproval.objects.bulk_create(
+                [
+                    PoleEmploiApproval(
+                        pe_structure_code="00000",
+                        number=f"{NUMBER_PREFIX}{i:07d}",
+                        pole_emploi_id=f"{i:08d}",
+                        first_name="PRENOM",
+                        last_name="NOM",
+                        birth_name="NOM",
+                    )
+                    for i in range(start, min(start + batch_size, rows))
+                ]
+            )
+
+    def handle(self, rows, chunk_size, iterators, **options):
+        if settings.ITOU_ENVIRONMENT == "PROD":
+            raise CommandError("This benchmark must not run in production.")
+
+        with transaction.atomic():
+            self.generate_rows(rows)
+
+            for size in [rows // 4, rows // 2, rows]:
+                queryset = PoleEmploiApproval.objects.filter(
+                    number__startswith=NUMBER_PREFIX, number__lt=f"{NUMBER_PREFIX}{size:07d}"
+                )
+                for name in iterators:
+                    start = time.perf_counter()
+                    count = sum(1 for _ in ITERATORS[name](queryset, chunk_size))
+                    duration = time.perf_counter() - start
+                    assert count == size
+                    self.stdout.write(
+                        f"{name:>20} | {size:>9} rows | {duration:8.2f} s | {duration / size * 1_000_000:6.2f} µs/row"
+                    )
+
+            transaction.set_rollback(True)
@@ -0,0 +1,35 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="GeocodingResult",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("address", models.TextField(verbose_name="Adresse normalisée")),
+                ("post_code", models.CharField(blank=True, max_length=255, verbose_name="Code postal")),
+                ("data", models.JSONField(null=True, verbose_name="Résultat du géocodage")),
+                (
+                    "created_at",
+                    models.DateTimeField(default=django.utils.timezone.now, verbose_name="Date de création"),
+                ),
+            ],
+            options={
+                "verbose_name": "Résultat de géocodage",
+                "verbose_name_plural": "Résultats de géocodage",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="geocodingresult",
+            constraint=models.UniqueConstraint(
+                fields=("address", "post_code"), name="unique_geocoding_result_address"
+            ),
+        ),
+    ]
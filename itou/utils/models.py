@@ -1,5 +1,7 @@
 from django.contrib.postgres.fields import DateRangeField
+from django.db import models
 from django.db.models import Func
+from django.utils import timezone
 
 
 class DateRange(Func):
@@ -13,3 +15,24 @@ class DateRange(Func):
 
     function = "daterange"
     output_field = DateRangeField()
+
+
+class GeocodingResult(models.Model):
+    """
+    Persistent cache of the BAN geocoding API, see `itou.utils.apis.geocoding`.
+
+    Keyed by normalized address and post code. `data` is the feature returned by the API,
+    or None when no result was found (negative caching).
+    """
+
+    address = models.TextField(verbose_name="Adresse normalisée")
+    post_code = models.CharField(verbose_name="Code postal", max_length=255, blank=True)
+    data = models.JSONField(verbose_name="Résultat du géocodage", null=True)
+    created_at = models.DateTimeField(verbose_name="Date de création", default=timezone.now)
+
+    class Meta:
+        verbose_name = "Résultat de géocodage"
+        verbose_name_plural = "Résultats de géocodage"
+        constraints = [
+            models.UniqueConstraint(fields=["address", "post_code"], name="unique_geocoding_result_address"),
+        ]
@@ -13,18 +13,26 @@ from django.core.mail.message import EmailMessage
 from django.http import HttpResponse
 from django.template import Context, Template
 from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.utils import timezone
 from factory import Faker
 
 from itou.common_apps.resume.forms import ResumeFormMixin
 from itou.institutions.factories import InstitutionFactory, InstitutionWithMembershipFactory
 from itou.job_applications.factories import JobApplicationFactory, JobApplicationWithApprovalFactory
+from itou.job_applications.models import JobApplication
 from itou.prescribers.factories import PrescriberOrganizationWithMembershipFactory
 from itou.siaes.factories import SiaeFactory, SiaeWithMembershipFactory
 from itou.siaes.models import Siae, SiaeMembership
 from itou.users.factories import JobSeekerFactory, PrescriberFactory
 from itou.users.models import User
-from itou.utils.apis.api_entreprise import etablissement_get_or_error
-from itou.utils.apis.geocoding import process_geocoding_data
+from itou.utils.apis import esd
+from itou.utils.apis.api_entreprise import etablissement_get_or_error, etablissements_get_or_error
+from itou.utils.apis.geocoding import (
+    GeocodingError,
+    get_geocoding_data,
+    get_geocoding_data_many,
+    process_geocoding_data,
+)
 from itou.utils.apis.pole_emploi import (
     POLE_EMPLOI_PASS_APPROVED,
     POLE_EMPLOI_PASS_REFUSED,
@@ -33,7 +41,9 @@ from itou.utils.apis.pole_emploi import (
     mise_a_jour_pass_iae,
     recherche_individu_certifie_api,
 )
+from itou.utils.apis.rate_limit import TokenBucket
 from itou.utils.emails import sanitize_mailjet_recipients
+from itou.utils.iterators import queryset_chunks, queryset_iterator
 from itou.utils.mocks.api_entreprise import ETABLISSEMENT_API_RESULT_MOCK
 from itou.utils.mocks.geocoding import BAN_GEOCODING_API_RESULT_MOCK
 from itou.utils.mocks.pole_emploi import (
@@ -42,6 +52,7 @@ from itou.utils.mocks.pole_emploi import (
     POLE_EMPLOI_RECHERCHE_INDIVIDU_CERTIFIE_API_RESULT_ERROR_MOCK,
     POLE_EMPLOI_RECHERCHE_INDIVIDU_CERTIFIE_API_RESULT_KNOWN_MOCK,
 )
+from itou.utils.models import GeocodingResult
 from itou.utils.password_validation import CnilCompositionPasswordValidator
 from itou.utils.perms.context_processors import get_current_organization_and_perms
 from itou.utils.perms.user import KIND_JOB_SEEKER, KIND_PRESCRIBER, KIND_SIAE_STAFF, get_user_info
@@ -292,6 +303,76 @@ class UtilsGeocodingTest(TestCase):
         }
         self.assertEqual(result, expected)
 
+    @mock.patch("itou.utils.apis.geocoding.call_ban_geocoding_api", return_value=BAN_GEOCODING_API_RESULT_MOCK)
+    def test_get_geocoding_data_cache(self, mock_call_ban_geocoding_api):
+        result = get_geocoding_data("10 PL 5 MARTYRS LYCEE BUFFON", post_code="75015")
+        self.assertEqual(result["insee_code"], "75115")
+        mock_call_ban_geocoding_api.assert_called_once()
+        self.assertEqual(GeocodingResult.objects.count(), 1)
+
+        # Same address once normalized.
+        result = get_geocoding_data("  10 pl 5  martyrs lycée buffon ", post_code="75015")
+        self.assertEqual(result["insee_code"], "75115")
+        mock_call_ban_geocoding_api.assert_called_once()
+
+        # Expired.
+        GeocodingResult.objects.update(
+            created_at=timezone.now() - datetime.timedelta(days=settings.API_BAN_CACHE_TTL_DAYS + 1)
+        )
+        get_geocoding_data("10 PL 5 MARTYRS LYCEE BUFFON", post_code="75015")
+        self.assertEqual(mock_call_ban_geocoding_api.call_count, 2)
+        self.assertEqual(GeocodingResult.objects.count(), 1)
+
+    @mock.patch("itou.utils.apis.geocoding.call_ban_geocoding_api", return_value=None)
+    def test_get_geocoding_data_negative_cache(self, mock_call_ban_geocoding_api):
+        self.assertIsNone(get_geocoding_data("nowhere", post_code="75015"))
+        self.assertIsNone(get_geocoding_data("nowhere", post_code="75015"))
+        mock_call_ban_geocoding_api.assert_called_once()
+        self.assertIsNone(GeocodingResult.objects.get().data)
+
+        # Negative results expire sooner.
+        GeocodingResult.objects.update(
+            created_at=timezone.now() - datetime.timedelta(days=settings.API_BAN_CACHE_NEGATIVE_TTL_DAYS + 1)
+        )
+        self.assertIsNone(get_geocoding_data("nowhere", post_code="75015"))
+        self.assertEqual(mock_call_ban_geocoding_api.call_count, 2)
+
+    @mock.patch("itou.utils.apis.geocoding.call_ban_geocoding_api", side_effect=GeocodingError)
+    def test_get_geocoding_data_error(self, mock_call_ban_geocoding_api):
+        self.assertIsNone(get_geocoding_data("10 PL 5 MARTYRS LYCEE BUFFON", post_code="75015"))
+        # Errors are not cached.
+        self.assertFalse(GeocodingResult.objects.exists())
+
+    @respx.mock
+    def test_get_geocoding_data_many(self):
+        csv_result = (
+            "q,postcode,latitude,longitude,result_label,result_score,result_type,result_id,result_housenumber,"
+            "result_name,result_street,result_postcode,result_city,result_context,result_citycode\r\n"
+            "10 pl 5 martyrs lycee buffon,75015,48.838411,2.316754,10 Pl des Cinq Martyrs du Lycee Buffon 75015 Paris,"
+            "0.587663373207207,housenumber,75115_2048_00010,10,10 Pl des Cinq Martyrs du Lycee Buffon,"
+            'Pl des Cinq Martyrs du Lycee Buffon,75015,Paris,"75, Paris, Île-de-France",75115\r\n'
+            "nowhere,75015,,,,,,,,,,,,,\r\n"
+        )
+        route = respx.post(f"{settings.API_BAN_BASE_URL}/search/csv/").mock(
+            return_value=httpx.Response(200, text=csv_result)
+        )
+        addresses = [("10 PL 5 MARTYRS LYCEE BUFFON", "75015"), ("nowhere", "75015")]
+
+        with mock.patch("itou.utils.apis.geocoding.call_ban_geocoding_api") as mock_call_ban_geocoding_api:
+            results = get_geocoding_data_many(addresses)
+            # Cached results are shared with single lookups.
+            self.assertEqual(get_geocoding_data(*addresses[0]), results[addresses[0]])
+            mock_call_ban_geocoding_api.assert_not_called()
+
+        self.assertEqual(route.call_count, 1)
+        self.assertEqual(results[addresses[0]], process_geocoding_data(BAN_GEOCODING_API_RESULT_MOCK))
+        self.assertIsNone(results[addresses[1]])
+        self.assertEqual(GeocodingResult.objects.count(), 2)
+
+        # Everything is served from cache.
+        self.assertEqual(get_geocoding_data_many(addresses), results)
+        self.assertEqual(route.call_count, 1)
+
 
 class UtilsValidatorsTest(TestCase):
     def test_validate_alphanumeric(self):
@@ -719,6 +800,71 @@ class ApiEntrepriseTest(SimpleTestCase):
         self.assertFalse(etablissement.is_closed)
         self.assertTrue(etablissement.is_head_office)
 
+    @respx.mock
+    def test_etablissements_api(self):
+        sirets = ["26570134200148", "26570134200149", "26570134200150"]
+        respx.get(f"{settings.API_ENTREPRISE_BASE_URL}/etablissements/{sirets[0]}").mock(
+            return_value=httpx.Response(200, json=ETABLISSEMENT_API_RESULT_MOCK)
+        )
+        respx.get(f"{settings.API_ENTREPRISE_BASE_URL}/etablissements/{sirets[1]}").mock(
+            return_value=httpx.Response(422)
+        )
+        respx.get(f"{settings.API_ENTREPRISE_BASE_URL}/etablissements/{sirets[2]}").mock(
+            side_effect=httpx.ConnectError
+        )
+
+        results = list(etablissements_get_or_error(sirets, max_workers=2))
+
+        self.assertEqual([siret for siret, _, _ in results], sirets)
+        self.assertEqual(results[0][1].name, "CENTRE COMMUNAL D'ACTION SOCIALE")
+        self.assertIsNone(results[0][2])
+        self.assertEqual(results[1][1:], (None, "SIRET « 26570134200149 » non reconnu."))
+        self.assertEqual(results[2][1:], (None, "Problème de connexion à la base Sirene. Essayez ultérieurement."))
+
+
+class TokenBucketTest(SimpleTestCase):
+    def test_acquire(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        with mock.patch("itou.utils.apis.rate_limit.time.sleep") as sleep:
+            # Within capacity
+            bucket.acquire()
+            bucket.acquire()
+            sleep.assert_not_called()
+            # Then at the given rate
+            bucket.acquire()
+            bucket.acquire()
+        self.assertEqual(sleep.call_count, 2)
+        self.assertAlmostEqual(sleep.call_args_list[0].args[0], 0.1, places=2)
+        self.assertAlmostEqual(sleep.call_args_list[1].args[0], 0.2, places=2)
+
+
+class EsdTokenTest(SimpleTestCase):
+    def setUp(self):
+        esd.TOKENS_CACHE.clear()
+        self.addCleanup(esd.TOKENS_CACHE.clear)
+
+    @respx.mock
+    def test_get_access_token(self):
+        route = respx.post(f"{settings.API_ESD_AUTH_BASE_URL}/connexion/oauth2/access_token").mock(
+            return_value=httpx.Response(200, json={"token_type": "Bearer", "access_token": "abc", "expires_in": 1500})
+        )
+        self.assertEqual(esd.get_access_token("some_scope"), "Bearer abc")
+        self.assertEqual(esd.get_access_token("some_scope"), "Bearer abc")
+        self.assertEqual(route.call_count, 1)
+
+        # Other scopes need other tokens.
+        esd.get_access_token("other_scope")
+        self.assertEqual(route.call_count, 2)
+
+    @respx.mock
+    def test_get_access_token_about_to_expire(self):
+        route = respx.post(f"{settings.API_ESD_AUTH_BASE_URL}/connexion/oauth2/access_token").mock(
+            return_value=httpx.Response(200, json={"token_type": "Bearer", "access_token": "abc", "expires_in": 30})
+        )
+        esd.get_access_token("some_scope")
+        esd.get_access_token("some_scope")
+        self.assertEqual(route.call_count, 2)
+
 
 class PoleEmploiTest(TestCase):
     """All the test cases around function recherche_individu_certifie_api and mise_a_jour_pass_iae"""
@@ -756,6 +902,14 @@ class PoleEmploiTest(TestCase):
             individu_result = recherche_individu_certifie_api(individual, "broken_token")
             self.assertIsNone(individu_result)
 
+    @mock.patch("httpx.post", side_effect=httpx.ConnectTimeout("timeout"))
+    def test_recherche_individu_certifie_timeout(self, mock_post):
+        individual = PoleEmploiIndividu("EVARISTE", "GALOIS", datetime.date(1979, 6, 3), "152062441001270")
+        with self.assertRaises(PoleEmploiMiseAJourPassIAEException) as cm:
+            recherche_individu_certifie_api(individual, "some_valid_token")
+        self.assertIsNone(cm.exception.http_code)
+        self.assertEqual(cm.exception.response_code, "ConnectTimeout")
+
     @mock.patch(
         "httpx.post",
         return_value=httpx.Response(200, json=POLE_EMPLOI_MISE_A_JOUR_PASS_API_RESULT_OK_MOCK),
@@ -872,3 +1026,40 @@ class ResumeFormMixinTest(TestCase):
         form = ResumeFormMixin(data={"resume_link": resume_link})
         self.assertTrue(form.is_valid())
         self.assertFalse(form.has_error("resume_link"))
+
+
+class QuerysetIteratorsTest(TestCase):
+    def test_queryset_chunks(self):
+        job_applications = JobApplicationFactory.create_batch(5)
+        expected = sorted(job_applications, key=lambda ja: ja.pk)
+
+        chunks = list(queryset_chunks(JobApplication.objects.all(), chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual([ja for chunk in chunks for ja in chunk], expected)
+
+        # An exact multiple of the chunk size does not yield an empty chunk.
+        chunks = list(queryset_chunks(JobApplication.objects.all(), chunk_size=5))
+        self.assertEqual([len(chunk) for chunk in chunks], [5])
+
+        self.assertEqual(list(queryset_chunks(JobApplication.objects.none(), chunk_size=2)), [])
+
+    def test_queryset_chunks_with_ordering_on_duplicate_values(self):
+        created_at = timezone.now()
+        job_applications = JobApplicationFactory.create_batch(3, created_at=created_at)
+        job_applications += JobApplicationFactory.create_batch(2, created_at=created_at - datetime.timedelta(days=1))
+        expected = sorted(job_applications, key=lambda ja: (-ja.created_at.timestamp(), ja.pk))
+
+        chunks = queryset_chunks(JobApplication.objects.all(), chunk_size=2, ordering=("-created_at", "pk"))
+        self.assertEqual([ja for chunk in chunks for ja in chunk], expected)
+
+    def test_queryset_iterator(self):
+        job_applications = JobApplicationFactory.create_batch(3)
+        expected = sorted(job_applications, key=lambda ja: ja.pk)
+
+        # Server-side cursor.
+        self.assertEqual(list(queryset_iterator(JobApplication.objects, chunk_size=2)), expected)
+
+        # Keyset pagination honoring prefetches.
+        with self.assertNumQueries(4):
+            result = list(queryset_iterator(JobApplication.objects.prefetch_related("selected_jobs"), chunk_size=2))
+        self.assertEqual(result, expected)
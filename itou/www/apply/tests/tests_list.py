@@ -513,6 +513,9 @@ class ProcessListExportsDownloadSiaeTest(ProcessListTest):
 
         self.assertEqual(200, response.status_code)
         self.assertIn("text/csv", response.get("Content-Type"))
+        # The export is streamed.
+        content = b"".join(response.streaming_content).decode()
+        self.assertTrue(content.startswith('"Nom candidat"'))
 
     def test_list_for_prescriber_exports_download_view(self):
         """
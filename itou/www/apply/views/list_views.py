@@ -1,9 +1,9 @@
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
 from django.utils.text import slugify
 
-from itou.job_applications.csv_export import generate_csv_export
+from itou.job_applications.csv_export import iter_csv_export
 from itou.utils.pagination import pager
 from itou.utils.perms.prescriber import get_all_available_job_applications_as_prescriber
 from itou.utils.perms.siae import get_current_siae_or_404
@@ -87,11 +87,10 @@ def list_for_prescriber_exports_download(request, month_identifier):
 
     filename = f"candidatures-{month_identifier}.csv"
 
-    response = HttpResponse(content_type="text/csv", charset="utf-8")
+    # Streamed: the download starts immediately, whatever the number of job applications.
+    response = StreamingHttpResponse(iter_csv_export(job_applications), content_type="text/csv", charset="utf-8")
     response["Content-Disposition"] = 'attachment; filename="{}"'.format(filename)
 
-    generate_csv_export(job_applications, response)
-
     return response
 
 
@@ -150,9 +149,8 @@ def list_for_siae_exports_download(request, month_identifier):
     job_applications = job_applications.created_on_given_year_and_month(year, month).with_list_related_data()
     filename = f"candidatures-{slugify(siae.display_name)}-{month_identifier}.csv"
 
-    response = HttpResponse(content_type="text/csv", charset="utf-8")
+    # Streamed: the download starts immediately, whatever the number of job applications.
+    response = StreamingHttpResponse(iter_csv_export(job_applications), content_type="text/csv", charset="utf-8")
     response["Content-Disposition"] = 'attachment; filename="{}"'.format(filename)
 
-    generate_csv_export(job_applications, response)
-
     return response
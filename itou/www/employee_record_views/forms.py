@@ -3,7 +3,8 @@ from django.core.validators import MinLengthValidator, RegexValidator
 from django.urls import reverse_lazy
 from django.utils import timezone
 
-from itou.asp.models import Commune, RSAAllocation
+from itou.asp.cache import referentials
+from itou.asp.models import RSAAllocation
 from itou.employee_record.models import EmployeeRecord
 from itou.siaes.models import SiaeFinancialAnnex
 from itou.users.models import JobSeekerProfile, User
@@ -104,7 +105,7 @@ class NewEmployeeRecordStep1Form(forms.ModelForm):
 
         # Here we must add coherence between birthdate and communes
         # existing at this period (not a simple check of existence)
-        birth_place = Commune.objects.by_insee_code_and_period(commune_code, birth_date).first()
+        birth_place = referentials.get_commune(commune_code, birth_date)
 
         self.cleaned_data["birth_place"] = birth_place
 
@@ -186,7 +187,7 @@ class NewEmployeeRecordStep2Form(forms.ModelForm):
             raise forms.ValidationError("Le code postal ne correspond pas à la commune")
 
         if commune_code:
-            commune = Commune.objects.current().by_insee_code(commune_code).first()
+            commune = referentials.get_commune(commune_code)
             self.cleaned_data["hexa_commune"] = commune
 
     class Meta:
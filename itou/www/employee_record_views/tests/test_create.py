@@ -2,6 +2,7 @@ from unittest import mock
 
 from django.test import TestCase
 from django.urls import reverse
+from huey.contrib.djhuey import HUEY
 
 from itou.asp.models import Commune, Country
 from itou.employee_record.models import EmployeeRecord
@@ -50,6 +51,10 @@ class AbstractCreateEmployeeRecordTest(TestCase):
         )
         self.job_seeker = self.job_application.job_seeker
 
+        # Step 1 asks huey to convert the HEXA address of the job seeker: run it right away.
+        HUEY.immediate = True
+        self.addCleanup(setattr, HUEY, "immediate", False)
+
     def login_response(self):
         self.client.login(username=self.user.username, password=DEFAULT_PASSWORD)
         return self.client.get(self.url)
@@ -9,6 +9,7 @@ from django.urls import reverse
 from django.utils.encoding import escape_uri_path
 
 from itou.employee_record.models import EmployeeRecord
+from itou.employee_record.tasks import huey_update_hexa_address
 from itou.job_applications.models import JobApplication
 from itou.users.models import JobSeekerProfile
 from itou.utils.pagination import pager
@@ -151,12 +152,10 @@ def create(request, job_application_id, template_name="employee_record/create.ht
         employee = job_application.job_seeker
         profile, _ = JobSeekerProfile.objects.get_or_create(user=employee)
 
-        # Try a geo lookup of the address every time we call this form
-        try:
-            profile.update_hexa_address()
-        except ValidationError:
-            # cleanup address
-            profile.clear_hexa_address()
+        # The HEXA address is converted ahead of time by huey workers: only ask for the conversion
+        # of an address that was missed (or has changed) without waiting for it.
+        if not profile.hexa_address_is_up_to_date:
+            huey_update_hexa_address(profile.pk)
 
         return HttpResponseRedirect(reverse("employee_record_views:create_step_2", args=(job_application.id,)))
 
@@ -197,6 +196,7 @@ def create_step_2(request, job_application_id, template_name="employee_record/cr
 
     if request.method == "POST" and form.is_valid():
         form.save()
+        profile.set_hexa_address_entered_by_hand()
 
         # Retry until we're good
         return HttpResponseRedirect(
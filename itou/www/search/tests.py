@@ -7,7 +7,7 @@ from itou.cities.models import City
 from itou.job_applications.factories import JobApplicationFactory
 from itou.prescribers.factories import AuthorizedPrescriberOrganizationFactory
 from itou.siaes.factories import SiaeFactory, SiaeWithJobsFactory
-from itou.siaes.models import Siae
+from itou.siaes.models import Siae, SiaeSearchIndex
 
 
 class SearchSiaeTest(TestCase):
@@ -25,6 +25,7 @@ class SearchSiaeTest(TestCase):
         )
         siae_1 = SiaeFactory(department="75", coords=paris_city.coords, post_code="75001")
         SiaeFactory(department="75", coords=paris_city.coords, post_code="75002")
+        SiaeSearchIndex.objects.refresh()
 
         # Filter on city
         response = self.client.get(self.url, {"city": city_slug})
@@ -41,6 +42,7 @@ class SearchSiaeTest(TestCase):
     def test_kind(self):
         city = create_city_saint_andre()
         SiaeFactory(department="44", coords=city.coords, post_code="44117", kind=Siae.KIND_AI)
+        SiaeSearchIndex.objects.refresh()
 
         response = self.client.get(self.url, {"city": city.slug, "kinds": [Siae.KIND_AI]})
         self.assertContains(response, "<b>1</b> résultat")
@@ -62,6 +64,7 @@ class SearchSiaeTest(TestCase):
         SiaeFactory(
             name=SIAE_SAINT_ANDRE, department="44", coords=saint_andre.coords, post_code="44117", kind=Siae.KIND_AI
         )
+        SiaeSearchIndex.objects.refresh()
 
         # 100 km
         response = self.client.get(self.url, {"city": guerande.slug, "distance": 100})
@@ -87,6 +90,21 @@ class SearchSiaeTest(TestCase):
         self.assertContains(response, "<b>1</b> résultat")
         self.assertContains(response, SIAE_VANNES.capitalize())
 
+    def test_inactive_siae(self):
+        city = create_city_saint_andre()
+        siae = SiaeFactory(department="44", coords=city.coords, post_code="44117", kind=Siae.KIND_AI)
+        SiaeSearchIndex.objects.refresh()
+
+        response = self.client.get(self.url, {"city": city.slug})
+        self.assertContains(response, "<b>1</b> résultat")
+
+        siae.convention.is_active = False
+        siae.convention.save()
+        SiaeSearchIndex.objects.refresh()
+
+        response = self.client.get(self.url, {"city": city.slug})
+        self.assertContains(response, "Aucun résultat")
+
     def test_order_by(self):
         """
         Check SIAE results sorting.
@@ -123,6 +141,7 @@ class SearchSiaeTest(TestCase):
         siae = SiaeFactory(department="44", coords=guerande.coords, post_code="44350", block_job_applications=True)
         created_siaes.append(siae)
 
+        SiaeSearchIndex.objects.refresh()
         response = self.client.get(self.url, {"city": guerande.slug})
         siaes_results = response.context["siaes_page"]
 
@@ -1,11 +1,12 @@
 from collections import defaultdict
 
 from django.contrib.gis.db.models.functions import Distance
+from django.db.models import Count
 from django.shortcuts import render
 
 from itou.common_apps.address.departments import DEPARTMENTS_WITH_DISTRICTS
 from itou.prescribers.models import PrescriberOrganization
-from itou.siaes.models import Siae
+from itou.siaes.models import Siae, SiaeSearchIndex
 from itou.utils.pagination import pager
 from itou.www.search.forms import PrescriberSearchForm, SiaeSearchForm
 
@@ -27,21 +28,21 @@ def search_siaes_results(request, template_name="search/siaes_search_results.htm
         distance = form.cleaned_data["distance"]
 
         # Step 1 - Initial query
-        siaes_step_1 = Siae.objects.active().within(city.coords, distance)
+        # Search data is denormalized in `SiaeSearchIndex` so that a single indexed query is needed.
+        siaes_step_1 = SiaeSearchIndex.objects.filter(is_active=True).within(city.coords, distance)
 
         # Step 2
         # Extract departments from results to inject them as filters
-        # The DB contains around 4k SIAE (always fast in Python and no need of iterator())
         departments = set()
         departments_districts = defaultdict(set)
-        for siae in siaes_step_1:
-            # Extract the department of SIAE
-            if siae.department:
-                departments.add(siae.department)
-                # Extract the post_code if it's a district to use it as criteria
-                if siae.department in DEPARTMENTS_WITH_DISTRICTS:
-                    if int(siae.post_code) <= DEPARTMENTS_WITH_DISTRICTS[siae.department]["max"]:
-                        departments_districts[siae.department].add(siae.post_code)
+        facets = siaes_step_1.exclude(department="").values("department", "post_code").annotate(Count("pk"))
+        for facet in facets.order_by():
+            department, post_code = facet["department"], facet["post_code"]
+            departments.add(department)
+            # Extract the post_code if it's a district to use it as criteria
+            if department in DEPARTMENTS_WITH_DISTRICTS:
+                if int(post_code) <= DEPARTMENTS_WITH_DISTRICTS[department]["max"]:
+                    departments_districts[department].add(post_code)
 
         if departments:
             departments = sorted(departments)
@@ -59,10 +60,21 @@ def search_siaes_results(request, template_name="search/siaes_search_results.htm
         for department_with_district in DEPARTMENTS_WITH_DISTRICTS:
             districts += request.GET.getlist(f"districts_{department_with_district}")
 
+        search_indexes = siaes_step_1
+        if kinds:
+            search_indexes = search_indexes.filter(kind__in=kinds)
+
+        if departments:
+            search_indexes = search_indexes.filter(department__in=departments)
+
+        if districts:
+            search_indexes = search_indexes.filter(post_code__in=districts)
+
         siaes = (
-            siaes_step_1
+            Siae.objects.all()
+            .filter(search_index__in=search_indexes)
             # Convert km to m (injected in SQL query)
-            .annotate(distance=Distance("coords", city.coords) / 1000)
+            .annotate(distance=Distance("search_index__coords", city.coords) / 1000)
             .prefetch_job_description_through()
             # For sorting let's put siaes in only 2 buckets (boolean has_active_members).
             # If we sort naively by `-_total_active_members` we would show
@@ -70,8 +82,6 @@ def search_siaes_results(request, template_name="search/siaes_search_results.htm
             # with 9 members, then siaes with 8 members etc...
             # This is clearly not what we want. We want to show siaes with members
             # (whatever the number of members is) then siaes without members.
-            .with_has_active_members()
-            .with_job_app_score()
             # Sort in 4 subgroups in the following order, each subgroup being sorted by job_app_score.
             # 1) has_active_members and not block_job_applications
             # These are the siaes which can currently hire, and should be on top.
@@ -83,16 +93,12 @@ def search_siaes_results(request, template_name="search/siaes_search_results.htm
             # 4) not has_active_members and block_job_applications
             # This group is supposed to be empty. But itou staff may have
             # detached members from their siae so it could still happen.
-            .order_by("-has_active_members", "block_job_applications", "job_app_score")
+            .order_by(
+                "-search_index__has_active_members",
+                "search_index__block_job_applications",
+                "search_index__job_app_score",
+            )
         )
-        if kinds:
-            siaes = siaes.filter(kind__in=kinds)
-
-        if departments:
-            siaes = siaes.filter(department__in=departments)
-
-        if districts:
-            siaes = siaes.filter(post_code__in=districts)
 
         siaes_page = pager(siaes, request.GET.get("page"), items_per_page=10)
 